@@ -9,33 +9,38 @@
 # Uses 2Dex hall sensor and Trinamic TMCM-1060 or TMCM-1160 motor.
 # Requires Python 3.6 or later.
 #
+# The field may be measured point by point, or by sweeping the sensor out
+# and back at a low speed and recording the streamed readings, followed by
+# point measurements where the field curves most (see fieldSweep.py).
+#
+# The motor library is imported when a fieldMap is created, and the
+# plotting and fitting modules (matplotlib, SciPy) only when the results are
+# plotted, so that this module can be imported without them.
 #
 
 import sensorShield
-import PyTrinamic
-from PyTrinamic.connections.serial_tmcl_interface import serial_tmcl_interface
-from PyTrinamic.modules.TMCM_1160 import TMCM_1160
+import fieldSweep
 import time
 import numpy as np
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from scipy import optimize
 import sys, os
-import serial.tools.list_ports as list_ports
 
-matplotlib.use('TkAgg')
+# Field map lookups are shared with the TopSpin scripts
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TopSpin', 'Python'))
+import fieldMapTable
+import deviceManager
 
 class fieldMap(object):
 
     def __init__(self):
+        import PyTrinamic
+        from PyTrinamic.connections.serial_tmcl_interface import serial_tmcl_interface
+        from PyTrinamic.modules.TMCM_1160 import TMCM_1160
+        
          # Open communications with sensor Arduino board and motor
-        for device in list_ports.comports():
-            if device.description == 'Trinamic Stepper Device':
-                motorPort = device.device
         self.sens = sensorShield.sensorShield()
+        self.sens.start()
         try:
-            myInterface = serial_tmcl_interface(motorPort)
+            myInterface = deviceManager.openWith('motor', serial_tmcl_interface)
             self.module = TMCM_1160(myInterface)
         except:
             print('Motor device not found')
@@ -72,33 +77,49 @@ class fieldMap(object):
         self.module.setTargetSpeed(speedPPS)
         
         # Get parameters
-        points = int(input("Number of points to use in generating field map: "))
         self.maxHeight = float(input("Maximum height to measure: "))
-        spacing = input("Use logarithmic (log) or linear (lin) spacing? ")
+        method = input("Measure point by point (step) or in a continuous sweep (sweep)? ")
+        if method.lower() == 'sweep':
+            self.module.setMaxVelocity(speedPPS)
+            resolution = float(input("Spacing of field map points (cm): "))
+            tolerance = float(input("Maximum interpolation error for refinement (mT): "))
+            self.recordSweep(NStep, Circ, speed, resolution, tolerance)
+        elif method.lower() == 'step':
+            points = int(input("Number of points to use in generating field map: "))
+            spacing = input("Use logarithmic (log) or linear (lin) spacing? ")
+            
         
+            # Calculate number of steps
+            if spacing.lower() == 'lin':
+                self.distance = np.linspace(0,self.maxHeight,points,dtype=float)
+            elif spacing.lower() == 'log':
+                self.distance = np.geomspace(1,self.maxHeight,points,dtype=float)
+            else:
+                print("Spacing must be either 'LOG' or 'LIN'")
+                return
+            print("\n")    
+            self.fieldStrength=[]
     
-        # Calculate number of steps
-        if spacing == 'lin' or 'LIN':
-            self.distance = np.linspace(0,self.maxHeight,points,dtype=float)
-        elif spacing == 'log' or 'LOG':
-            self.distance = np.geomspace(1,self.maxHeight,points,dtype=float)
+            # Set motor to home position
+            self.moveToPosition(0)
+            
+            # record field strength at different distances
+            for x in self.distance:
+                steps = int(-(x*NStep)/Circ)
+                field = self.recordField(steps)
+                self.fieldStrength.append(field)
+                print('Distance: ' + str(round(x,1)) + 'cm, Field strength: ' + str(field) + 'mT')
+            print("\n")   
         else:
-            print("Spacing must be either 'LOG' or 'LIN'")
+            print("Method must be either 'step' or 'sweep'")
             return
-        print("\n")    
-        self.fieldStrength=[]
 
-        # Set motor to home position
-        self.module.moveToPosition(0)
-        time.sleep(5)
-        
-        # record field strength at different distances
-        for x in self.distance:
-            steps = int(-(x*NStep)/Circ)
-            field = self.recordField(steps)
-            self.fieldStrength.append(field)
-            print('Distance: ' + str(round(x,1)) + 'cm, Field strength: ' + str(field) + 'mT')
-        print("\n")   
+        # Check that the field map can be used by the shuttle
+        try:
+            self.table = fieldMapTable.fieldMapTable(self.distance, self.fieldStrength, method='pchip')
+        except ValueError as err:
+            self.table = None
+            print('WARNING: ' + str(err))
 
         # Plot and fit the results
         self.plot()
@@ -111,41 +132,116 @@ class fieldMap(object):
         
         # Save data
         saveData = input("Save data (Y/N)? ")
-        if saveData == 'y' or 'Y':
+        if saveData.lower() == 'y':
             fileName = os.getcwd() + '/fieldMap.csv'
             np.savetxt(fileName,data,delimiter=',',newline='\n',header="Position (cm), Field Strength (mT)")
         
             
+    def moveToPosition(self, steps, timeout=120):
+        # Move motor to position and wait until it gets there
+        self.module.moveToPosition(steps)
+        end = time.monotonic() + timeout
+        while self.module.actualPosition() != steps:
+            if time.monotonic() > end:
+                print('Motor did not reach position')
+                sys.exit()
+            time.sleep(0.05)
+    
+    
     def recordField(self,steps):
         # Move motor to position
-        self.module.moveToPosition(steps)
-        
-        time.sleep(1)
+        self.moveToPosition(steps)
         
-        # Suppress printing output from sensorShield
-        original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, 'w')
+        # Save field strength reading from 2Dex sensor, measured after the
+        # move (the first reading may have been started during the move)
+        for i in range(2):
+            record = self.sens.waitForRecord()
+            if record is None:
+                print('No data from sensors')
+                sys.exit()
+        field = self.sens.hallSens
 
-        # Save field strength reading from 2Dex sensor
-        self.sens.clearBuffer()
+        return field
+    
+    
+    def sweep(self, steps, timeout):
+        # Move motor to position, polling its position. Returns the sensor
+        # readings (times, field strengths) and the motor positions (times,
+        # distances), all timed with time.monotonic().
+        index = self.sens.buffer.count
+        times = []
+        positions = []
+        self.module.moveToPosition(steps)
+        end = time.monotonic() + timeout
         while True:
-            line = self.sens.readSensors()
-            if line != None and len(line) > 25:
-                field = self.sens.hallSens
+            before = time.monotonic()
+            position = self.module.actualPosition()
+            times.append(0.5 * (before + time.monotonic()))
+            positions.append(-position * self.Circ / self.NStep)
+            if position == steps:
                 break
-
-        # Reable printing
-        sys.stdout.close()
-        sys.stdout = original_stdout
-        return field
+            if time.monotonic() > end:
+                print('Motor did not reach position')
+                sys.exit()
+            time.sleep(0.02)
+        
+        # Readings measured at the end of the sweep arrive a little later
+        time.sleep(1)
+        rows, index = self.sens.buffer.since(index)
+        field = 1000*((rows['hallVoltage']-self.sens.offset)/self.sens.sensitivity)
+        return rows['time'], field, np.array(times), np.array(positions)
+    
+    
+    def recordSweep(self, NStep, Circ, speed, resolution, tolerance):
+        # Sweep the sensor out to maxHeight and back at speed (cm/s), then
+        # measure extra points where the field map would be least accurate
+        self.NStep = NStep
+        self.Circ = Circ
+        timeout = 2 * self.maxHeight / speed + 60
+        
+        self.moveToPosition(0)
+        print("Sweeping out to " + str(self.maxHeight) + " cm and back (about " + str(round(2 * self.maxHeight / speed)) + " s)")
+        outward = self.sweep(int(-(self.maxHeight*NStep)/Circ), timeout)
+        back = self.sweep(0, timeout)
+        
+        # Line up the two sweeps, allowing for the delay of the readings
+        lag = fieldSweep.estimateLag(outward, back)
+        print("Sensor reading delay: " + str(round(lag,3)) + " s")
+        z, B = [], []
+        for times, field, pollTimes, positions in (outward, back):
+            zSweep, BSweep = fieldSweep.samplePositions(times - lag, field, pollTimes, positions)
+            z.append(zSweep)
+            B.append(BSweep)
+        self.distance, self.fieldStrength = fieldSweep.binMap(np.concatenate(z), np.concatenate(B), resolution)
+        print(str(len(self.distance)) + " points from " + str(sum([len(zSweep) for zSweep in z])) + " readings")
+        
+        # Refine where the gradient of dB/dz is large
+        extra = fieldSweep.refinePositions(self.distance, self.fieldStrength, tolerance, minSpacing=resolution/2)
+        print("Measuring " + str(len(extra)) + " extra points\n")
+        extraField = []
+        for x in extra:
+            field = self.recordField(int(-(x*NStep)/Circ))
+            extraField.append(field)
+            print('Distance: ' + str(round(x,2)) + 'cm, Field strength: ' + str(field) + 'mT')
+        self.distance, self.fieldStrength = fieldSweep.mergePoints(self.distance, self.fieldStrength, extra, extraField, minSpacing=resolution/2)
+        self.moveToPosition(0)
+        print("\n")
         
     
         
     def plot(self):
+        import matplotlib
+        matplotlib.use('TkAgg')
+        import matplotlib.pyplot as plt
+        from scipy import optimize
+        
         fig = plt.figure()
         ax = fig.add_subplot(1, 1, 1)
         
         ax.plot(self.distance, self.fieldStrength, 'x')
+        if self.table is not None:
+            z = np.linspace(self.distance[0], self.distance[-1], 1001)
+            ax.plot(z, self.table.fieldAt(z), label='Interpolated (PCHIP)')
         
         plt.title('Field strength vs. Distance')
         ax.set_ylabel('Field strength (mT)')
@@ -0,0 +1,110 @@
+#
+# fieldSweep.py
+# Version 1.0, Oct 2026
+#
+# Builds a field map from continuous sweeps of the Hall sensor, for
+# fieldMap.py.
+#
+# During a sweep the shuttle moves at a constant low speed while the sensor
+# Arduino streams readings (see sensorStream.py) and the motor position is
+# polled. Both are timestamped with time.monotonic(), so the position of
+# every reading is found by interpolating the polled positions at the time
+# of the reading. Readings are timestamped when they arrive rather than
+# when the field is measured, so the sensor is swept out and back, and the
+# delay (lag) which brings the two sweeps into line is found and allowed
+# for. The readings are then averaged in bins of resolution cm.
+#
+# Where the curvature of the field (the gradient of dB/dz) is large, linear
+# interpolation between neighbouring map points can be in error by up to
+# h^2 * |d2B/dz2| / 8 for spacing h. refinePositions() returns positions
+# between points where this exceeds a tolerance, to be measured with the
+# sensor stopped.
+#
+# Usage:
+#   z, B = fieldSweep.samplePositions(sampleTimes - lag, fields, pollTimes, positions)
+#   lag = fieldSweep.estimateLag(outward, back)
+#   distance, field = fieldSweep.binMap(z, B, 0.1)
+#   extra = fieldSweep.refinePositions(distance, field, tolerance=0.5)
+#
+
+import numpy as np
+
+
+def samplePositions(sampleTimes, values, pollTimes, positions):
+    # Position of each sample, interpolated from the polled positions.
+    # Samples outside the polled times are dropped. Returns (positions, values).
+    sampleTimes = np.asarray(sampleTimes, dtype=float)
+    values = np.asarray(values, dtype=float)
+    inside = (sampleTimes >= pollTimes[0]) & (sampleTimes <= pollTimes[-1])
+    return np.interp(sampleTimes[inside], pollTimes, positions), values[inside]
+
+
+def _mismatch(outward, back, lag):
+    # rms difference between the sweeps out and back with the readings moved lag s earlier
+    zOut, bOut = samplePositions(outward[0] - lag, outward[1], outward[2], outward[3])
+    zBack, bBack = samplePositions(back[0] - lag, back[1], back[2], back[3])
+    if len(zOut) < 2 or len(zBack) < 2:
+        return np.inf
+    order = np.argsort(zBack)
+    zBack, bBack = zBack[order], bBack[order]
+    overlap = (zOut >= zBack[0]) & (zOut <= zBack[-1])
+    if np.count_nonzero(overlap) < 2:
+        return np.inf
+    return float(np.sqrt(np.mean((np.interp(zOut[overlap], zBack, bBack) - bOut[overlap])**2)))
+
+
+def estimateLag(outward, back, maxLag=1.0, step=0.005):
+    # Delay (s) between measurement and timestamp of the readings which best
+    # lines up a sweep out with a sweep back. Each sweep is (sample times,
+    # values, poll times, positions).
+    lags = np.arange(0.0, maxLag + step / 2, step)
+    mismatch = [_mismatch(outward, back, lag) for lag in lags]
+    return float(lags[int(np.argmin(mismatch))])
+
+
+def binMap(z, B, resolution):
+    # Mean position and value of the samples in each bin of width
+    # resolution (cm), in order of position
+    z = np.asarray(z, dtype=float)
+    B = np.asarray(B, dtype=float)
+    bins, index = np.unique(np.round(z / resolution).astype(int), return_inverse=True)
+    counts = np.bincount(index)
+    return np.bincount(index, z) / counts, np.bincount(index, B) / counts
+
+
+def interpolationError(z, B):
+    # Largest error (mT) of linear interpolation in each interval between
+    # map points, estimated from the curvature of the field
+    z = np.asarray(z, dtype=float)
+    B = np.asarray(B, dtype=float)
+    if len(z) < 3:
+        return np.zeros(max(0, len(z) - 1))
+    curvature = np.abs(np.gradient(np.gradient(B, z), z))
+    return np.diff(z)**2 * np.maximum(curvature[:-1], curvature[1:]) / 8.0
+
+
+def refinePositions(z, B, tolerance, maxPoints=50, minSpacing=0.05):
+    # Midpoints of the intervals (at least 2 * minSpacing cm wide) where the
+    # interpolation error exceeds tolerance (mT), largest error first, at
+    # most maxPoints
+    z = np.asarray(z, dtype=float)
+    error = interpolationError(z, B)
+    candidates = np.nonzero((error > tolerance) & (np.diff(z) >= 2 * minSpacing))[0]
+    candidates = candidates[np.argsort(error[candidates])[::-1]][:maxPoints]
+    return np.sort(0.5 * (z[candidates] + z[candidates + 1]))
+
+
+def mergePoints(z, B, zExtra, BExtra, minSpacing=0.05):
+    # Add extra points (measured with the sensor stopped) to a map,
+    # replacing map points closer than minSpacing (cm) to them
+    z = np.asarray(z, dtype=float)
+    B = np.asarray(B, dtype=float)
+    zExtra = np.asarray(zExtra, dtype=float)
+    BExtra = np.asarray(BExtra, dtype=float)
+    keep = np.ones(len(z), dtype=bool)
+    for position in zExtra:
+        keep &= np.abs(z - position) >= minSpacing
+    z = np.concatenate((z[keep], zExtra))
+    B = np.concatenate((B[keep], BExtra))
+    order = np.argsort(z)
+    return z[order], B[order]
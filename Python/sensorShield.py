@@ -8,20 +8,38 @@
 # using PT100 temperature sensors and 2Dex hall sensor
 # Also includes graphical user interface.
 #
+# The sensorShield class can be imported without a display (e.g. by
+# fieldMap.py, inside TopSpin or in a service). The GUI and plotting modules
+# are only imported when the GUI is started, by running this file.
+#
 # Jul 2020
 version = 'v1.6'
 
-import tkinter as tk
-from tkinter import filedialog
-import serial, sys, time
-import datetime as dt
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.animation as animation
-import serial.tools.list_ports as list_ports
+import sys, os, time
+import sensorStream
+import numpy as np
+
+# Shared modules are in the TopSpin Python folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TopSpin', 'Python'))
+import ringBuffer
+import dataLogger
+import equilibration
+import deviceManager
+
+# Set to True when the GUI is running (error messages are then shown in a window)
+GUI = False
+
 
-matplotlib.use('TkAgg')
+def importGUI():
+    # Import the GUI and plotting modules (Tkinter and matplotlib)
+    global tk, filedialog, matplotlib, plt, FigureCanvasTkAgg, livePlot
+    import tkinter as tk
+    from tkinter import filedialog
+    import matplotlib
+    matplotlib.use('TkAgg')
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    import livePlot
 
 
 class sensorShield(object):
@@ -31,14 +49,17 @@ class sensorShield(object):
     sensitivity = 51.5
 
 
-    def __init__(self, baud=9600): 
-        # Open connection to arduino
-        for device in list_ports.comports():
-            if device.serial_number == '55739323637351819251':
-                port = device.device
+    def __init__(self, baud=9600, transport=None): 
+        self.parser = sensorStream.frameParser()
+        self.reader = None
+        # Open connection to arduino, or use transport (e.g. deviceSimulator.simulatedSensorArduino)
+        if transport is not None:
+            self.sens = transport
+            print("Using simulated sensors")
+            return
         try:
-            self.sens = serial.Serial(port, baud, timeout=0.1)
-        except:
+            self.sens = deviceManager.connect('sensors', baudrate=baud)
+        except IOError:
             print('Sensor device not found')
             if GUI == True:
                 errMsg()
@@ -49,58 +70,109 @@ class sensorShield(object):
         print(self.sens.read_all())
         
     def clearBuffer(self):
+        if self.reader is not None:
+            # Skip records already read by the reader thread
+            self.readIndex = self.buffer.count
+            return
         print(self.sens.read_all())
+        self.parser.reset()
+
+    def start(self, capacity=100000):
+        # Read sensors continuously in a background thread, keeping the last
+        # capacity records in self.buffer. Record times are then from time.monotonic().
+        self.buffer = ringBuffer.ringBuffer(capacity, sensorStream.RECORD_DTYPE)
+        self.readIndex = 0
+        self.reader = sensorStream.sensorReader(self.sens, self.buffer)
+        self.reader.start()
+
+    def stop(self):
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
         
     def readSensors(self):
-        data = None
-        buffer = self.sens.readlines()
-        for line in buffer:
-            rawData = str(line)
-            if rawData[2] == "{" and len(rawData) > 45:
-                data = rawData.strip("b'{ }\\r\\n").split(", ")
-                self.PT100_1 = float(data[0])
-                self.PT100_2 = float(data[1])
-                self.PT100_3 = float(data[2])
-                self.hallSens = round(1000*((float(data[3])-self.offset)/self.sensitivity),2)
-                self.dyneoSetTemp = round(float(data[4]),1)
-                self.dyneoActualTemp = round(float(data[5]),1)
-                data = (str(self.PT100_1) + ", " + str(self.PT100_2) + ", " + str(self.PT100_3) + ", " + str(self.hallSens)+ ", " + str(self.dyneoSetTemp)+ ", " + str(self.dyneoActualTemp))           
-            if data != None:
-                return data
-       # else:
-       #     print(rawData.strip("b'{ }\\r\\n")) 
+        # Returns latest measurement as a string, or None if no new data
+        records = self.readRecords()
+        if len(records) == 0:
+            return None
+        return ", ".join([str(value) for value in (self.PT100_1, self.PT100_2, self.PT100_3, self.hallSens, self.dyneoSetTemp, self.dyneoActualTemp)])
+
+    def readRecords(self):
+        # Returns all measurements received since the last call (sensorStream.sensorRecord)
+        if self.reader is not None:
+            rows, self.readIndex = self.buffer.since(self.readIndex)
+            records = [sensorStream.sensorRecord(*row) for row in rows.tolist()]
+        else:
+            records = self.parser.readFrom(self.sens)
+        if len(records) > 0:
+            record = records[-1]
+            self.PT100_1 = record.PT100_1
+            self.PT100_2 = record.PT100_2
+            self.PT100_3 = record.PT100_3
+            self.hallSens = round(1000*((record.hallVoltage-self.offset)/self.sensitivity),2)
+            self.dyneoSetTemp = round(record.dyneoSetTemp,1)
+            self.dyneoActualTemp = round(record.dyneoActualTemp,1)
+        return records
+
+    def waitForRecord(self, timeout=5.0):
+        # Wait for the next measurement (reader thread must be running).
+        # Returns the record, or None if there is none before timeout.
+        self.clearBuffer()
+        if not self.buffer.wait(self.readIndex, timeout):
+            return None
+        return self.readRecords()[0]
+    
+    def waitForEquilibrium(self, setpoint=None, field='PT100_1', tolerance=0.1, confidence=0.95, timeout=None, logPath=None):
+        # Wait until the temperature from sensor field has settled (see
+        # equilibration.py; reader thread must be running). Returns True if
+        # it settled before timeout.
+        detector = equilibration.equilibrationDetector(setpoint, tolerance, confidence, start=time.monotonic())
+        index = self.buffer.count
+        while not detector.ready():
+            if timeout is not None and time.monotonic() - detector.start > timeout:
+                break
+            if self.buffer.wait(index, 5.0):
+                rows, index = self.buffer.since(index)
+                detector.extend(rows['time'], rows[field])
+                detector.predict()
+        equilibration.logResult(logPath, detector.result())
+        return detector.ready()
             
+    # Column headings of the data file
+    LOG_FIELDS = ['Temperature 1 (degC)', 'Temperature 2 (degC)', 'Temperature 3 (degC)', 'Field strength (mT)',
+                  'Dyneo Set Temperature (degC)', 'Sample Temperature (degC)']
+
     def openFile(self, interval, path):
-        self.outData = open(path, 'w+')
-        self.outData.write('Timestamp' + ', ' + 'Temperature 1 (degC)' + ', ' + 'Temperature 2 (degC)' + ', ' + 'Temperature 3 (degC)' + ', ' + 'Field strength (mT)' + ',' + 'Dyneo Set Temperature (degC)' + ',' + 'Sample Temperature (degC)\n')
-        self.n = interval - 1
+        # Record every measurement to path (.csv, or .bin for binary), with a
+        # summary (mean, min, max) for every interval seconds. See dataLogger.py.
+        self.logger = dataLogger.dataLogger(path, self.LOG_FIELDS, interval=interval)
+        if self.reader is not None:
+            self.logIndex = self.buffer.count
     
     def writeData(self, interval, variables):
-        elapsedTime = time.time() - self.startTime
-        if elapsedTime >= interval:
-            print('Writing data to file...')
-            outStr = str(dt.datetime.now()) 
-            outStr += ', '
-            if variables[0] == 1:
-                outStr +=str(self.PT100_1)
-            outStr += ', '
-            if variables[1]  == 1:
-                outStr +=str(self.PT100_2)
-            outStr += ', '
-            if variables[2]  == 1:
-                outStr +=str(self.PT100_3)
-            outStr += ', '
-            if variables[3]  == 1:
-                outStr +=str(self.hallSens)
-            outStr += ', '
-            if variables[4]  == 1:
-                outStr +=str(self.dyneoSetTemp)
-            outStr += ', '
-            if variables[5]  == 1:
-                outStr +=str(self.dyneoActualTemp)
-            self.outData.write(outStr + '\n')
-            self.outData.flush()
+        # Pass new measurements to the logger, leaving unselected variables blank
+        if self.reader is not None:
+            rows, self.logIndex = self.buffer.since(self.logIndex)
+            if len(rows) == 0:
+                return
+            data = np.column_stack((rows['time'] + (time.time() - time.monotonic()),
+                                    rows['PT100_1'], rows['PT100_2'], rows['PT100_3'],
+                                    np.round(1000*((rows['hallVoltage']-self.offset)/self.sensitivity),2),
+                                    np.round(rows['dyneoSetTemp'],1), np.round(rows['dyneoActualTemp'],1)))
+        else:
+            # Without the reader thread only the latest values are available
+            if time.time() - self.startTime < interval:
+                return
             self.startTime = time.time()
+            data = np.array([[time.time(), self.PT100_1, self.PT100_2, self.PT100_3, self.hallSens, self.dyneoSetTemp, self.dyneoActualTemp]])
+        data[:,1:][:,np.array(variables) != 1] = np.nan
+        self.logger.log(data)
+
+    def closeFile(self):
+        if getattr(self, 'logger', None) is not None:
+            self.logger.close()
+            print(self.logger.summary())
+            self.logger = None
 
 
 
@@ -108,6 +180,8 @@ class sensorShield(object):
 class gui(object):
     
     def __init__(self):
+        importGUI()
+        
         # Set up sensors
         self.sens=sensorShield()
     	
@@ -254,10 +328,14 @@ class gui(object):
         # Set up plot
         self.intialisePlot()
         self.sens.clearBuffer()
+        self.sens.start()
 
         
         # Measure and update graph
-        ani = animation.FuncAnimation(self.fig, self.animate, interval=5, blit=False)
+        # (livePlot redraws the plot itself, so a plain timer is used rather than FuncAnimation)
+        self.timer = self.fig.canvas.new_timer(interval=5)
+        self.timer.add_callback(self.animate, 0)
+        self.timer.start()
         
         
         tk.mainloop()
@@ -273,61 +351,7 @@ class gui(object):
         
         self.ax1 = self.fig.add_subplot(1, 2, 1)
         self.ax2 = self.fig.add_subplot(1, 2, 2)
-        
-        # Create a blank list for each x and y dataset
-        self.xs = []
-        self.Temp1 = []
-        self.Temp2 = []
-        self.Temp3 = []
-        self.hallProbe = []
-        self.DyneoSet = []
-        self.SampleTemp = []
 
-
-    def plot(self):
-
-        # Add x and y to lists
-        self.xs.append(dt.datetime.now().strftime('%H:%M:%S'))
-        self.Temp1.append(self.sens.PT100_1)
-        self.Temp2.append(self.sens.PT100_2)
-        self.Temp3.append(self.sens.PT100_3)
-        self.hallProbe.append(self.sens.hallSens)
-        self.DyneoSet.append(self.sens.dyneoSetTemp)
-        self.SampleTemp.append(self.sens.dyneoActualTemp)
-        
-        # Limit x and y lists to number of time points set (default is around 5 min)
-        points = int(self.TimePoints.get())
-        self.xs = self.xs[-points:]
-        self.Temp1 = self.Temp1[-points:]
-        self.Temp2 = self.Temp2[-points:]
-        self.Temp3 = self.Temp3[-points:]
-        self.hallProbe = self.hallProbe[-points:]
-        self.DyneoSet = self.DyneoSet[-points:]
-        self.SampleTemp = self.SampleTemp[-points:]
-        
-        # Draw x and y lists
-        self.ax1.clear()
-        self.ax2.clear()
-        lns=[]
-        if self.PT100_1_display.get() == 1:
-            ln1 = self.ax1.plot(self.xs, self.Temp1, color='#cf81d6', label="PT100_1")
-            lns+=ln1
-        if self.PT100_2_display.get() == 1:
-            ln2 = self.ax1.plot(self.xs, self.Temp2, color='#e5ea3f', label="PT100_2")
-            lns+=ln2
-        if self.PT100_3_display.get() == 1:
-            ln3 = self.ax1.plot(self.xs, self.Temp3, color='#cb4c3b', label="PT100_3")
-            lns+=ln3
-        if self.HallSens_display.get() == 1:
-            ln4 = self.ax2.plot(self.xs, self.hallProbe, color='#4986ae', label="Hall sensor")
-            lns+=ln4
-        if self.SetTemp_display.get() == 1:
-            ln5 = self.ax1.plot(self.xs, self.DyneoSet, color='#6c49da', linestyle="dashed", label="Set temperature")
-            lns+=ln5
-        if self.SampleTemp_display.get() == 1:
-            ln6 = self.ax1.plot(self.xs, self.SampleTemp, color='#dbc2ba', linestyle="dashed", label="Sample temperature")
-            lns+=ln6
-    
         # Format plot
         self.ax1.tick_params(axis='x', rotation=90)
         self.ax1.xaxis.set_major_locator(plt.MaxNLocator(10))
@@ -338,9 +362,44 @@ class gui(object):
         self.ax2.yaxis.tick_right()
         self.ax2.yaxis.set_label_position("right")
         self.ax2.set_ylabel('Field strength (mT)')
-        
-        Temp_min, Temp_max = self.ax1.get_ylim()
-        Field_min, Field_max = self.ax2.get_ylim()
+
+        # Lines are created once and redrawn by livePlot
+        self.livePlot = livePlot.livePlot(self.fig)
+        self.livePlot.addLine(self.ax1, 'Temp1', color='#cf81d6', label="PT100_1")
+        self.livePlot.addLine(self.ax1, 'Temp2', color='#e5ea3f', label="PT100_2")
+        self.livePlot.addLine(self.ax1, 'Temp3', color='#cb4c3b', label="PT100_3")
+        self.livePlot.addLine(self.ax2, 'hallProbe', color='#4986ae', label="Hall sensor")
+        self.livePlot.addLine(self.ax1, 'DyneoSet', color='#6c49da', linestyle="dashed", label="Set temperature")
+        self.livePlot.addLine(self.ax1, 'SampleTemp', color='#dbc2ba', linestyle="dashed", label="Sample temperature")
+        self.livePlot.legend(self.ax1, loc='upper center', bbox_to_anchor=(1.1, -0.35), ncol=6)
+        
+        # History of plotted values, for the number of time points set
+        names = ['time'] + list(self.livePlot.lines)
+        self.history = ringBuffer.ringBuffer(int(self.TimePoints.get()), [(name, 'f8') for name in names])
+
+
+    def plot(self):
+
+        # Add values to history, resizing if the number of time points has changed
+        self.history.append((time.time(), self.sens.PT100_1, self.sens.PT100_2, self.sens.PT100_3,
+                             self.sens.hallSens, self.sens.dyneoSetTemp, self.sens.dyneoActualTemp))
+        points = int(self.TimePoints.get())
+        if points != self.history.capacity:
+            self.history.resize(points)
+        history = self.history.view()
+        
+        # Show selected lines
+        self.livePlot.setVisible('Temp1', self.PT100_1_display.get() == 1)
+        self.livePlot.setVisible('Temp2', self.PT100_2_display.get() == 1)
+        self.livePlot.setVisible('Temp3', self.PT100_3_display.get() == 1)
+        self.livePlot.setVisible('hallProbe', self.HallSens_display.get() == 1)
+        self.livePlot.setVisible('DyneoSet', self.SetTemp_display.get() == 1)
+        self.livePlot.setVisible('SampleTemp', self.SampleTemp_display.get() == 1)
+        series = dict([(name, history[name]) for name in self.livePlot.lines])
+        
+        # Scale limits from the data, or as set by the user
+        Temp_min, Temp_max = self.livePlot.dataLimits(self.ax1) or self.ax1.get_ylim()
+        Field_min, Field_max = self.livePlot.dataLimits(self.ax2) or self.ax2.get_ylim()
         
         if self.Temp_autoscale_max.get() == 1:
             self.Temp_max.delete(0,tk.END)
@@ -368,12 +427,7 @@ class gui(object):
         else:
             Field_min = float(self.Field_min.get())        
         
-        self.ax1.set_ylim(Temp_min, Temp_max)
-        self.ax2.set_ylim(Field_min, Field_max)
-
-        # Legend
-        labs = [l.get_label() for l in lns]
-        self.ax1.legend(lns, labs, loc='upper center', bbox_to_anchor=(1.1, -0.35), ncol=6)
+        self.livePlot.update(history['time'], series, {self.ax1: (Temp_min, Temp_max), self.ax2: (Field_min, Field_max)})
 
     def animate(self,i):
         # Update Hall sensor settings
@@ -388,16 +442,23 @@ class gui(object):
             self.plot()
         
     def startSave(self):
-        self.sens.openFile(self.save_var.get(), self.FilePath.get())
+        try:
+            self.sens.openFile(self.SaveInterval.get(), self.FilePath.get())
+        except (IOError, OSError, ValueError) as err:
+            # e.g. existing file with other columns
+            print("Could not open data file: " + str(err))
+            return
         self.save = True
         self.save_button.config(relief='sunken', fg='red', text='Saving...')
         
     def fileDirectory(self):
-        path = filedialog.asksaveasfilename(title = "Select file",filetypes = (("csv files","*.csv"),("all files","*.*")))
+        path = filedialog.asksaveasfilename(title = "Select file",filetypes = (("csv files","*.csv"),("binary files","*.bin"),("all files","*.*")))
         self.FilePath.delete(0,'end')
         self.FilePath.insert(10, path)
         
     def exitProgram(self):
+        self.sens.stop()
+        self.sens.closeFile()
         self.root.quit() 
         self.root.destroy()
         sys.exit()
@@ -407,6 +468,7 @@ class gui(object):
 class errMsg(object):
 	
     def __init__(self):
+        importGUI()
         self.errMsg = tk.Tk()
         self.errMsg.eval('tk::PlaceWindow . center')
         self.errMsg.wm_title("Temperature and Field Strength Sensors")
@@ -424,8 +486,8 @@ class errMsg(object):
         sys.exit()
         
         
-# When running this program inside TopSpin, set GUI=False and comment out line below        
-GUI = True
-gui()
+if __name__ == '__main__':
+    GUI = True
+    gui()
 
         
@@ -0,0 +1,170 @@
+#
+# sensorStream.py
+# Version 1.0, Oct 2026
+#
+# Incremental parser for the serial output of the sensor Arduino
+# (NMRShuttle_Sensors.ino), used by sensorShield.py.
+#
+# The Arduino sends one line per measurement:
+#   {PT100_1, PT100_2, PT100_3, Hall sensor (mV), Dyneo set temp, Dyneo actual temp}
+# together with start-up messages and sensor fault reports, which may run
+# into the start of a measurement line. Bytes are read from the port into a
+# reusable buffer, and every complete {...} record is decoded straight to
+# floats and returned as a sensorRecord, so no measurement is lost however
+# many lines arrive between reads. Lines without a record (and any text
+# before a record) are kept in parser.messages.
+#
+# A sensorReader thread reads the port continuously, independent of the
+# GUI and file writing, and adds every record to a ring buffer (see
+# ringBuffer.py) as a row of RECORD_DTYPE, timestamped with time.monotonic().
+#
+# Usage:
+#   parser = sensorStream.frameParser()
+#   for record in parser.readFrom(port):
+#       print(record.PT100_1, record.hallVoltage)
+#
+#   reader = sensorStream.sensorReader(port, ringBuffer.ringBuffer(10000, sensorStream.RECORD_DTYPE))
+#   reader.start()
+#
+
+import collections, threading, time
+import numpy as np
+
+
+FIELDS = ('PT100_1', 'PT100_2', 'PT100_3', 'hallVoltage', 'dyneoSetTemp', 'dyneoActualTemp')
+
+# time is the time at which the record was read from the port (s)
+sensorRecord = collections.namedtuple('sensorRecord', ('time',) + FIELDS)
+
+RECORD_DTYPE = np.dtype([(name, 'f8') for name in sensorRecord._fields])
+
+
+class frameParser(object):
+
+    def __init__(self, size=4096, clock=time.time):
+        self.buffer = bytearray(size)
+        self.length = 0
+        self.clock = clock
+        self.messages = collections.deque(maxlen=100)
+
+        # Statistics
+        self.records = 0
+        self.errors = 0
+        self.overflows = 0
+
+
+    def reset(self):
+        # Discard any incomplete line, e.g. after the port input buffer is cleared
+        self.length = 0
+
+
+    def readFrom(self, port):
+        # Read everything waiting on the port, waiting up to the port timeout
+        # for the first byte. Returns the list of complete records.
+        data = port.read(max(1, port.in_waiting))
+        if len(data) > 0 and port.in_waiting > 0:
+            data += port.read(port.in_waiting)
+        return self.feed(data)
+
+
+    def feed(self, data, timestamp=None):
+        # Add bytes received from the port. Returns the list of complete records.
+        timestamp = self.clock() if timestamp is None else timestamp
+        records = []
+        data = memoryview(data)
+        while len(data) > 0:
+            n = min(len(data), len(self.buffer) - self.length)
+            if n == 0:
+                # Buffer full of a line with no end; discard it
+                self.overflows += 1
+                self.length = 0
+                continue
+            self.buffer[self.length:self.length + n] = data[:n]
+            self.length += n
+            data = data[n:]
+            self._parse(timestamp, records)
+        return records
+
+
+    def _parse(self, timestamp, records):
+        # Decode all complete lines in the buffer
+        end = self.buffer.rfind(b'\n', 0, self.length)
+        if end < 0:
+            return
+        for line in self.buffer[:end].split(b'\n'):
+            brace = line.find(b'{')
+            if brace < 0:
+                self._message(line)
+                continue
+            if brace > 0:
+                self._message(line[:brace])
+            record = self._decode(line, brace + 1, line.find(b'}', brace), timestamp)
+            if record is not None:
+                records.append(record)
+
+        # Move the incomplete line to the start of the buffer
+        remaining = self.length - end - 1
+        self.buffer[:remaining] = self.buffer[end + 1:self.length]
+        self.length = remaining
+
+
+    def _decode(self, line, start, end, timestamp):
+        if end < 0:
+            self.errors += 1
+            return None
+        values = line[start:end].split(b',')
+        if len(values) != len(FIELDS):
+            self.errors += 1
+            return None
+        try:
+            record = sensorRecord(timestamp, *[float(value) for value in values])
+        except ValueError:
+            self.errors += 1
+            return None
+        self.records += 1
+        return record
+
+
+    def _message(self, line):
+        text = line.decode('utf-8', 'replace').strip()
+        if len(text) > 0:
+            self.messages.append(text)
+
+
+
+class sensorReader(object):
+    # Reads records from the port in a background thread and adds them to buffer
+
+    def __init__(self, port, buffer, parser=None):
+        self.port = port
+        self.buffer = buffer
+        self.parser = frameParser(clock=time.monotonic) if parser is None else parser
+        self.error = None
+        self.running = False
+        self.thread = None
+
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def _run(self):
+        while self.running:
+            try:
+                records = self.parser.readFrom(self.port)
+            except (IOError, OSError, ValueError) as err:
+                # e.g. device unplugged
+                self.error = err
+                self.running = False
+                break
+            if len(records) > 0:
+                self.buffer.extend(records)
+
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
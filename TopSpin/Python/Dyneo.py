@@ -9,8 +9,11 @@ communication for control of Julabo heater/chiller and flow direction valves.
 """
 
 import julaboController
+import NMRShuttleSetup
+import deviceManager
 import sys, time
 
+setup = NMRShuttleSetup.NMRShuttle()
 
 # Import dyneo module
 dyneo = julaboController.dyneo()
@@ -29,6 +32,8 @@ else:
 
 # Check arguments from Topspin. Switch on and set temperature and flow 
 # switching delay accordingly. If argument is 'OFF' switch everything off.
+# If the third argument is 'NOWAIT', set the temperature without waiting
+# for it to settle.
 if sys.argv[1] == 'OFF':
 	dyneo.switchOff()
 	if valves_disabled == False:
@@ -47,9 +52,15 @@ else:
             print("Flow direction valves: " + valves.checkStatus().strip('\n'))
     dyneo.switchOn()
     time.sleep(1)   # delay to allow Julabo time to respond
-    dyneo.setTemp_wait(float(sys.argv[1]))
+    if len(sys.argv) > 3 and sys.argv[3] == 'NOWAIT':
+        dyneo.setTemp(float(sys.argv[1]))
+    else:
+        dyneo.setTemp_wait(float(sys.argv[1]), setup.equilibTolerance, setup.equilibConfidence, setup.equilibLog)
 
 
+# Serial port timings
+print(deviceManager.summary())
+
 # Close serial communication
 dyneo.close()
 if valves_disabled == False:
@@ -14,207 +14,348 @@
 
 # Import libraries and define functions
 import NMRShuttleSetup
-import PyTrinamic
-from PyTrinamic.connections.serial_tmcl_interface import serial_tmcl_interface
-from PyTrinamic.modules.TMCM_1160 import TMCM_1160
-import time, datetime, math, sys, select
+import velocityRamp
+import fieldMapTable
+import speedTable
+import motionPlanner
+import trajectoryOptimizer
+import motorSupervisor
+import tmclBatch
+import shuttleTelemetry
+import time, datetime, math, sys
 import numpy as np
-import serial.tools.list_ports as list_ports
 
 # Define what to do if terminate signal recieved
 def terminate():
 	timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
 	print(str("Sequence terminated at " + str(timestamp)))
-	myInterface.close()
-	sys.exit(1)
+	raise SystemExit(1)
 
-# Get field map values from file
-fieldMap = open('fieldMap.csv','r')
-fieldMapValues = fieldMap.readlines()
-del fieldMapValues[0]
-		
-distanceValues = []
-fieldValues = []
-		
-for i in fieldMapValues:
-	value = i.split(',')
-	distanceValues.append(float(value[0]))
-	fieldValues.append(float(value[1]))
-fieldMap.close()				  
-				      
-# Print information about script
-print("NMRshuttle.py\nVersion 3.0\nThis program is for controlling a NMR low field shuttle using a TMCM-1060 or TMCM-1160 motor.\nCopyright (c) Andrew Hall, 2019\nFor further details see https://github.com/AMRHall/NMR_Shuttle/blob/master/README.md\n")
-
-# Import default values from setup file
-setup = NMRShuttleSetup.NMRShuttle()
-
-# Define parameters of magnet + shuttle system
-B0 = setup.B0                      # Magnetic field strength at centre of magnet (Tesla)
-Circ = setup.circ		   # Circumference of spindle wheel (cm)
-BSample = float(sys.argv[3])	   # Sample field strength (mT)
-speed = float(sys.argv[6])	   # Motor speed (cm/s)
-accel = float(sys.argv[7])	   # Acceleration (cm/s^2)
-dist = float(sys.argv[8])	   # Distance to move (cm)
-ramp = str(sys.argv[9])            # Equation for velocity ramp
-
-
-# Open communications with motor driver
-PyTrinamic.showInfo()
-for device in list_ports.comports():
-	if device.description == 'Trinamic Stepper Device':
-		port = device.device
-try:
-	myInterface = serial_tmcl_interface(port)
-except:
-        print('Motor driver not found')
-        terminate()
-module = TMCM_1160(myInterface)
-print("\n")
-
-# Reset all error flags
-module.setUserVariable(9,0)	#Clear motor error flags
-module.setUserVariable(8,0)	#Set position to 'down'
-
-
-# Get operation mode
-mode = int(sys.argv[1]) # 1 = Constant velocity, 2 = Velocity sweep, 3 = Constant time
-
-# Get tube type and fetch appropriate stall guard settings
-stallSetting = int(sys.argv[2]) # 1 = Standard glass tube, 2 = 5mm High pressure tube, 3 = 10mm High pressure tube
-if stallSetting == 1:
-	stallGuard = NMRShuttleSetup.stallGuard_1()
-elif stallSetting == 2:
-	stallGuard = NMRShuttleSetup.stallGuard_2()
-elif stallSetting == 3:
-	stallGuard = NMRShuttleSetup.stallGuard_3()
-else:
-	print("Invalid value for tube type.")
-	sys.exit(0)
-
-# Motor settings
-module.motorRunCurrent(stallGuard.motorRunCurrent)
-module.motorStandbyCurrent(stallGuard.motorStandbyCurrent)
-module.stallguard2Filter(stallGuard.stallguard2Filter)
-module.stallguard2Threshold(stallGuard.stallguard2Threshold)
-module.stopOnStall(stallGuard.stopOnStall)
-module.setAxisParameter(154,setup.pulDiv)
-module.setAxisParameter(153,setup.rampDiv)
-
-# Convert speed and acceleration from real units to motor units
-pulseDiv = module.axisParameter(154)
-uStepRes = module.axisParameter(140)
-fullStepRot = setup.fullStepRot
-rampDiv = module.axisParameter(153)
-NStep = fullStepRot * 2**uStepRes
-
-# The TMCM-1060 works in internal units of pps/s whilst the TMCM-1160 uses arbitary 12 bit internal units
-# These calculations are taken from pages 91 - 95 of the TMCM-1160 manual.
-if setup.model == 'TMCM-1160':
-	speed = int(((speed/Circ) * fullStepRot * (2**uStepRes) * (2**pulseDiv) * 2048 * 32)/(16 * (10**6)))
-	maxSpeed = int(((setup.maxSpeed/Circ) * fullStepRot * (2**uStepRes) * (2**pulseDiv) * 2048 * 32)/(16 * (10**6)))
-	accel = int(((accel/Circ) * fullStepRot * (2**uStepRes) * (2**(rampDiv + pulseDiv + 29)))/((16 * (10**6))**2))
-elif setup.model == 'TMCM-1060':
-	speed = int((speed/Circ) * fullStepRot * (2**uStepRes))
-	maxSpeed = int((setup.maxSpeed/Circ) * fullStepRot * (2**uStepRes))
-	accel = int((accel/Circ) * fullStepRot * (2**uStepRes))
-else:
-	print("Invalid motor model.")
-	sys.exit(0)
+
+def loadFieldMap(path='fieldMap.csv'):
+	# Get field map values from file
+	try:
+		fieldMap = fieldMapTable.load(path)
+	except (IOError, ValueError) as err:
+		print("Could not read field map: " + str(err))
+		raise SystemExit(1)
+	return fieldMap
+
+
+def connectMotor(setup):
+	# Open communications with motor driver
+	if setup.simulate:
+		import tmcmSimulator
+		myInterface = tmcmSimulator.simulatedInterface(model=setup.model, upDelay=1, downDelay=1)
+		module = tmcmSimulator.simulatedTMCM(myInterface)
+		print("Using simulated motor driver")
+	else:
+		import PyTrinamic
+		from PyTrinamic.connections.serial_tmcl_interface import serial_tmcl_interface
+		from PyTrinamic.modules.TMCM_1160 import TMCM_1160
+		import deviceManager
+		PyTrinamic.showInfo()
+		# PyTrinamic opens the port itself. If the cached port fails, the ports are scanned again.
+		try:
+			myInterface = deviceManager.openWith('motor', serial_tmcl_interface)
+		except IOError:
+		        print('Motor driver not found')
+		        terminate()
+		module = TMCM_1160(myInterface)
+	print("\n")
+	return myInterface, module
+
+
+def stallGuardSettings(stallSetting):
+	# Stall guard settings for CNST12 = stallSetting: class stallGuard_<stallSetting>
+	# in NMRShuttleSetup.py (1 = Standard glass tube, 2 = 5mm High pressure tube,
+	# 3 = 10mm High pressure tube, 4... = profiles added by stallTuning.py).
+	# Returns None if there is no such class.
+	profile = getattr(NMRShuttleSetup, 'stallGuard_' + str(stallSetting), None)
+	if profile is None:
+		return None
+	return profile()
+
+
+def setStallGuard(batch, stallGuard):
+	# Queue the motor current and stall detection settings
+	batch.setAxisParameter(6,stallGuard.motorRunCurrent)
+	batch.setAxisParameter(7,stallGuard.motorStandbyCurrent)
+	batch.setAxisParameter(173,stallGuard.stallguard2Filter)
+	batch.setAxisParameter(174,stallGuard.stallguard2Threshold)
+	batch.setAxisParameter(181,stallGuard.stopOnStall)
+
+
+def cancelHeldMove(module, timeout=None):
+	# Cancel an upward move that the firmware is holding for new settings
+	# (UserVariable15 = -2, see NMRshuttle_1160_v4.tmc), so that it cannot be
+	# started later by another sequence without a trigger. Further upward moves
+	# are cancelled until new settings are written. If timeout (s) is given,
+	# wait until the firmware has dropped the held move (UserVariable16).
+	module.setUserVariable(15,-2)
+	if timeout is None:
+		return
+	start = time.time()
+	while module.userVariable(16) != 0:
+		if time.time() - start > timeout:
+			print("Motor did not cancel the held upward move.")
+			raise SystemExit(1)
+		time.sleep(0.01)
+
+
+def sliceValues(argument, n=None):
+	# Values of a command line argument for each 2D slice: a single value, or a
+	# comma separated list for a variable field (VB list) experiment
+	values = [float(value) for value in str(argument).split(',')]
+	if n is not None and len(values) == 1:
+		values = values * n
+	if n is not None and len(values) != n:
+		print("Lists of field strengths, speeds and distances must be the same length.")
+		raise SystemExit(1)
+	return values
+
+
+def runSequence(arguments, setup, fieldMap, myInterface, module, stdin=sys.stdin):
+	# Run the shuttle for one experiment. arguments are the command line
+	# arguments of this program (without the program name). Errors and
+	# STOP from TopSpin raise SystemExit, as sys.exit() would.
+	# Field strength, speed and distance may be comma separated lists, one
+	# value for each 2D slice (used in turn, repeating if there are more
+	# slices than values). The motor is reprogrammed between slices, and
+	# the firmware holds the first upward move of each slice until it has
+	# been reprogrammed (UserVariable15), however soon it is triggered.
+
+	# Define parameters of magnet + shuttle system
+	B0 = setup.B0                      # Magnetic field strength at centre of magnet (Tesla)
+	Circ = setup.circ		   # Circumference of spindle wheel (cm)
+	fields = sliceValues(arguments[2])	   # Sample field strength (mT)
+	speeds = sliceValues(arguments[5], len(fields))	   # Motor speed (cm/s)
+	accel = float(arguments[6])	   # Acceleration (cm/s^2)
+	distances = sliceValues(arguments[7], len(fields))	   # Distance to move (cm)
+	ramp = str(arguments[8])            # Equation for velocity ramp
+
+	# Get operation mode
+	mode = int(arguments[0]) # 1 = Constant velocity, 2 = Velocity sweep, 3 = Constant time
+
+	# Compile and check the velocity ramp before any motor settings are changed, so that a
+	# malformed equation cannot stop the sample part way through a sweep.
+	# The ramp 'optimal' uses the time-optimal speed table (see trajectoryOptimizer.py).
+	optimal = mode == 2 and trajectoryOptimizer.isOptimal(ramp)
+	if mode == 2:
+		try:
+			if optimal:
+				rateLimit = trajectoryOptimizer.sweepRateLimit(setup.sweepRateLimit, fieldMap)
+			else:
+				rampProfile = velocityRamp.velocityRamp(ramp, fieldMap)
+				for dist in distances:
+					rampProfile.validate(dist)
+		except ValueError as err:
+			print(str(err))
+			raise SystemExit(1)
+
+
+	# Motor commands are queued and sent together to save round trips (see tmclBatch.py)
+	batch = tmclBatch.tmclBatch(myInterface)
+
+	# Drop any upward move left held by a sequence that was stopped, before the new
+	# settings are written
+	cancelHeldMove(module, timeout=2.0)
+
+	# Reset all error flags
+	batch.setUserVariable(9,0)	#Clear motor error flags
+	batch.setUserVariable(8,0)	#Set position to 'down'
+	batch.setUserVariable(speedTable.TABLE_LENGTH,0)	#Constant velocity unless a speed table is uploaded
+
+
+	# Get tube type and fetch appropriate stall guard settings
+	stallSetting = int(arguments[1]) # 1 = Standard glass tube, 2 = 5mm High pressure tube, 3 = 10mm High pressure tube
+	stallGuard = stallGuardSettings(stallSetting)
+	if stallGuard is None:
+		print("Invalid value for tube type.")
+		raise SystemExit(0)
+
+	# Motor settings
+	setStallGuard(batch, stallGuard)
+	batch.setAxisParameter(154,setup.pulDiv)
+	batch.setAxisParameter(153,setup.rampDiv)
+	pulseDiv = batch.axisParameter(154)
+	uStepRes = batch.axisParameter(140)
+	rampDiv = batch.axisParameter(153)
+	values = batch.execute()
+
+	# Convert speed and acceleration from real units to motor units
+	pulseDiv = values[pulseDiv]
+	uStepRes = values[uStepRes]
+	fullStepRot = setup.fullStepRot
+	rampDiv = values[rampDiv]
+	NStep = fullStepRot * 2**uStepRes
+
+	# Plan the motion for every field strength in real units, then convert speed and acceleration
+	# to motor units. See motionPlanner.py for the conversion between real units and motor units.
+	plans = []
+	try:
+		units = motionPlanner.motorUnits(setup.model, Circ, fullStepRot, uStepRes, pulseDiv, rampDiv)
+		for dist, speed in zip(distances, speeds):
+			if optimal:
+				table = trajectoryOptimizer.optimalTable(dist, speed, accel, units, fieldMap, rateLimit, maxSpeed=setup.maxSpeed)
+				plans.append(motionPlanner.planMotion(dist, speed, accel, units, maxSpeed=setup.maxSpeed, table=table, fieldMap=fieldMap))
+			elif mode == 2:
+				plans.append(motionPlanner.planMotion(dist, speed, accel, units, maxSpeed=setup.maxSpeed, ramp=rampProfile, fieldMap=fieldMap))
+			else:
+				plans.append(motionPlanner.planMotion(dist, speed, accel, units, maxSpeed=setup.maxSpeed, fieldMap=fieldMap))
+	except ValueError as err:
+		print(str(err))
+		raise SystemExit(1)
+	maxSpeed = units.speedToMotor(setup.maxSpeed)
+	accel = plans[0].motorAccel
 
 	
-module.setMaxVelocity(maxSpeed)
-module.setMaxAcceleration(accel)
-
-
-#Print some information for the user
-if mode == 1 or mode == 3:
-	module.setTargetSpeed(speed)
-	print("Target speed = " + str(speed) + " (motor units)")
-	     
-print("Acceleration = " + str(accel) + " (motor units)")
-
-print(str("Magnetic field strength = " + str(BSample) +  " mT"))
-
-print(str("Height = " + str(round(dist,2)) + " cm"))
-
-    
-# Calculate number of steps
-steps = int((dist*NStep)/Circ)
-print(str("Number of steps = " + str(steps) + "\n"))
-
-module.setUserVariable(1,steps)
-
-
-# Get number of transients for each field strength
-NS = int(sys.argv[4])
-
-# Get number of 2D slices
-TD = int(sys.argv[5])
-  
-# Check position of sample and wait until finished
-up = False
-newLine = False
-m = 0
-while m < TD:
-	n = 0
-	m += 1
-	while n < NS:	
-		# Check for errors in motor
-		if module.digitalInput(10) == 0:		#Shutdown error from light gate
-			print("\nEmergency stop detected. Aborting acquisition.")
-			terminate()
-		elif module.statusFlags() != 0:       #Stall detected
-			print("\nStall detected. Aborting acquisition.")
-			terminate()
+	batch.setAxisParameter(4,maxSpeed)
+	batch.setAxisParameter(5,accel)
+	print("Acceleration = " + str(accel) + " (motor units)")
+	if len(fields) > 1:
+		print(str("Variable field experiment with " + str(len(fields)) + " field strengths"))
 
-		
-		#If terminate signal recieved from Topspin, safely stop motor
-		for sys.stdin in select.select([sys.stdin], [], [], 0)[0]:
-			line = sys.stdin.readline()
-			if line == "STOP":
-				print("\nAquisition aborted by Topspin.")
-				terminate()
+
+	# Get number of transients for each field strength
+	NS = int(arguments[3])
+
+	# Get number of 2D slices
+	TD = int(arguments[4])
+
+
+	def setSlice(i):
+		# Program the motor for field strength i, while the sample is down
+		plan = plans[i]
+		steps = units.steps(distances[i])
+		batch.setUserVariable(15,-1)	#Hold any upward move until the new settings are written
+		if mode == 1 or mode == 3:
+			# Moves to position (MVP) are limited by the maximum positioning speed, not the target speed
+			batch.setAxisParameter(2,plan.motorSpeed)
+			batch.setAxisParameter(4,min(plan.motorSpeed, maxSpeed))
+			print("Target speed = " + str(plan.motorSpeed) + " (motor units)")
+		print(str("Magnetic field strength = " + str(fields[i]) +  " mT"))
+		print(str("Height = " + str(round(distances[i],2)) + " cm"))
+		print(str("Predicted motion time = " + str(round(plan.motionTime,3)) + " s"))
+		print(str("Number of steps = " + str(steps) + "\n"))
+		batch.setUserVariable(1,steps)
+		batch.execute()
+
+		# For velocity sweep mode, precompute the speed at each position and upload
+		# the table to the motor. The firmware then changes speed during the motion
+		# without any commands from this program.
+		if mode == 2:
+			tablePositions, tableSpeeds = plan.table
+			speedTable.uploadSpeedTable(module, tablePositions, tableSpeeds, batch=batch)
+			print(str("Uploaded speed table with " + str(len(tablePositions)) + " entries (" + str(min(tableSpeeds)) + " to " + str(max(tableSpeeds)) + " motor units)\n"))
+
+		# Allow NS upward moves with these settings; the next one waits until the
+		# next slice has been programmed (0 = no limit, as the settings never change)
+		batch.setUserVariable(15,NS if len(fields) > 1 else 0)
+		batch.execute()
+
+	current = 0
+	setSlice(current)
+
+	# Check position of sample and wait until finished.
+	# The motor is polled quickly while the sample is moving and slowly while it is parked (see motorSupervisor.py).
+	supervisor = motorSupervisor.motorSupervisor(module, stdin=stdin, batch=batch)
+
+	# Record timing of each transit (see shuttleTelemetry.py)
+	settings = {'mode': mode, 'field': fields, 'distance': distances, 'speed': [plan.motorSpeed for plan in plans],
+	            'accel': accel, 'ramp': ramp, 'NS': NS, 'TD': TD}
+	telemetry = shuttleTelemetry.shuttleTelemetry(setup.telemetryLog, settings, predicted=plans[0].motionTime)
+	completed = False
+	try:
+		handled = 0	# moves handled so far (odd = up, even = down)
+		m = 0
+		while m < TD:
+			n = 0
+			m += 1
+
+			# Move to the next field strength of a VB list (the sample is down between slices)
+			if (m - 1) % len(fields) != current:
+				current = (m - 1) % len(fields)
+				setSlice(current)
+				telemetry.predicted = plans[current].motionTime
+				supervisor.hold = False
+			BSample = fields[current]
+			while n < NS:
+				#If terminate signal recieved from Topspin, safely stop motor
+				line = supervisor.wait()
+				if line == "STOP":
+					print("\nAquisition aborted by Topspin.")
+					terminate()
+				supervisor.update()
+
+				# Check for errors in motor
+				if supervisor.error == motorSupervisor.SHUTDOWN:		#Shutdown error from light gate
+					print("\nEmergency stop detected. Aborting acquisition.")
+					terminate()
+				elif supervisor.error == motorSupervisor.STALL:       #Stall detected
+					print("\nStall detected. Aborting acquisition.")
+					terminate()
 	
-		#Check sample position
-		position = module.userVariable(8)
-		if up == False and position == 1:
-			up = True
-			print("\nSample UP.")
-			startTime = time.time()
-		if up == True and position == 1:
-			elapsedTime = round((time.time() - startTime),1)
-			print('\rElapsed time = ' + str(elapsedTime), end = ' ')
-			newLine = True
-		if up == True and position == 0:
-			up = False
-			n += 1
-			print("\nSample DOWN.")
-			if TD == 1:
-				print(str("Completed scan " + str(n) + " of " + str(NS) + " at magnetic field strength of " + str(BSample) + " mT"))
-			else:
-				print(str("Completed scan " + str(n) + "/" + str(NS) + " for 2D slice " + str(m) + "/" + str(TD) + " at magnetic field strength of " + str(BSample) + " mT"))
-			if mode == 2:
-				print("\n")
-		if position == 2 and mode == 2:
-			if newLine == True:
-				print('')
-				newLine = False
-			z = (module.actualPosition()*(setup.direction*Circ))/NStep
-			Bz = float(B0/(1+((z/b)**a)))
-			rampSpeed = int(speed*eval(ramp))
-			module.setTargetSpeed(rampSpeed)
-			print('\rTarget speed = ' + str(rampSpeed), end = ' ')
-		time.sleep(0.02)
+				#Check sample position. Every move that finished since the last poll is
+				#handled in turn, as a short move may start and finish between two polls.
+				while n < NS and handled < supervisor.arrivals:
+					handled += 1
+					latest = handled == supervisor.arrivals
+					if handled % 2 == 1:
+						print("\nSample UP.")
+						startTime = time.time()
+						telemetry.transit('up', m, n + 1, supervisor, timed=latest)
+						# The next upward move is held until the next slice has been programmed,
+						# so look for the end of the slice quickly
+						if n + 1 == NS and m < TD and len(fields) > 1:
+							supervisor.hold = True
+					else:
+						n += 1
+						print("\nSample DOWN.")
+						telemetry.transit('down', m, n, supervisor, timed=latest)
+						if TD == 1:
+							print(str("Completed scan " + str(n) + " of " + str(NS) + " at magnetic field strength of " + str(BSample) + " mT"))
+						else:
+							print(str("Completed scan " + str(n) + "/" + str(NS) + " for 2D slice " + str(m) + "/" + str(TD) + " at magnetic field strength of " + str(BSample) + " mT"))
+				if handled % 2 == 1 and supervisor.position == motorSupervisor.UP:
+					elapsedTime = round((time.time() - startTime),1)
+					print('\rElapsed time = ' + str(elapsedTime), end = ' ')
 		
-# Once sequence is complete for all magnetic field strengths:
-# Set motor distance back to zero for safety
-module.setUserVariable(1,0)
+		# Once sequence is complete for all magnetic field strengths:
+		# Set motor distance back to zero for safety
+		module.setUserVariable(1,0)
+		module.setUserVariable(15,0)
+		speedTable.clearSpeedTable(module)
+
+		# Print completion message
+		timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
+		print(str("\nSequence successfully completed at " + str(timestamp)))
+		print(supervisor.summary())
+		print(telemetry.summary())
+		completed = True
+	finally:
+		# On STOP and errors, make sure that a held upward move is not started later
+		if not completed:
+			try:
+				cancelHeldMove(module)
+			except Exception:
+				pass
+		# Close the log on STOP and errors as well
+		telemetry.close()
+	return 0
 
-# Print completion message
-timestamp = datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
-print(str("\nSequence successfully completed at " + str(timestamp)))
 
-# Close serial port
-myInterface.close()
+if __name__ == '__main__':
+	# Print information about script
+	print("NMRshuttle.py\nVersion 3.0\nThis program is for controlling a NMR low field shuttle using a TMCM-1060 or TMCM-1160 motor.\nCopyright (c) Andrew Hall, 2019\nFor further details see https://github.com/AMRHall/NMR_Shuttle/blob/master/README.md\n")
 
-sys.exit(0)
+	# Import default values from setup file
+	setup = NMRShuttleSetup.NMRShuttle()
+	fieldMap = loadFieldMap()
+	myInterface, module = connectMotor(setup)
+	try:
+		status = runSequence(sys.argv[1:], setup, fieldMap, myInterface, module)
+	finally:
+		# Close serial port
+		myInterface.close()
+	sys.exit(status)
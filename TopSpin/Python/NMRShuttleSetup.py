@@ -10,6 +10,15 @@ class NMRShuttle(object):
   
   # Motor model
   model =             "TMCM-1160"
+
+  # Use simulated motor instead of hardware (for testing without the shuttle)
+  simulate =          False
+
+  # Local TCP port used by the shuttle service (shuttleService.py)
+  servicePort =       50007
+
+  # Log file for transit timing (shuttleTelemetry.py). Set to "" to disable.
+  telemetryLog =      "shuttleTelemetry.jsonl"
   
   # Motor direction
   direction =         -1
@@ -42,9 +51,16 @@ class NMRShuttle(object):
   maxSpeed =          30.5
 
   # Velocity ramp equation. Equation must be expressed as a Python math equation 
-  # in terms of sample position (z) or local field strength (Bz)
+  # in terms of sample position (z) or local field strength (Bz), or "optimal" for
+  # the fastest motion within the speed, acceleration and sweep rate limits.
   ramp =              "1-0.9/(1+math.exp(-0.001*(Bz-5000)))"
 
+  # Maximum rate of change of field strength seen by the sample (mT/s), used when
+  # the ramp equation is "optimal" (see trajectoryOptimizer.py). A number, or an
+  # equation in terms of z or Bz to set a lower limit near level anti-crossings,
+  # e.g. "50000-49000*math.exp(-((Bz-1500)/200)**2)". Set to "" for no limit.
+  sweepRateLimit =    ""
+
 
   
 # Settings for low field homogeneity coil. If coil is not used, set lowFieldCoil_Field to 0 or NaN.
@@ -57,8 +73,23 @@ class NMRShuttle(object):
   
  
   
- # Temperature equilibriation time (s):
-  equilibTime =       30
+ # Temperature equilibriation. Dyneo.py waits until the sample temperature
+ # has settled within equilibTolerance of the setpoint, with the given
+ # confidence (0...1), and logs the settling time to equilibLog (set to ""
+ # to disable). See equilibration.py.
+  equilibTolerance =  0.1
+  equilibConfidence = 0.95
+  equilibLog =        "equilibration.jsonl"
+  
+ # Additional time to wait once the temperature has settled (s):
+  equilibTime =       0
+  
+ # Temperature series (runNMRShuttleSeries.py). Order of the points: "serpentine",
+ # "monotone" or "given" (see seriesScheduler.py), and time before the end of each
+ # acquisition at which the heater/chiller starts moving to the next temperature
+ # (s, 0 to disable).
+  seriesOrdering =    "serpentine"
+  seriesPreRamp =     30
 
   
   
@@ -82,6 +113,9 @@ class NMRShuttle(object):
 # STALL GUARD SETTINGS ARE USED TO LIMIT THE TORQUE THAT THE MOTOR CAN APPLY.
 # SEE THE MANUAL FOR MORE DETAILS.
 # *****************************
+# CNST12 = n selects class stallGuard_n. stallTuning.py adds new classes with the
+# fastest speed and acceleration (cm/s, cm/s^2) found for a tube type, which are
+# then used unless CNST30/CNST31 are set.
 
 class stallGuard_1(object):
   # Stall guard setting 1
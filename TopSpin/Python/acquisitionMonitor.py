@@ -0,0 +1,88 @@
+#
+# acquisitionMonitor.py
+# Version 1.0, Oct 2026
+#
+# Waits for the acquisition (ZG) and the motor sequence (NMRShuttle.py or the
+# shuttle service) to finish, for runNMRShuttle.py. Works with TopSpin's
+# Jython interpreter.
+#
+# Each side is watched by its own thread, and the calling thread sleeps
+# until one of them finishes. The motor process is waited on directly. TopSpin
+# does not provide a blocking wait for a command started with
+# NO_WAIT_TILL_DONE, so the acquisition thread checks zg.getResult() at a
+# low rate instead. The time taken by each side is recorded, so that it is
+# possible to see whether the shuttle or the spectrometer is holding up the
+# experiment.
+#
+# Usage:
+#   monitor = acquisitionMonitor.acquisitionMonitor(proc, zg)
+#   first = monitor.wait()      # 'motor' or 'acquisition'
+#
+
+import threading, time
+
+
+class acquisitionMonitor(object):
+
+    def __init__(self, proc, zg, pollInterval=0.5):
+        self.proc = proc
+        self.zg = zg
+        self.pollInterval = pollInterval
+        self.changed = threading.Event()
+        self.startTime = time.time()
+        self.motorTime = None
+        self.acquisitionTime = None
+
+        for target in (self._watchMotor, self._watchAcquisition):
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
+
+
+    def _watchMotor(self):
+        self.proc.wait()
+        self.motorTime = time.time() - self.startTime
+        self.changed.set()
+
+
+    def _watchAcquisition(self):
+        while self.zg.getResult() != 0:
+            time.sleep(self.pollInterval)
+        self.acquisitionTime = time.time() - self.startTime
+        self.changed.set()
+
+
+    def wait(self, timeout=None):
+        # Sleep until either side finishes (or timeout, in seconds). Returns
+        # 'motor' or 'acquisition' for whichever finished, or None on timeout.
+        self.changed.wait(timeout)
+        self.changed.clear()
+        if self.motorTime is not None and self.acquisitionTime is None:
+            return 'motor'
+        if self.acquisitionTime is not None:
+            return 'acquisition'
+        return None
+
+
+    def waitForMotor(self, timeout):
+        # Wait up to timeout seconds for the motor sequence to finish.
+        # Returns True if it did.
+        end = time.time() + timeout
+        while self.motorTime is None and time.time() < end:
+            self.changed.wait(max(0.0, end - time.time()))
+            self.changed.clear()
+        return self.motorTime is not None
+
+
+    def summary(self):
+        text = ""
+        if self.acquisitionTime is not None:
+            text += "Acquisition took " + str(round(self.acquisitionTime,1)) + " s. "
+        if self.motorTime is not None:
+            text += "Motor sequence took " + str(round(self.motorTime,1)) + " s. "
+        if self.acquisitionTime is not None and self.motorTime is not None:
+            if self.motorTime > self.acquisitionTime:
+                text += "Shuttle finished " + str(round(self.motorTime - self.acquisitionTime,1)) + " s after the spectrometer."
+            else:
+                text += "Spectrometer finished " + str(round(self.acquisitionTime - self.motorTime,1)) + " s after the shuttle."
+        return text.strip()
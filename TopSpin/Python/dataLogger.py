@@ -0,0 +1,256 @@
+#
+# dataLogger.py
+# Version 1.0, Oct 2026
+#
+# Records sensor data to file at the full sampling rate, with a summary
+# (mean, minimum and maximum of each value) for every save interval.
+#
+# Rows are passed to log() and written by a background thread, so the GUI
+# and the sensor reader never wait for the disk. The queue between them is
+# bounded; if the writer falls more than queueSize batches behind, log()
+# drops the batch rather than wait for it. Dropped rows are counted
+# and reported by summary(), and a warning is printed when rows are first
+# dropped. Rows are written in batches and the file is flushed every
+# flushInterval seconds, or sooner if flushRows rows are waiting, rather
+# than after every row.
+#
+# Two file formats are available, chosen by the extension of path:
+#   .csv   Timestamp, value 1, value 2... (missing values left blank)
+#   .bin   append-only float64 rows (time in s since the epoch, then the
+#          values; missing values NaN), described by path + '.json'. Read
+#          with readLog(path). No formatting is needed, and values are
+#          read back exactly.
+# An existing file in either format is appended to if it has the same
+# columns (an incomplete last row, e.g. after a power cut, is removed first).
+# The summary is written alongside, e.g. data_summary.csv for data.csv,
+# in the same format, with a row for each interval: the start time of the
+# interval, then the mean, minimum and maximum of each value and the number
+# of samples.
+#
+# Usage:
+#   logger = dataLogger.dataLogger('data.csv', ['T1 (degC)', 'T2 (degC)'], interval=10)
+#   logger.log([[time.time(), 21.3, 22.1]])
+#   logger.close()
+#   print(logger.summary())
+#
+
+import datetime, json, os, threading, time, warnings
+import numpy as np
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+def summaryPath(path):
+    stem, extension = os.path.splitext(path)
+    return stem + '_summary' + extension
+
+
+def readLog(path):
+    # Read a binary log file. Returns the rows and the column names.
+    with open(path + '.json', 'r') as header:
+        columns = json.load(header)['columns']
+    return np.fromfile(path, dtype='<f8').reshape(-1, len(columns)), columns
+
+
+
+class _logFile(object):
+    # Output file in CSV or binary format
+
+    def __init__(self, path, columns, binary):
+        self.binary = binary
+        if binary:
+            description = {'columns': ['time'] + columns, 'dtype': '<f8'}
+            if os.path.exists(path) and os.path.exists(path + '.json'):
+                with open(path + '.json', 'r') as header:
+                    if json.load(header) != description:
+                        raise ValueError("Log file " + path + " has different columns")
+                # Remove an incomplete last row so that new rows line up
+                rowSize = 8 * len(description['columns'])
+                size = os.path.getsize(path)
+                if size % rowSize != 0:
+                    with open(path, 'r+b') as existing:
+                        existing.truncate(size - size % rowSize)
+            else:
+                with open(path + '.json', 'w') as header:
+                    json.dump(description, header)
+            self.file = open(path, 'ab')
+        else:
+            header = ', '.join(['Timestamp'] + columns) + '\n'
+            new = not os.path.exists(path) or os.path.getsize(path) == 0
+            if not new:
+                with open(path, 'r+b') as existing:
+                    if existing.readline().decode('utf-8', 'replace').rstrip() != header.rstrip():
+                        raise ValueError("Log file " + path + " has different columns")
+                    # Remove an incomplete last line so that new rows start on a new line
+                    start = existing.tell()
+                    existing.seek(0, os.SEEK_END)
+                    size = existing.tell()
+                    existing.seek(max(start, size - 4096))
+                    tail = existing.read()
+                    if len(tail) > 0 and not tail.endswith(b'\n'):
+                        existing.truncate(size - len(tail) + tail.rfind(b'\n') + 1)
+            self.file = open(path, 'a')
+            if new:
+                self.file.write(header)
+
+
+    def write(self, rows):
+        if self.binary:
+            self.file.write(np.ascontiguousarray(rows, dtype='<f8').tobytes())
+            return
+        lines = []
+        for row in rows.tolist():
+            values = ['' if value != value else '%.10g' % value for value in row[1:]]
+            lines.append(', '.join([str(datetime.datetime.fromtimestamp(row[0]))] + values) + '\n')
+        self.file.write(''.join(lines))
+
+
+    def flush(self):
+        self.file.flush()
+
+
+    def close(self):
+        self.file.close()
+
+
+
+class dataLogger(object):
+
+    def __init__(self, path, fields, interval=None, flushInterval=5.0, flushRows=1000, queueSize=1000):
+        self.path = path
+        self.fields = list(fields)
+        self.interval = interval if interval else None
+        self.flushInterval = flushInterval
+        self.flushRows = flushRows
+        binary = os.path.splitext(path)[1].lower() == '.bin'
+
+        self.data = _logFile(path, self.fields, binary)
+        self.summaryFile = None
+        if self.interval is not None:
+            columns = []
+            for field in self.fields:
+                columns += [field + ' mean', field + ' min', field + ' max']
+            self.summaryFile = _logFile(summaryPath(path), columns + ['Samples'], binary)
+
+        # Summary of the current interval: start, count, sum, min and max of each value
+        self.bin = None
+        self.binSamples = 0
+
+        self.queue = queue.Queue(maxsize=queueSize)
+        self.error = None
+
+        # Statistics
+        self.rows = 0
+        self.writes = 0
+        self.dropped = 0
+
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def log(self, rows):
+        # Queue rows (time in s since the epoch, then one value per field) to be written
+        if self.error is not None:
+            raise IOError("Data logging failed: " + str(self.error))
+        rows = np.array(rows, dtype=float, ndmin=2)
+        if len(rows) == 0:
+            return
+        try:
+            self.queue.put_nowait(rows)
+        except queue.Full:
+            if self.dropped == 0:
+                print("Data logger cannot keep up, rows are being dropped (" + self.path + ")")
+            self.dropped += len(rows)
+
+
+    def _run(self):
+        pending = []
+        pendingRows = 0
+        lastFlush = time.time()
+        running = True
+        while running:
+            try:
+                rows = self.queue.get(timeout=max(0.01, lastFlush + self.flushInterval - time.time()))
+            except queue.Empty:
+                rows = None
+            if rows is not None and len(rows) == 0:
+                running = False     # close() was called
+            elif rows is not None:
+                pending.append(rows)
+                pendingRows += len(rows)
+            if not running or pendingRows >= self.flushRows or time.time() - lastFlush >= self.flushInterval:
+                try:
+                    self._write(pending, final=not running)
+                except (IOError, OSError, ValueError) as err:
+                    self.error = err
+                    return
+                pending = []
+                pendingRows = 0
+                lastFlush = time.time()
+
+
+    def _write(self, pending, final=False):
+        if len(pending) > 0:
+            rows = np.concatenate(pending)
+            self.data.write(rows)
+            self.rows += len(rows)
+            if self.summaryFile is not None:
+                self._summarise(rows)
+        if self.summaryFile is not None and final and self.bin is not None:
+            self._endInterval()
+        self.data.flush()
+        if self.summaryFile is not None:
+            self.summaryFile.flush()
+        self.writes += 1
+
+
+    def _summarise(self, rows):
+        # Add rows to the interval summaries, writing each interval as it ends
+        starts = np.floor(rows[:,0] / self.interval) * self.interval
+        for start in np.unique(starts):
+            values = rows[starts == start, 1:]
+            if self.bin is not None and self.bin[0] != start:
+                self._endInterval()
+            if self.bin is None:
+                n = values.shape[1]
+                self.bin = [start, np.zeros(n), np.zeros(n), np.full(n, np.inf), np.full(n, -np.inf)]
+            valid = ~np.isnan(values)
+            self.bin[1] += valid.sum(axis=0)
+            self.bin[2] += np.where(valid, values, 0).sum(axis=0)
+            self.bin[3] = np.minimum(self.bin[3], np.where(valid, values, np.inf).min(axis=0))
+            self.bin[4] = np.maximum(self.bin[4], np.where(valid, values, -np.inf).max(axis=0))
+            self.binSamples += len(values)
+
+
+    def _endInterval(self):
+        start, count, total, low, high = self.bin
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+            mean = np.where(count > 0, total / count, np.nan)
+        low = np.where(count > 0, low, np.nan)
+        high = np.where(count > 0, high, np.nan)
+        row = np.concatenate(([start], np.column_stack((mean, low, high)).ravel(), [self.binSamples]))
+        self.summaryFile.write(row.reshape(1, -1))
+        self.bin = None
+        self.binSamples = 0
+
+
+    def close(self):
+        # Write everything queued, then close the files
+        if self.thread.is_alive():
+            self.queue.put(np.zeros((0, 0)))
+            self.thread.join()
+        self.data.close()
+        if self.summaryFile is not None:
+            self.summaryFile.close()
+
+
+    def summary(self):
+        text = str(self.rows) + " rows written to " + self.path + " in " + str(self.writes) + " writes"
+        if self.dropped > 0:
+            text += ", " + str(self.dropped) + " rows dropped (writer could not keep up)"
+        return text
@@ -0,0 +1,321 @@
+#
+# deviceManager.py
+# Version 1.0, Oct 2026
+#
+# Finds and opens the serial devices of the NMR shuttle: the motor driver,
+# the Julabo heater/chiller, the sensor Arduino and the flow direction valve
+# Arduino.
+#
+# Devices are recognised by USB description or serial number (DEVICES). The
+# port of each device is saved in a cache file (deviceCache.json, next to
+# this file), so the ports are only scanned when a device is not where it
+# was last found. A cached port is checked by reading the USB information
+# of that port alone (on Linux), which is much quicker than listing every
+# port.
+#
+# Connections are kept open for the rest of the process, so a device opened
+# again (e.g. by a new dyneo or valves object) is not reopened. Opening the
+# port of an Arduino normally resets it, after which it does not reply for a
+# couple of seconds. On Linux and macOS the port is left with HUPCL cleared,
+# so that DTR is not dropped when the port is closed and the next open does
+# not reset the board; on Windows DTR is not raised on open. Instead of
+# waiting a fixed time, a device with a probe command is asked until it
+# replies.
+#
+# A device opened by another library (e.g. the motor by PyTrinamic) is
+# opened with openWith(), which scans the ports again if the cached port
+# cannot be opened, as connect() does.
+#
+# The time taken to find and open each device and the round trip time of
+# each command (from a write to the first reply data) are recorded.
+#
+# Usage:
+#   port = deviceManager.connect('valves')      # open serial port (shared)
+#   motorPort = deviceManager.findPort('motor') # port name only
+#   interface = deviceManager.openWith('motor', serial_tmcl_interface)
+#   print(deviceManager.summary())
+#
+
+import json, os, sys, time
+import serial
+import serial.tools.list_ports as list_ports
+
+try:
+    import termios
+except ImportError:
+    termios = None
+
+
+# Device name: USB attribute and value used to recognise it, serial settings,
+# whether opening the port may reset it, and a command it always answers
+DEVICES = {
+    'motor':   {'match': ('description', 'Trinamic Stepper Device')},
+    'julabo':  {'match': ('description', 'CORIO'),
+                'settings': {'baudrate': 4800, 'bytesize': 7, 'parity': serial.PARITY_EVEN, 'stopbits': 1, 'timeout': 0.1}},
+    'sensors': {'match': ('serial_number', '55739323637351819251'),
+                'settings': {'baudrate': 9600, 'timeout': 0.1}, 'arduino': True},
+    'valves':  {'match': ('serial_number', '55736323239351918101'),
+                'settings': {'baudrate': 9600, 'timeout': 0.1}, 'arduino': True, 'probe': b'STATUS\n'},
+}
+
+# Longest time for an Arduino to start after a reset (s)
+RESET_TIME = 3.0
+
+CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deviceCache.json')
+
+
+
+class timedPort(object):
+    # Serial port which records the time from each write to the first data
+    # read after it. Other attributes are those of the port.
+
+    def __init__(self, port, name, manager):
+        self.port = port
+        self.name = name
+        self.manager = manager
+        self.sent = None
+
+
+    def __getattr__(self, name):
+        return getattr(self.port, name)
+
+
+    def write(self, data):
+        self.sent = time.time()
+        return self.port.write(data)
+
+
+    def _received(self, data):
+        if self.sent is not None and len(data) > 0:
+            self.manager.record(self.name, 'roundTrip', time.time() - self.sent)
+            self.sent = None
+        return data
+
+
+    def read(self, size=1):
+        return self._received(self.port.read(size))
+
+
+    def readline(self):
+        return self._received(self.port.readline())
+
+
+    def read_all(self):
+        return self._received(self.port.read_all())
+
+
+    def close(self):
+        # The connection stays open for the rest of the process
+        pass
+
+
+
+class deviceManager(object):
+
+    def __init__(self, cachePath=CACHE_PATH, devices=DEVICES):
+        self.cachePath = cachePath
+        self.devices = devices
+        self.cache = self._readCache()
+        self.connections = {}
+        self.timings = {}
+
+        # Statistics
+        self.scans = 0
+        self.cacheHits = 0
+
+
+    def _readCache(self):
+        try:
+            with open(self.cachePath, 'r') as cacheFile:
+                return json.load(cacheFile)
+        except (IOError, OSError, ValueError):
+            return {}
+
+
+    def _writeCache(self):
+        try:
+            with open(self.cachePath, 'w') as cacheFile:
+                json.dump(self.cache, cacheFile, indent=1)
+        except (IOError, OSError):
+            pass    # the cache only saves time
+
+
+    def record(self, name, kind, value):
+        self.timings.setdefault(name, {}).setdefault(kind, []).append(value)
+
+
+    def _matches(self, name, info):
+        attribute, value = self.devices[name]['match']
+        return info is not None and getattr(info, attribute, None) == value
+
+
+    def _valid(self, name, port):
+        # Check a cached port. On Linux the USB information of the port is
+        # read; elsewhere the port is trusted if it exists, and connect() and
+        # openWith() scan again if it cannot be opened.
+        if sys.platform.startswith('linux'):
+            if not os.path.exists(port):
+                return False
+            try:
+                from serial.tools.list_ports_linux import SysFS
+                return self._matches(name, SysFS(port))
+            except (ImportError, IOError, OSError):
+                return False
+        return os.name == 'nt' or os.path.exists(port)
+
+
+    def _scan(self):
+        # List every port and cache the port of each known device
+        self.scans += 1
+        found = {}
+        for info in list_ports.comports():
+            for name in self.devices:
+                if self._matches(name, info):
+                    found[name] = info.device
+        self.cache = found
+        self._writeCache()
+        return found
+
+
+    def findPort(self, name):
+        # Port name of a device, or None if it is not connected
+        if name not in self.devices:
+            raise ValueError("Unknown device: " + str(name))
+        start = time.time()
+        port = self.cache.get(name)
+        if port is not None and self._valid(name, port):
+            self.cacheHits += 1
+        else:
+            port = self._scan().get(name)
+        self.record(name, 'find', time.time() - start)
+        return port
+
+
+    def connect(self, name, **settings):
+        # Open serial port of a device, or the one already opened by this
+        # process. settings override the serial settings in DEVICES. Raises
+        # IOError if the device is not found or cannot be opened.
+        if name in self.connections:
+            return self.connections[name]
+        start = time.time()
+        device = self.devices[name]
+        portSettings = dict(device.get('settings', {}))
+        portSettings.update(settings)
+        port = self.findPort(name)
+        try:
+            connection = self._open(port, portSettings, device.get('arduino', False))
+        except (IOError, OSError, serial.SerialException, TypeError, ValueError):
+            # Port may have changed since the cache was written
+            port = self._scan().get(name)
+            try:
+                connection = self._open(port, portSettings, device.get('arduino', False))
+            except (IOError, OSError, serial.SerialException, TypeError, ValueError):
+                raise IOError("Device not found: " + name)
+        if 'probe' in device:
+            self._waitForReply(connection, device['probe'])
+        self.record(name, 'open', time.time() - start)
+        self.connections[name] = timedPort(connection, name, self)
+        return self.connections[name]
+
+
+    def openWith(self, name, opener):
+        # Open a device with opener(port), for libraries which open the port
+        # themselves. Returns the result of opener. Raises IOError if the
+        # device is not found or cannot be opened.
+        start = time.time()
+        port = self.findPort(name)
+        try:
+            if port is None:
+                raise IOError("No port")
+            result = opener(port)
+        except Exception:
+            # Port may have changed since the cache was written (on Windows
+            # a cached port is not checked before it is used)
+            port = self._scan().get(name)
+            if port is None:
+                raise IOError("Device not found: " + name)
+            try:
+                result = opener(port)
+            except Exception:
+                raise IOError("Device not found: " + name)
+        self.record(name, 'open', time.time() - start)
+        return result
+
+
+    def _open(self, port, settings, arduino):
+        if port is None:
+            raise IOError("No port")
+        connection = serial.Serial()
+        connection.port = port
+        for key in settings:
+            setattr(connection, key, settings[key])
+        if arduino and os.name == 'nt':
+            connection.dtr = False
+        connection.open()
+        if arduino and termios is not None:
+            # Keep DTR raised when the port is closed, so that the next open does not reset the board
+            attributes = termios.tcgetattr(connection.fileno())
+            attributes[2] &= ~termios.HUPCL
+            termios.tcsetattr(connection.fileno(), termios.TCSANOW, attributes)
+        return connection
+
+
+    def _waitForReply(self, connection, probe):
+        # Send probe until the device replies (it may be starting after a reset)
+        end = time.time() + RESET_TIME
+        while True:
+            connection.reset_input_buffer()
+            connection.write(probe)
+            if len(connection.readline()) > 0:
+                connection.reset_input_buffer()
+                return
+            if time.time() > end:
+                raise IOError("No reply from device")
+            time.sleep(0.05)
+
+
+    def close(self, name=None):
+        # Close one device, or all of them
+        names = [name] if name is not None else list(self.connections)
+        for name in names:
+            connection = self.connections.pop(name, None)
+            if connection is not None:
+                connection.port.close()
+
+
+    def summary(self):
+        lines = []
+        for name in sorted(self.timings):
+            text = name + ":"
+            for kind in ('find', 'open', 'roundTrip'):
+                values = self.timings[name].get(kind, [])
+                if len(values) == 0:
+                    continue
+                text += " " + kind + " " + str(round(1000 * sum(values) / len(values), 1)) + " ms"
+                if len(values) > 1:
+                    text += " mean, " + str(round(1000 * max(values), 1)) + " ms max (" + str(len(values)) + ")"
+                text += ","
+            lines.append(text.rstrip(','))
+        lines.append(str(self.scans) + " port scans, " + str(self.cacheHits) + " cached ports used")
+        return "\n".join(lines)
+
+
+
+# Shared by everything in this process
+manager = deviceManager()
+
+
+def findPort(name):
+    return manager.findPort(name)
+
+
+def connect(name, **settings):
+    return manager.connect(name, **settings)
+
+
+def openWith(name, opener):
+    return manager.openWith(name, opener)
+
+
+def summary():
+    return manager.summary()
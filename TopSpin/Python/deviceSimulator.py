@@ -0,0 +1,515 @@
+#
+# deviceSimulator.py
+# Version 1.0, Oct 2026
+#
+# Simulated serial devices for testing and benchmarking without the lab
+# hardware (the motor module is simulated by tmcmSimulator.py):
+#   simulatedSensorArduino  sensor logger (NMRShuttle_Sensors.ino), sends a
+#                           '{T1, T2, T3, Hall (mV), set temp, actual temp}'
+#                           line every ~0.7 s
+#   simulatedJulabo         Julabo heater/chiller (HE/SE protocol: in_pv_00,
+#                           in_pv_02, in_sp_00, out_sp_00, out_mode_05, status...)
+#   simulatedValveArduino   flow direction valves (flowDirection.ino: SWITCH_ON,
+#                           SWITCH_OFF, SET_VALVE_ON/OFF, STATUS, POS, delay)
+#
+# Each device is a port object with the pyserial methods used by
+# sensorShield.py and julaboController.py (write, read, readline, readlines,
+# read_all, in_waiting, reset_input_buffer, close), so it can be passed to
+# them in place of a serial.Serial port:
+#   sens = sensorShield.sensorShield(transport=deviceSimulator.simulatedSensorArduino())
+#   dyneo = julaboController.dyneo(transport=deviceSimulator.simulatedJulabo())
+#
+# Characters arrive one at a time at the baud rate of the real device, after
+# the device's processing delay, and reads wait for them with the port
+# timeout as a real port does. The devices are emulated from the elapsed
+# time when the port is read or written, so no background threads are used.
+# The sensor Arduino and the Julabo share a bath model (julaboBath), in which
+# the bath approaches the set point with a limited heating/cooling rate and
+# the sample follows the bath. The Hall sensor reading can follow the
+# simulated motor through the field map (see motorField).
+#
+# Run this file to print the sensor stream and the round trip times of the
+# Julabo and valve commands:
+#   python deviceSimulator.py
+#
+
+import math, random, threading, time
+
+
+class simulatedPort(object):
+    # Serial port with the pyserial methods used by the drivers. Subclasses
+    # implement _command() for each line received and may use _update() and
+    # _nextEvent() to send data of their own accord.
+
+    def __init__(self, baudrate=9600, bitsPerChar=10, timeout=0.1, terminator=b'\n'):
+        self.baudrate = baudrate
+        self.charTime = bitsPerChar / float(baudrate)
+        self.timeout = timeout
+        self.terminator = terminator
+        self.lock = threading.RLock()
+        self.pending = []           # [start time, data] on the way to the host
+        self.buffer = bytearray()   # received by the host, not yet read
+        self.input = bytearray()    # received by the device, not yet a full line
+        self.lineFree = 0.0
+        self.writeEnd = 0.0         # time the last character written reaches the device
+        self.is_open = True
+        self.openTime = time.time()
+
+        # Statistics
+        self.commands = 0
+        self.bytesSent = 0
+
+
+    # Device side
+    def _update(self, now):
+        pass
+
+    def _nextEvent(self):
+        # Time at which the device will next send data of its own accord
+        return None
+
+    def _command(self, line, now):
+        pass
+
+    def _send(self, data, start):
+        # Queue device output, starting at time start or when the line is free
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        start = max(start, self.lineFree)
+        self.pending.append([start, bytes(data)])
+        self.lineFree = start + len(data) * self.charTime
+        self.bytesSent += len(data)
+
+
+    def _receive(self, now):
+        # Move characters which have arrived by now into the input buffer
+        self._update(now)
+        while len(self.pending) > 0:
+            start, data = self.pending[0]
+            n = min(len(data), int((now - start) / self.charTime))
+            if n <= 0:
+                break
+            self.buffer += data[:n]
+            if n == len(data):
+                self.pending.pop(0)
+            else:
+                self.pending[0] = [start + n * self.charTime, data[n:]]
+
+
+    def _nextArrival(self):
+        if len(self.pending) > 0:
+            return self.pending[0][0] + self.charTime
+        return self._nextEvent()
+
+
+    # Host side
+    def write(self, data):
+        with self.lock:
+            now = time.time()
+            data = bytearray(data)
+            self._receive(now)
+            self.writeEnd = now + len(data) * self.charTime
+            for i, char in enumerate(data):
+                self.input.append(char)
+                if self.input.endswith(self.terminator):
+                    line = bytes(self.input[:-len(self.terminator)]).decode('utf-8', 'replace')
+                    self.input = bytearray()
+                    self.commands += 1
+                    self._command(line, now + (i + 1) * self.charTime)
+            return len(data)
+
+
+    def _wait(self, size, until=None):
+        # Wait until size bytes (or the until character) have been received,
+        # with the port timeout running from the last character received
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        while True:
+            with self.lock:
+                now = time.time()
+                received = len(self.buffer)
+                self._receive(now)
+                if len(self.buffer) > received and deadline is not None:
+                    deadline = now + self.timeout
+                if len(self.buffer) >= size:
+                    return size
+                if until is not None and until in self.buffer:
+                    return self.buffer.index(until) + 1
+                if deadline is not None and now >= deadline:
+                    return min(size, len(self.buffer))
+                wake = self._nextArrival()
+            if wake is None:
+                wake = now + 0.01 if deadline is None else deadline
+            elif deadline is not None:
+                wake = min(wake, deadline)
+            time.sleep(max(wake - now, 0.0001))
+
+
+    def read(self, size=1):
+        n = self._wait(size)
+        with self.lock:
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            return data
+
+
+    def readline(self):
+        n = self._wait(float('inf'), b'\n'[0])
+        with self.lock:
+            data = bytes(self.buffer[:n])
+            del self.buffer[:n]
+            return data
+
+
+    def readlines(self):
+        lines = []
+        while True:
+            line = self.readline()
+            if len(line) == 0:
+                return lines
+            lines.append(line)
+
+
+    @property
+    def in_waiting(self):
+        with self.lock:
+            self._receive(time.time())
+            return len(self.buffer)
+
+
+    def read_all(self):
+        return self.read(self.in_waiting)
+
+
+    def reset_input_buffer(self):
+        with self.lock:
+            self._receive(time.time())
+            self.buffer = bytearray()
+
+
+    def flush(self):
+        # Wait until everything written has been sent
+        wait = self.writeEnd - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+
+    def close(self):
+        self.is_open = False
+
+
+
+class julaboBath(object):
+    # Bath and sample temperatures of the heater/chiller. The bath approaches
+    # the set point exponentially (time constant tau, s) with at most maxRate
+    # K/s, or drifts to ambient when switched off. The sample (external
+    # sensor) follows the bath with time constant sampleTau. Time runs
+    # speedup times faster than real time.
+
+    def __init__(self, temperature=21.0, ambient=21.0, tau=120.0, sampleTau=60.0,
+                 maxRate=0.1, speedup=1.0):
+        self.ambient = ambient
+        self.bath = temperature
+        self.sample = temperature
+        self.setpoint = 20.0
+        self.on = False
+        self.tau = tau
+        self.sampleTau = sampleTau
+        self.maxRate = maxRate
+        self.speedup = speedup
+        self.lastTime = time.time()
+        self.lock = threading.RLock()
+
+
+    def update(self, now=None):
+        with self.lock:
+            now = time.time() if now is None else now
+            elapsed = (now - self.lastTime) * self.speedup
+            if elapsed <= 0:
+                return
+            self.lastTime = now
+            steps = int(min(math.ceil(elapsed), 1000))
+            dt = elapsed / steps
+            for i in range(steps):
+                if self.on:
+                    target, tau = self.setpoint, self.tau
+                else:
+                    target, tau = self.ambient, 10 * self.tau
+                change = (target - self.bath) * (1 - math.exp(-dt / tau))
+                limit = self.maxRate * dt
+                self.bath += max(-limit, min(limit, change))
+                self.sample += (self.bath - self.sample) * (1 - math.exp(-dt / self.sampleTau))
+
+
+    def setTemperature(self, setpoint):
+        with self.lock:
+            self.update()
+            self.setpoint = setpoint
+
+
+    def switch(self, on):
+        with self.lock:
+            self.update()
+            self.on = on
+
+
+
+class simulatedSensorArduino(simulatedPort):
+    # NMRShuttle_Sensors.ino. Prints the start-up message after bootDelay and
+    # then one line of sensor values every conversionTime + interval seconds.
+    # field is a function returning the field strength at the Hall sensor
+    # (mT), e.g. from motorField(). Sensor faults are reported at random with
+    # probability faultRate per line.
+
+    BANNER = ("Adafruit MAX31865 PT100 & Adafruit ADS1115 ADC Sensor Test\r\n"
+              "ADC Range: +/- 0.512V (8x gain, 1 bit = 0.015625mV)\r\n")
+
+    def __init__(self, bath=None, field=None, interval=0.5, conversionTime=0.2, bootDelay=0.0,
+                 offset=0.0, sensitivity=51.5, faultRate=0.0, seed=None, timeout=0.1):
+        simulatedPort.__init__(self, baudrate=9600, timeout=timeout)
+        self.bath = julaboBath() if bath is None else bath
+        self.field = field
+        self.period = conversionTime + interval
+        self.conversionTime = conversionTime
+        self.offset = offset
+        self.sensitivity = sensitivity
+        self.faultRate = faultRate
+        self.sensorOffsets = (0.05, -0.08, 0.12)    # calibration of each PT100 (degC)
+        self.random = random.Random(seed)
+        self.lines = 0
+        self._send(self.BANNER, self.openTime + bootDelay)
+        self.nextLine = self.openTime + bootDelay + conversionTime
+
+
+    def _nextEvent(self):
+        return self.nextLine
+
+
+    def _update(self, now):
+        while self.nextLine <= now:
+            self._send(self.measure(self.nextLine), self.nextLine)
+            self.nextLine += self.period
+
+
+    def _analogTemperature(self, temperature):
+        # Julabo analogue output (-20 to 80 degC = 0 to 5 V) read by the
+        # Arduino's 10 bit ADC and converted back as in readDyneo()
+        reading = int(round((5.0 * (temperature + 20) / 100 - 0.032) * 1023 / 5.0))
+        reading = max(0, min(1023, reading))
+        return (reading * 5.0 / 1023 + 0.032) * 100 / 5 - 20
+
+
+    def _hallVoltage(self, field):
+        # ADS1115 reading (mV) as in readADC(): gain 16 below 64 mV, otherwise 8
+        voltage = self.offset + field * self.sensitivity / 1000 + self.random.gauss(0, 0.003)
+        gain = 16 if abs(voltage) < 64 else 8
+        voltage = max(-4096.0 / gain, min(4096.0 / gain, voltage))
+        return round(voltage * gain / 0.125) * 0.125 / gain
+
+
+    def measure(self, now):
+        self.bath.update(now)
+        self.lines += 1
+        text = ""
+        for sensor in range(3):
+            if self.faultRate > 0 and self.random.random() < self.faultRate:
+                text += "Sensor " + str(sensor + 1) + " Fault 0x40:  RTDIN- < 0.85 x Bias - FORCE- open\r\n"
+        temperatures = ["%.2f" % (self.bath.sample + offset + self.random.gauss(0, 0.02)) for offset in self.sensorOffsets]
+        field = 0.05 if self.field is None else self.field()
+        values = temperatures + ["%.4f" % self._hallVoltage(field),
+                                 "%.1f" % self._analogTemperature(self.bath.setpoint),
+                                 "%.1f" % self._analogTemperature(self.bath.sample)]
+        return text + "{" + ", ".join(values) + "}\r\n"
+
+
+
+class simulatedJulabo(simulatedPort):
+    # Julabo heater/chiller on its RS232 port (4800 baud, 7 data bits, even
+    # parity). Queries are answered after replyDelay seconds; out_ commands
+    # have no reply. Commands sent less than commandInterval seconds after the
+    # previous one are ignored, as by the real unit when sent too quickly.
+
+    def __init__(self, bath=None, replyDelay=0.05, commandInterval=0.0, seed=None, timeout=0.1):
+        simulatedPort.__init__(self, baudrate=4800, bitsPerChar=10, timeout=timeout, terminator=b'\r')
+        self.bath = julaboBath() if bath is None else bath
+        self.replyDelay = replyDelay
+        self.commandInterval = commandInterval
+        self.lastCommand = None
+        self.random = random.Random(seed)
+        self.ignored = 0
+
+
+    def _command(self, line, now):
+        if self.lastCommand is not None and now - self.lastCommand < self.commandInterval:
+            self.ignored += 1
+            return
+        self.lastCommand = now
+        self.bath.update(now)
+        words = line.strip().split()
+        if len(words) == 0:
+            return
+        command = words[0].lower()
+        reply = None
+        if command == 'version':
+            reply = "JULABO DYNEO DD VERSION 1.0"
+        elif command == 'status':
+            reply = "03 REMOTE START" if self.bath.on else "02 REMOTE STOP"
+        elif command == 'in_pv_00':
+            reply = "%.2f" % (self.bath.bath + self.random.gauss(0, 0.005))
+        elif command == 'in_pv_02':
+            reply = "%.2f" % (self.bath.sample + self.random.gauss(0, 0.005))
+        elif command == 'in_sp_00':
+            reply = "%.2f" % self.bath.setpoint
+        elif command == 'in_mode_05':
+            reply = "1" if self.bath.on else "0"
+        elif command in ('out_sp_00', 'out_mode_05') and len(words) == 2:
+            try:
+                value = float(words[1])
+            except ValueError:
+                reply = "-08 INVALID COMMAND"
+            else:
+                if command == 'out_sp_00':
+                    self.bath.setTemperature(value)
+                else:
+                    self.bath.switch(value != 0)
+        else:
+            reply = "-08 INVALID COMMAND"
+        if reply is not None:
+            self._send(reply + "\r\n", now + self.replyDelay)
+
+
+
+class simulatedValveArduino(simulatedPort):
+    # flowDirection.ino. The valves switch every switchDelay seconds while
+    # switched on, except during the hold time after a trigger from the
+    # spectrometer (trigger()). With ttlWorking=False the TTL input is
+    # reported as an error and triggers are ignored.
+
+    def __init__(self, switchDelay=300, holdDelay=10, ttlWorking=True, replyDelay=0.001, timeout=0.1):
+        simulatedPort.__init__(self, baudrate=9600, timeout=timeout)
+        self.switchDelay = switchDelay
+        self.holdDelay = holdDelay
+        self.ttlWorking = ttlWorking
+        self.errs = "" if ttlWorking else "ERROR: No signal from TTL input"
+        self.replyDelay = replyDelay
+        self.on = False
+        self.valveState = 0
+        self.hold = False
+        self.holdStart = 0.0
+        self.previous = self.openTime
+        self.switches = 0
+
+
+    def _toggle(self, n=1):
+        self.switches += n
+        if n % 2 == 1:
+            self.valveState = 1 - self.valveState
+
+
+    def _update(self, now):
+        # Switching loop of the Arduino program
+        if not self.on:
+            return
+        if self.hold:
+            if now - self.holdStart < self.holdDelay:
+                return
+            self.hold = False
+            end = self.holdStart + self.holdDelay
+            if end - self.previous >= self.switchDelay:
+                self.previous = end
+                self._toggle()
+        n = int((now - self.previous) // self.switchDelay)
+        if n > 0:
+            self.previous += n * self.switchDelay
+            self._toggle(n)
+
+
+    def trigger(self):
+        # TTL pulse from the spectrometer at the start of an acquisition
+        with self.lock:
+            now = time.time()
+            self._update(now)
+            if self.on and self.ttlWorking:
+                self.hold = True
+                self.holdStart = now
+
+
+    def _command(self, line, now):
+        self._update(now)
+        reply = None
+        if "SWITCH_ON" in line:
+            self.on = True
+            self.previous = now
+            reply = "ON"
+        elif "SWITCH_OFF" in line:
+            self.on = False
+            self.valveState = 0
+            reply = "OFF"
+        elif "SET_VALVE_ON" in line:
+            self.valveState = 1
+            reply = str(self.valveState)
+        elif "SET_VALVE_OFF" in line:
+            self.valveState = 0
+            reply = str(self.valveState)
+        elif "STATUS" in line:
+            if not self.on:
+                reply = "OFF"
+            elif len(self.errs) > 0:
+                reply = self.errs
+            elif self.hold:
+                reply = "HOLD"
+            else:
+                reply = "ON"
+        elif "POS" in line:
+            reply = str(self.valveState)
+        else:
+            # String.toInt(): leading integer, 0 if there is none
+            digits = ""
+            for char in line.strip():
+                if not char.isdigit():
+                    break
+                digits += char
+            if len(digits) > 0 and int(digits) > 0:
+                self.switchDelay = int(digits)
+                reply = "DELAY: " + digits
+        if reply is not None:
+            self._send(reply + "\r\n", now + self.replyDelay)
+
+
+
+def motorField(motor, fieldMap, circ, nStep):
+    # Field strength function for simulatedSensorArduino which follows a
+    # tmcmSimulator.simulatedMotor through a field map (fieldMapTable), with
+    # the sensor moving up as the motor position becomes negative, as in
+    # fieldMap.py. circ is the wheel circumference (cm), nStep the
+    # microsteps per revolution.
+    def field():
+        return fieldMap.fieldAt(max(0.0, -motor.position * circ / nStep))
+    return field
+
+
+
+if __name__ == '__main__':
+    import julaboController
+
+    bath = julaboBath(speedup=10)
+    sensors = simulatedSensorArduino(bath, seed=1)
+    dyneo = julaboController.dyneo(transport=simulatedJulabo(bath, seed=1))
+    valves = julaboController.valves(transport=simulatedValveArduino(switchDelay=2))
+
+    start = time.time()
+    dyneo.switchOn()
+    dyneo.setTemp(30)
+    print('Julabo status: ' + dyneo.checkStatus().strip())
+    for name, command in (('Julabo readTemp', dyneo.readTemp), ('Julabo checkStatus', dyneo.checkStatus),
+                          ('Valves checkStatus', valves.checkStatus), ('Valves readPosition', valves.readPosition)):
+        start = time.time()
+        for i in range(5):
+            command()
+        print(name + ': ' + str(round(200 * (time.time() - start), 1)) + ' ms per command')
+
+    valves.switchOn()
+    start = time.time()
+    while time.time() - start < 5:
+        for line in sensors.readlines():
+            print(line.decode('utf-8').strip() + '   valves: ' + valves.readPosition().strip())
+    print('Sensor lines: ' + str(sensors.lines) + ', valve switches: ' + str(valves.valves.switches))
@@ -0,0 +1,239 @@
+#
+# equilibration.py
+# Version 1.0, Oct 2026
+#
+# Decides when the sample temperature has settled after a change of set
+# point, from a stream of readings (the heater/chiller's external sensor,
+# or a sample PT100 on the sensor Arduino), instead of waiting a fixed time.
+#
+# The sample is ready when, over the last window seconds of readings:
+#   - the slope of a straight line fit, allowing for its uncertainty, would
+#     change the temperature by less than tolerance over another window;
+#   - the scatter about the line is within tolerance;
+#   - if a set point is given, the present temperature is within tolerance
+#     of it, allowing for the uncertainty of the fit.
+# Each test uses the normal quantile for the given confidence, e.g. 1.96
+# standard errors for 0.95. One outlier only widens the uncertainty a
+# little, rather than restarting the count as a fixed run of readings in
+# band would.
+#
+# The settling time is also predicted by fitting a first order approach,
+#   T(t) = final + amplitude * exp(-t / tau)
+# to the recent readings, from the point where the temperature was changing
+# fastest (before that the heater/chiller is ramping at its maximum rate).
+# The predicted and actual settling times are recorded by logResult() in a
+# JSON Lines file, to check the prediction and choose the tolerance and
+# confidence.
+#
+# Usage:
+#   detector = equilibration.equilibrationDetector(setpoint=25.0, tolerance=0.1, confidence=0.95)
+#   while not detector.ready():
+#       detector.add(time.time(), dyneo.readTemp())
+#       time.sleep(1)
+#   equilibration.logResult('equilibration.jsonl', detector.result())
+#
+
+import datetime, json, math
+import numpy as np
+
+
+# Time constants tried when fitting the approach (s)
+TAU_GRID = np.logspace(np.log10(2.0), np.log10(7200.0), 80)
+
+
+def normalQuantile(p):
+    # Inverse of the standard normal distribution function, by bisection
+    # (statistics.NormalDist needs Python 3.8)
+    if not 0 < p < 1:
+        raise ValueError("Probability must be between 0 and 1")
+    low, high = -40.0, 40.0
+    for i in range(100):
+        middle = (low + high) / 2.0
+        if 0.5 * (1 + math.erf(middle / math.sqrt(2))) < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2.0
+
+
+def fitApproach(t, values):
+    # Least squares fit of values = final + amplitude * exp(-(t - t[0]) / tau).
+    # Returns (final, amplitude, tau, rms residual), or None if there are
+    # too few points. tau is limited to TAU_GRID.
+    t = np.asarray(t, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if len(t) < 4:
+        return None
+    best = None
+    for tau in TAU_GRID:
+        design = np.column_stack((np.ones(len(t)), np.exp(-(t - t[0]) / tau)))
+        coefficients, residuals, rank, sv = np.linalg.lstsq(design, values, rcond=None)
+        if rank < 2:
+            continue
+        sse = float(np.sum((design.dot(coefficients) - values)**2))
+        if best is None or sse < best[3]:
+            best = (float(coefficients[0]), float(coefficients[1]), float(tau), sse)
+    if best is None:
+        return None
+    return best[:3] + (math.sqrt(best[3] / len(t)),)
+
+
+def logResult(path, result):
+    # Append a result (see equilibrationDetector.result()) to a JSON Lines file
+    if not path:
+        return
+    record = {'type': 'equilibration', 'time': datetime.datetime.now().isoformat()}
+    record.update(result)
+    with open(path, 'a') as log:
+        log.write(json.dumps(record) + "\n")
+
+
+
+class equilibrationDetector(object):
+
+    def __init__(self, setpoint=None, tolerance=0.1, confidence=0.95, window=30.0,
+                 fitWindow=180.0, minSamples=10, start=None):
+        # setpoint: temperature to reach, or None to wait only for the
+        #   temperature to stop changing
+        # tolerance: allowed deviation (degC)
+        # confidence: confidence level of the tests (0...1)
+        # window: length of the stability tests (s)
+        # fitWindow: length of the readings fitted to predict the settling time (s)
+        # start: time of the set point change (s, defaults to the first reading)
+        if not 0 < confidence < 1:
+            raise ValueError("Confidence must be between 0 and 1")
+        self.setpoint = setpoint
+        self.tolerance = tolerance
+        self.confidence = confidence
+        self.z = normalQuantile((1 + confidence) / 2.0)
+        self.window = window
+        self.fitWindow = fitWindow
+        self.minSamples = minSamples
+        self.start = start
+        self.times = []
+        self.values = []
+        self.readyTime = None
+        self.fit = None
+        self.predictions = []       # (time of prediction, predicted settling time), s from start
+
+        # Statistics
+        self.samples = 0
+        self.missing = 0
+
+
+    def add(self, t, value):
+        # Add a reading (time in s, temperature). None (no reading) is skipped.
+        if value is None or value != value:
+            self.missing += 1
+            return
+        if self.start is None:
+            self.start = t
+        self.times.append(float(t))
+        self.values.append(float(value))
+        self.samples += 1
+        # Readings older than the fit window are no longer needed
+        if self.times[0] < t - max(self.window, self.fitWindow):
+            first = np.searchsorted(self.times, t - max(self.window, self.fitWindow))
+            del self.times[:first], self.values[:first]
+
+
+    def extend(self, times, values):
+        for t, value in zip(times, values):
+            self.add(t, value)
+
+
+    def stability(self):
+        # Straight line fit to the last window seconds of readings. Returns
+        # (level at the latest reading, slope, standard error of the level,
+        # standard error of the slope, rms scatter), or None if there are
+        # too few readings or they do not yet span the window.
+        if len(self.times) < self.minSamples:
+            return None
+        t = np.asarray(self.times)
+        inWindow = t >= t[-1] - self.window
+        if t[-1] - t[0] < self.window or np.count_nonzero(inWindow) < self.minSamples:
+            return None
+        t = t[inWindow]
+        values = np.asarray(self.values)[inWindow]
+        n = len(t)
+        dt = t - t.mean()
+        sxx = float(np.sum(dt**2))
+        if sxx == 0:
+            return None
+        slope = float(np.sum(dt * (values - values.mean())) / sxx)
+        residuals = values - values.mean() - slope * dt
+        scatter = math.sqrt(float(np.sum(residuals**2)) / (n - 2))
+        level = float(values.mean() + slope * dt[-1])
+        levelError = scatter * math.sqrt(1.0 / n + dt[-1]**2 / sxx)
+        return level, slope, levelError, scatter / math.sqrt(sxx), scatter
+
+
+    def predict(self):
+        # Fit the approach to the recent readings and predict when the
+        # temperature will be within tolerance of its final value. Returns
+        # the predicted settling time (s from start), or None.
+        if len(self.times) < self.minSamples:
+            return None
+        t = np.asarray(self.times)
+        values = np.asarray(self.values)
+        recent = t >= t[-1] - self.fitWindow
+        t, values = t[recent], values[recent]
+        
+        # Fit from the start of the window with the largest rate of change
+        edges = np.searchsorted(t, np.arange(t[0], t[-1], self.window))
+        if len(edges) > 2:
+            rates = np.abs(np.diff(values[edges]) / np.diff(t[edges]))
+            first = edges[int(np.argmax(rates))]
+            t, values = t[first:], values[first:]
+        self.fit = fitApproach(t, values)
+        if self.fit is None:
+            return None
+        final, amplitude, tau, rms = self.fit
+        
+        # Time at which the fit comes within tolerance of the set point (or
+        # of its final value if there is no set point)
+        remaining = self.tolerance
+        if self.setpoint is not None:
+            remaining -= abs(final - self.setpoint)
+        if tau >= TAU_GRID[-1] or remaining <= 0:
+            # Not settling, or settling away from the set point
+            return None
+        settle = t[0]
+        if abs(amplitude) > remaining:
+            settle += tau * math.log(abs(amplitude) / remaining)
+        predicted = settle - self.start
+        self.predictions.append((self.times[-1] - self.start, predicted))
+        return predicted
+
+
+    def ready(self):
+        # True once the readings show the temperature has settled
+        if self.readyTime is not None:
+            return True
+        stats = self.stability()
+        if stats is None:
+            return False
+        level, slope, levelError, slopeError, scatter = stats
+        if (abs(slope) + self.z * slopeError) * self.window > self.tolerance:
+            return False
+        if self.z * scatter > self.tolerance:
+            return False
+        if self.setpoint is not None and abs(level - self.setpoint) + self.z * levelError > self.tolerance:
+            return False
+        self.readyTime = self.times[-1]
+        return True
+
+
+    def result(self):
+        # Summary of the settling, for logResult()
+        predicted = [p for tp, p in self.predictions]
+        stats = self.stability()
+        return {'setpoint': self.setpoint, 'tolerance': self.tolerance, 'confidence': self.confidence,
+                'window': self.window,
+                'actual': None if self.readyTime is None else self.readyTime - self.start,
+                'predictedFirst': predicted[0] if len(predicted) > 0 else None,
+                'predictedLast': predicted[-1] if len(predicted) > 0 else None,
+                'predictions': self.predictions,
+                'final': None if stats is None else stats[0],
+                'tau': None if self.fit is None else self.fit[2],
+                'samples': self.samples, 'missing': self.missing}
@@ -0,0 +1,327 @@
+#
+# fieldMapTable.py
+# Version 1.0, Oct 2026
+#
+# Field map lookups for the NMR shuttle.
+#
+# Loads the measured field map (fieldMap.csv, columns 'Position (cm), Field
+# Strength (mT)') once, checks it, and gives the field strength at a distance
+# from the magnet centre (fieldAt) or the distance for a given field strength
+# (distanceAt). Lookups use a binary search, so they cost the same for dense
+# automatically recorded maps as for sparse ones. Arrays of values are looked
+# up in one call if NumPy is available. Linear or monotone cubic (PCHIP)
+# interpolation may be chosen.
+#
+# The first time a field map is loaded, the lookup tables and fit parameters
+# are saved next to it in a binary cache file (fieldMap.cache.npy, a float64
+# .npy array). Later loads memory map the cache file instead of parsing the
+# CSV file. The cache is rebuilt when the modification time or size of the
+# CSV file changes and its contents (CRC32) no longer match.
+#
+# This module must also run in TopSpin's Jython interpreter (runNMRShuttle.py),
+# so NumPy is optional. Without NumPy the cache file is read with the array
+# module instead.
+#
+
+import array, bisect, math, os, struct, sys, zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _pchipSlopes(x, y):
+    # Derivatives at each point for monotone cubic interpolation
+    # (Fritsch-Carlson method, as used by scipy.interpolate.PchipInterpolator)
+    n = len(x)
+    h = [x[i+1] - x[i] for i in range(n - 1)]
+    delta = [(y[i+1] - y[i]) / h[i] for i in range(n - 1)]
+    if n == 2:
+        return [delta[0], delta[0]]
+    d = [0.0] * n
+    for i in range(1, n - 1):
+        if delta[i-1] * delta[i] > 0:
+            w1 = 2 * h[i] + h[i-1]
+            w2 = h[i] + 2 * h[i-1]
+            d[i] = (w1 + w2) / (w1 / delta[i-1] + w2 / delta[i])
+    d[0] = _pchipEndSlope(h[0], h[1], delta[0], delta[1])
+    d[-1] = _pchipEndSlope(h[-1], h[-2], delta[-1], delta[-2])
+    return d
+
+
+def _pchipEndSlope(h0, h1, delta0, delta1):
+    d = ((2 * h0 + h1) * delta0 - h0 * delta1) / (h0 + h1)
+    if d * delta0 <= 0:
+        return 0.0
+    if delta0 * delta1 <= 0 and abs(d) > abs(3 * delta0):
+        return 3 * delta0
+    return d
+
+
+def _fitParameters(distanceValues, fieldValues, B0):
+    # Least squares fit of B(z) = B0/(1+(z/a)^b) (see README) using
+    # log(B0/B - 1) = b*log(z) - b*log(a). Returns (B0, a, b).
+    x = []
+    y = []
+    for z, B in zip(distanceValues, fieldValues):
+        if z > 0 and 0 < B < 0.999 * B0:
+            x.append(math.log(z))
+            y.append(math.log(B0 / B - 1))
+    if len(x) < 2:
+        return (B0, float('nan'), float('nan'))
+    xMean = sum(x) / len(x)
+    yMean = sum(y) / len(y)
+    sxx = sum([(xi - xMean)**2 for xi in x])
+    if sxx == 0:
+        return (B0, float('nan'), float('nan'))
+    b = sum([(xi - xMean) * (yi - yMean) for xi, yi in zip(x, y)]) / sxx
+    a = math.exp(xMean - yMean / b)
+    return (B0, a, b)
+
+
+def _buildTables(distanceValues, fieldValues, tolerance):
+    # Check field map and calculate the forward and inverse lookup tables
+    distanceValues = [float(z) for z in distanceValues]
+    fieldValues = [float(B) for B in fieldValues]
+    if len(distanceValues) < 2 or len(distanceValues) != len(fieldValues):
+        raise ValueError("Field map must contain at least two points.")
+    for i in range(1, len(distanceValues)):
+        if distanceValues[i] <= distanceValues[i-1]:
+            raise ValueError("Field map distances must be strictly increasing (line " + str(i + 2) + ").")
+
+    # Beyond the point of maximum field, the field must fall with distance.
+    # Small increases (less than tolerance * maximum field) are treated as
+    # measurement noise and removed for the inverse lookup.
+    peak = fieldValues.index(max(fieldValues))
+    lowest = fieldValues[peak]
+    inverseDistance = [distanceValues[peak]]
+    inverseField = [lowest]
+    for i in range(peak + 1, len(fieldValues)):
+        if fieldValues[i] - lowest > tolerance * fieldValues[peak]:
+            raise ValueError("Field strength must decrease with distance from the magnet centre (line " + str(i + 2) + ").")
+        if fieldValues[i] < lowest:
+            lowest = fieldValues[i]
+            inverseDistance.append(distanceValues[i])
+            inverseField.append(lowest)
+    if len(inverseField) < 2:
+        raise ValueError("Field map does not contain any decreasing field values.")
+    inverseField.reverse()
+    inverseDistance.reverse()
+
+    return {'distance': distanceValues,
+            'field': fieldValues,
+            'fieldSlopes': _pchipSlopes(distanceValues, fieldValues),
+            'inverseField': inverseField,
+            'inverseDistance': inverseDistance,
+            'inverseSlopes': _pchipSlopes(inverseField, inverseDistance),
+            'fit': _fitParameters(distanceValues, fieldValues, fieldValues[peak])}
+
+
+class _interpolator(object):
+    # Interpolation of y(x) for strictly increasing x. The values may be lists
+    # or (memory mapped) NumPy arrays.
+
+    def __init__(self, x, y, d, method):
+        if method not in ('linear', 'pchip'):
+            raise ValueError("Interpolation method must be 'linear' or 'pchip'.")
+        self.x = x
+        self.y = y
+        self.d = d
+        self.method = method
+        if np is not None:
+            self.xArray = np.asarray(x, dtype=float)
+            self.yArray = np.asarray(y, dtype=float)
+            self.dArray = np.asarray(d, dtype=float)
+
+    def scalar(self, x):
+        i = bisect.bisect_right(self.x, x) - 1
+        i = min(max(i, 0), len(self.x) - 2)
+        x0 = float(self.x[i])
+        h = float(self.x[i+1]) - x0
+        t = (x - x0) / h
+        y0 = float(self.y[i])
+        y1 = float(self.y[i+1])
+        if self.method == 'linear':
+            return y0 + (y1 - y0) * t
+        return (y0 * (1 + 2*t) * (1 - t)**2 + h * float(self.d[i]) * t * (1 - t)**2
+                + y1 * t**2 * (3 - 2*t) + h * float(self.d[i+1]) * t**2 * (t - 1))
+
+    def array(self, x):
+        if self.method == 'linear':
+            return np.interp(x, self.xArray, self.yArray)
+        i = np.clip(np.searchsorted(self.xArray, x, side='right') - 1, 0, len(self.x) - 2)
+        x0 = self.xArray[i]
+        h = self.xArray[i+1] - x0
+        t = (x - x0) / h
+        y0 = self.yArray[i]
+        y1 = self.yArray[i+1]
+        return (y0 * (1 + 2*t) * (1 - t)**2 + h * self.dArray[i] * t * (1 - t)**2
+                + y1 * t**2 * (3 - 2*t) + h * self.dArray[i+1] * t**2 * (t - 1))
+
+
+
+class fieldMapTable(object):
+
+    def __init__(self, distanceValues, fieldValues, method='linear', tolerance=0.005):
+        self._setTables(_buildTables(distanceValues, fieldValues, tolerance), method)
+
+
+    @classmethod
+    def fromTables(cls, tables, method='linear'):
+        # Create field map from precalculated tables (e.g. from a cache file)
+        table = cls.__new__(cls)
+        table._setTables(tables, method)
+        return table
+
+
+    def _setTables(self, tables, method):
+        self.tables = tables
+        self.distanceValues = tables['distance']
+        self.fieldValues = tables['field']
+        self.fitParameters = tuple(tables['fit'])
+        self.method = method
+        self.minDistance = float(self.distanceValues[0])
+        self.maxDistance = float(self.distanceValues[-1])
+        self.minField = float(tables['inverseField'][0])
+        self.maxField = float(tables['inverseField'][-1])
+        self.field = _interpolator(self.distanceValues, self.fieldValues, tables['fieldSlopes'], method)
+        self.inverse = _interpolator(tables['inverseField'], tables['inverseDistance'], tables['inverseSlopes'], method)
+
+
+    def fieldAt(self, z):
+        # Field strength (mT) at distance z (cm) from the magnet centre.
+        # Beyond the ends of the map the field at the nearest end is returned.
+        if np is not None and not isinstance(z, (int, float)):
+            z = np.clip(np.asarray(z, dtype=float), self.minDistance, self.maxDistance)
+            return self.field.array(z)
+        return self.field.scalar(min(max(float(z), self.minDistance), self.maxDistance))
+
+
+    def distanceAt(self, B):
+        # Distance (cm) from the magnet centre with field strength B (mT).
+        # Returns None (or NaN for arrays) if B is outside the field map.
+        if np is not None and not isinstance(B, (int, float)):
+            B = np.asarray(B, dtype=float)
+            outside = (B < self.minField) | (B > self.maxField)
+            z = self.inverse.array(np.clip(B, self.minField, self.maxField))
+            return np.where(outside, np.nan, z)
+        if B < self.minField or B > self.maxField:
+            return None
+        return self.inverse.scalar(float(B))
+
+
+
+# Layout of cache file: header values followed by the lookup tables
+CACHE_VERSION = 1
+CACHE_HEADER = 9      # version, mtime, size, crc32, n, m, fit B0, fit a, fit b
+CACHE_TABLES = (('distance', 'n'), ('field', 'n'), ('fieldSlopes', 'n'),
+                ('inverseField', 'm'), ('inverseDistance', 'm'), ('inverseSlopes', 'm'))
+
+
+def cachePath(path):
+    return os.path.splitext(path)[0] + '.cache.npy'
+
+
+def load(path, method='linear', cache=True):
+    # Read field map from CSV file (first line is a header), using the binary
+    # cache file if it is up to date.
+    info = os.stat(path)
+    values = None
+    if cache:
+        values = _readCache(cachePath(path))
+        if values is not None and float(values[1]) == info.st_mtime and int(values[2]) == info.st_size:
+            return fieldMapTable.fromTables(_tablesFromCache(values), method)
+
+    fieldMap = open(path, 'rb')
+    content = fieldMap.read()
+    fieldMap.close()
+    crc = zlib.crc32(content) & 0xffffffff
+
+    if values is not None and int(values[3]) == crc:
+        # File has been touched or copied but not changed
+        tables = _tablesFromCache(values)
+    else:
+        distanceValues = []
+        fieldValues = []
+        for line in content.decode('utf-8').splitlines()[1:]:
+            if line.strip() == '':
+                continue
+            value = line.split(',')
+            distanceValues.append(float(value[0]))
+            fieldValues.append(float(value[1]))
+        tables = _buildTables(distanceValues, fieldValues, 0.005)
+
+    if cache:
+        try:
+            _writeCache(cachePath(path), info, crc, tables)
+        except (IOError, OSError):
+            pass    # e.g. read-only directory; the cache is only an optimisation
+    return fieldMapTable.fromTables(tables, method)
+
+
+def _tablesFromCache(values):
+    lengths = {'n': int(values[4]), 'm': int(values[5])}
+    tables = {'fit': [float(v) for v in values[6:CACHE_HEADER]]}
+    i = CACHE_HEADER
+    for name, length in CACHE_TABLES:
+        tables[name] = values[i:i + lengths[length]]
+        i += lengths[length]
+    return tables
+
+
+def _readCache(path):
+    # Returns cache values, or None if there is no valid cache file
+    try:
+        if np is not None:
+            values = np.load(path, mmap_mode='r')
+        else:
+            cacheFile = open(path, 'rb')
+            start = cacheFile.read(10)
+            if start[:6] != b'\x93NUMPY':
+                cacheFile.close()
+                return None
+            cacheFile.read(struct.unpack('<H', start[8:10])[0])
+            values = array.array('d')
+            content = cacheFile.read()
+            cacheFile.close()
+            if hasattr(values, 'frombytes'):
+                values.frombytes(content)
+            else:
+                values.fromstring(content)
+            if sys.byteorder == 'big':
+                values.byteswap()
+    except (IOError, OSError, ValueError):
+        return None
+    if len(values) < CACHE_HEADER or int(values[0]) != CACHE_VERSION:
+        return None
+    if len(values) != CACHE_HEADER + 3 * int(values[4]) + 3 * int(values[5]):
+        return None
+    return values
+
+
+def _writeCache(path, info, crc, tables):
+    # Write cache as a one dimensional float64 .npy file. The file is written
+    # without NumPy so that the cache can also be created from TopSpin.
+    values = [CACHE_VERSION, info.st_mtime, info.st_size, crc,
+              len(tables['distance']), len(tables['inverseField'])]
+    values += [float(v) for v in tables['fit']]
+    for name, length in CACHE_TABLES:
+        values += [float(v) for v in tables[name]]
+    data = array.array('d', values)
+    if sys.byteorder == 'big':
+        data.byteswap()
+
+    header = "{'descr': '<f8', 'fortran_order': False, 'shape': (" + str(len(values)) + ",), }"
+    header += ' ' * ((64 - (len(header) + 11) % 64) % 64) + '\n'
+    temporary = path + '.tmp'
+    cacheFile = open(temporary, 'wb')
+    cacheFile.write(b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin-1'))
+    cacheFile.write(data.tobytes() if hasattr(data, 'tobytes') else data.tostring())
+    cacheFile.close()
+    if hasattr(os, 'replace'):
+        os.replace(temporary, path)
+    else:
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(temporary, path)
@@ -18,29 +18,52 @@ HOLD, ERROR). The command 'POS' returns the postion of the valves (1= ON,
 'SET_VALVE_ON' and 'SET_VALVE_OFF'. The module is activated and deactivated 
 using the commands 'SWITCH_ON' and 'SWITCH_OFF'
 
+Commands can be run in a background thread with commandQueue, so that a
+user interface does not wait for the serial port. This module has no GUI
+or plotting dependencies (see julaboGUI.py for the user interface).
+
 """
-import serial, time, sys
-import serial.tools.list_ports as list_ports
+import time, sys, threading, queue
+import deviceManager
 
 
 
 class dyneo(object):
-    def __init__(self, GUI=False):
-        for device in list_ports.comports():
-            if device.description == 'CORIO':
-                port = device.device
+    def __init__(self, GUI=False, transport=None, commandInterval=0.1, replyTimeout=0.5):
+        # transport: port object to use instead of the serial port (e.g. deviceSimulator.simulatedJulabo)
+        # commandInterval: minimum time between commands (s), as the Julabo ignores commands sent too quickly
+        # replyTimeout: maximum time to wait for a reply (s)
+        self.commandInterval = commandInterval
+        self.replyTimeout = replyTimeout
+        self.lastCommand = 0.0
+        if transport is not None:
+            self.dyneo = transport
+            return
         try:
-            self.dyneo = serial.Serial(port=port, baudrate=4800, bytesize=7, parity=serial.PARITY_EVEN, stopbits=1, timeout=0.1)
-        except:
+            self.dyneo = deviceManager.connect('julabo')
+        except IOError:
             sys.exit(1)
     
     
-    def send(self, command):
+    def send(self, command, reply=True):
+        # Commands starting 'out_' have no reply, so set reply=False to
+        # return without waiting for one
+        wait = self.lastCommand + self.commandInterval - time.time()
+        if wait > 0:
+            time.sleep(wait)
         self.dyneo.reset_input_buffer()
         command = str(command) + "\r"
         self.dyneo.write(bytes(command.encode('utf-8')))
-        time.sleep(0.1) # 100 ms delay to allow Julabo time to respond
-        reply = self.dyneo.readline()
+        self.dyneo.flush()
+        self.lastCommand = time.time()
+        if not reply:
+            return None
+        
+        # Return as soon as the end of the reply arrives
+        reply = b''
+        endTime = time.time() + self.replyTimeout
+        while not reply.endswith(b'\n') and time.time() < endTime:
+            reply += self.dyneo.readline()
         if len(reply) > 0:
             reply = reply.decode('utf-8').strip('\n')
         else:
@@ -49,11 +72,11 @@ class dyneo(object):
         
     
     def switchOn(self):
-        self.send('out_mode_05 1')
+        self.send('out_mode_05 1', reply=False)
         
         
     def switchOff(self):
-        self.send('out_mode_05 0')
+        self.send('out_mode_05 0', reply=False)
 
 
     def readTemp(self):
@@ -65,28 +88,43 @@ class dyneo(object):
     
     
     def setTemp(self,setpoint):
-        self.send('out_sp_00 ' + str(setpoint))
+        self.send('out_sp_00 ' + str(setpoint), reply=False)
         print('Set temperature: ' + str(setpoint) + u'\N{DEGREE SIGN}C')
         
         
-    def setTemp_wait(self, setpoint):
+    def setTemp_wait(self, setpoint, tolerance=0.1, confidence=0.95, logPath=None, timeout=None):
+        # Wait until the temperature has settled within tolerance of the
+        # setpoint (see equilibration.py), or for timeout seconds. The
+        # predicted and actual settling times are added to logPath.
+        # Returns True if the temperature settled.
+        import equilibration     # needs NumPy, which is not needed for the other commands
         self.setTemp(setpoint)
         startTime = time.time()
-        
-        temp = self.readTemp()
+        detector = equilibration.equilibrationDetector(setpoint, tolerance, confidence, start=startTime)
         
         n = 0
-        while n < 60:
+        predicted = None
+        while not detector.ready():
+            if timeout is not None and time.time() - startTime > timeout:
+                break
             temp = self.readTemp()
-            print('\rActual temperature: ' + str(temp) + u'\N{DEGREE SIGN}C', end=' ')
-            if temp > setpoint-0.1 and temp < setpoint+0.1:
-                n += 1
-            else:
-                n = 0
+            detector.add(time.time(), temp)
+            n += 1
+            if n % 10 == 0:
+                predicted = detector.predict()
+            message = '\rActual temperature: ' + str(temp) + u'\N{DEGREE SIGN}C'
+            if predicted is not None:
+                message += '  Predicted settling time: ' + str(round(predicted)) + ' s'
+            print(message, end=' ')
             time.sleep(1)
     
         elapsedTime = round(time.time() - startTime)
-        print('\nSetpoint reached. Elapsed time: ' + str(elapsedTime))
+        equilibration.logResult(logPath, detector.result())
+        if detector.ready():
+            print('\nSetpoint reached. Elapsed time: ' + str(elapsedTime))
+        else:
+            print('\nSetpoint not reached after ' + str(elapsedTime) + ' s')
+        return detector.ready()
 
 
     def checkStatus(self):
@@ -103,14 +141,15 @@ class dyneo(object):
 
 
 class valves(object):
-    def __init__(self):
-        for device in list_ports.comports():
-            if device.serial_number == '55736323239351918101':
-                port = device.device
+    def __init__(self, transport=None):
+        # transport: port object to use instead of the serial port (e.g. deviceSimulator.simulatedValveArduino)
+        if transport is not None:
+            self.valves = transport
+            return
         try:
-            self.valves = serial.Serial(port=port, baudrate=9600, timeout=0.1)
-            time.sleep(2)  # Arduino takes a couple of seconds to wake up
-        except:
+            # Returns once the Arduino answers, rather than after a fixed wait for it to wake up
+            self.valves = deviceManager.connect('valves')
+        except IOError:
             raise AttributeError
     
     
@@ -157,3 +196,101 @@ class valves(object):
         sys.exit()
 
 
+
+
+
+class commandQueue(object):
+    # Runs the commands for one device (a dyneo or valves object) in a
+    # background thread, in the order they are submitted, so that the caller
+    # never waits for the serial port. Give each device its own queue and
+    # the Julabo and valve commands run at the same time.
+    #
+    # Results are passed to callbacks by poll(), in the thread that calls
+    # it, e.g. from a Tkinter timer (Tkinter must only be used from its own
+    # thread). Repeated queries can be given a key, so that a new one is
+    # skipped while the last is still waiting, rather than piling up behind
+    # a slow device.
+    #
+    # Usage:
+    #   julabo = julaboController.commandQueue(julaboController.dyneo())
+    #   julabo.submit(julabo.device.setTemp, (25.0,))
+    #   julabo.submit(julabo.device.readTemp, callback=showTemperature, key='temperature')
+    #   errors = julabo.poll()    # calls showTemperature(temperature) once read
+    
+    def __init__(self, device):
+        self.device = device
+        self.tasks = queue.Queue()
+        self.results = queue.Queue()
+        self.pending = set()
+        self.lock = threading.Lock()
+        
+        # Statistics
+        self.commands = 0
+        self.skipped = 0
+        self.errors = 0
+        
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+        
+        
+    def submit(self, function, args=(), callback=None, key=None):
+        # Queue function(*args); callback(result) is called by poll() once
+        # it has run. Returns False if skipped because a task with the same
+        # key has not finished.
+        with self.lock:
+            if key is not None:
+                if key in self.pending:
+                    self.skipped += 1
+                    return False
+                self.pending.add(key)
+        self.tasks.put((function, args, callback, key))
+        return True
+    
+    
+    def _run(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                self.tasks.task_done()
+                break
+            function, args, callback, key = task
+            result, error = None, None
+            try:
+                result = function(*args)
+            except Exception as err:
+                # e.g. device unplugged or an unexpected reply
+                error = err
+                self.errors += 1
+            self.commands += 1
+            with self.lock:
+                self.pending.discard(key)
+            self.results.put((callback, result, error))
+            self.tasks.task_done()
+            
+            
+    def poll(self):
+        # Call the callbacks of all finished tasks. Returns the list of
+        # exceptions raised by tasks.
+        errors = []
+        while True:
+            try:
+                callback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                return errors
+            if error is not None:
+                errors.append(error)
+            elif callback is not None:
+                callback(result)
+                
+                
+    def wait(self):
+        # Wait until all submitted tasks have run
+        self.tasks.join()
+        
+        
+    def close(self):
+        # Finish the submitted tasks and stop the thread
+        if self.thread.is_alive():
+            self.tasks.put(None)
+            self.thread.join()
@@ -15,9 +15,10 @@ import datetime as dt
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import matplotlib.animation as animation
 import julaboController
-import sys
+import livePlot
+import ringBuffer
+import sys, time
 
 # This is needed to allow matplotlib to work properly on Linux machine.
 matplotlib.use('TkAgg')
@@ -142,13 +143,17 @@ class gui(object):
         # Initialise plot, Julabo and valves. If valve module is not connected
         # then disable and grey out buttons.
         self.initialise_plot()
+        # Commands are sent by a background thread for each device, so the
+        # window does not freeze while waiting for replies.
         try:
             self.d = julaboController.dyneo()  
+            self.julabo = julaboController.commandQueue(self.d)
         except:
             errMsg("Dyneo not found")
             
         try:
             self.v = julaboController.valves()
+            self.valves = julaboController.commandQueue(self.v)
         except:
             self.valve_disable = True
             self.disableChildren(frame3)
@@ -159,7 +164,10 @@ class gui(object):
             
         
         # Animate plot
-        ani = animation.FuncAnimation(self.fig, self.animate, interval=200, blit=False)
+        # (livePlot redraws the plot itself, so a plain timer is used rather than FuncAnimation)
+        self.timer = self.fig.canvas.new_timer(interval=200)
+        self.timer.add_callback(self.animate, 0)
+        self.timer.start()
         
         self.window.mainloop()
     
@@ -184,40 +192,34 @@ class gui(object):
         canvas.get_tk_widget().grid(column=0, row=0, columnspan=3)
         
         self.ax = self.fig.add_subplot(1,1,1)
+        self.ax.set_ylabel('Temperature (\u00B0C)')
+        self.ax.xaxis.set_major_locator(plt.MaxNLocator(5))
+        
+        # Lines are created once and redrawn by livePlot
+        self.livePlot = livePlot.livePlot(self.fig)
+        self.livePlot.addLine(self.ax, 'setpoints', color='r', linestyle="dashed", label='Setpoint')
+        self.livePlot.addLine(self.ax, 'temps', color='g', label='Temperature')
         
-        # Create a blank list for each x and y dataset
-        self.xs =[]
-        self.setpoints = []
-        self.temps = []
+        # History of plotted values, for the number of time points set
+        self.history = ringBuffer.ringBuffer(int(self.TimePoints.get()), [('time', 'f8'), ('setpoints', 'f8'), ('temps', 'f8')])
         
         
     def plot(self, temperature):
-        # Add x and y to lists
-        self.xs.append(dt.datetime.now().strftime('%H:%M:%S'))
+        # Add values to history, resizing if the number of time points has changed
         try:
-            self.setpoints.append(float(self.set_temp.get()))
+            setpoint = float(self.set_temp.get())
         except:
-            self.setpoints.append(None)
-        self.temps.append(temperature)
-        
-        # Limit x and y lists to number of time points set (default is around 5 min)
+            setpoint = float('nan')
+        self.history.append((time.time(), setpoint, float('nan') if temperature is None else temperature))
         points = int(self.TimePoints.get())
-        self.xs = self.xs[-points:]
-        self.setpoints = self.setpoints[-points:]
-        self.temps = self.temps[-points:]
-        
-        # Draw plot
-        self.ax.clear()
-        self.ax.plot(self.xs, self.setpoints, color='r', linestyle="dashed", label='Setpoint')
-        self.ax.plot(self.xs, self.temps, color='g', label='Temperature')
-        
-        self.ax.set_ylabel('Temperature (\u00B0C)')
-        self.ax.xaxis.set_major_locator(plt.MaxNLocator(5))
+        if points != self.history.capacity:
+            self.history.resize(points)
+        history = self.history.view()
         
         
         # Set maximum and minimum plot limits either automatically or using 
         # settings given by user.
-        Temp_min, Temp_max = self.ax.get_ylim()
+        Temp_min, Temp_max = self.livePlot.dataLimits(self.ax) or self.ax.get_ylim()
         
         if self.Temp_autoscale_max.get() == 1:
             self.Temp_max.delete(0,tk.END)
@@ -238,7 +240,8 @@ class gui(object):
             except:
                 Temp_min = round(Temp_min-5,0)
             
-        self.ax.set_ylim(Temp_min, Temp_max)
+        # Draw plot
+        self.livePlot.update(history['time'], {'setpoints': history['setpoints'], 'temps': history['temps']}, {self.ax: (Temp_min, Temp_max)})
         
         
         
@@ -254,34 +257,39 @@ class gui(object):
         
         
     def switch_on(self):
-        self.d.setTemp(float(self.set_temp.get()))
-        self.d.switchOn()
+        self.julabo.submit(self.d.setTemp, (float(self.set_temp.get()),))
+        self.julabo.submit(self.d.switchOn)
         self.add_to_log('Julabo: ON\nSet temperature: ' + self.set_temp.get() + ' \u00B0C\n')
         if self.valve_disable == False and self.position_var.get() == 'Auto':
-            self.v.switchOn()
+            self.valves.submit(self.v.switchOn)
             self.set_valve_delay()
         self.on = True
         
     
     
     def switch_off(self):
-        self.d.switchOff()
+        self.julabo.submit(self.d.switchOff)
         if self.valve_disable == False:
-            self.v.switchOff()
+            self.valves.submit(self.v.switchOff)
         self.on = False
         self.add_to_log('Julabo: OFF\n')
          
     
     
     def measure_temperature(self):
-        self.errors = self.d.checkStatus()
+        # Runs in the Julabo command thread
+        return self.d.checkStatus(), self.d.readTemp()
+    
+    
+    
+    def show_temperature(self, reply):
+        self.errors, temperature = reply
         if self.errors == None:
             pass
         elif self.errors[0] == '-':
             self.add_to_log(self.errors, priority=True)
             self.errors = ''
         
-        temperature = self.d.readTemp()
         displayTemp = temperature
         
         try:
@@ -303,13 +311,19 @@ class gui(object):
         
         self.temp_var.set(str(displayTemp) + " \u00B0C")
         
-        return temperature
+        if self.on == True:
+            self.plot(temperature)
     
     
     
     def get_valve_state(self):
-        position = int(self.v.readPosition())
-        status = self.v.checkStatus()
+        # Runs in the valve command thread
+        return int(self.v.readPosition()), self.v.checkStatus()
+    
+    
+    
+    def show_valve_state(self, reply):
+        position, status = reply
 
         if status != self.valve_status:
             self.valve_status = status
@@ -327,7 +341,7 @@ class gui(object):
         # To stop the valve switching too quickly a minimum delay of 30 seconds
         # is enforced.
         if delay >= 30:
-            self.v.setDelay(delay)
+            self.valves.submit(self.v.setDelay, (delay,))
             self.add_to_log("Flow switching delay: " + str(delay) + "\n")
         else:
             self.add_to_log("Switching delay must be a minimum of 30 s\n")
@@ -336,26 +350,31 @@ class gui(object):
     def set_valve_position(self):
         position = self.position_var.get()
         if position == 'A':
-            self.v.switchOff()  # Stop the valve switching
+            self.valves.submit(self.v.switchOff)  # Stop the valve switching
             self.add_to_log("Manual override: Valve position A\n")
         elif position == 'B':
-            self.v.switchOff()  # Stop the valve switching
-            self.v.setPosition(1)   # Energise both valves
+            self.valves.submit(self.v.switchOff)  # Stop the valve switching
+            self.valves.submit(self.v.setPosition, (1,))   # Energise both valves
             self.add_to_log("Manual override: Valve position B\n")
         elif self.on == True:
-            self.v.switchOn()
+            self.valves.submit(self.v.switchOn)
             self.set_valve_delay()
         else:
-            self.v.switchOff()
+            self.valves.submit(self.v.switchOff)
         
     
     def animate(self, i):
-        temperature = self.measure_temperature()
+        # Show the replies received since the last call, then ask for new
+        # readings. A reading is not requested again until the last one has
+        # been received.
+        for error in self.julabo.poll():
+            self.add_to_log('Julabo: ' + str(error) + '\n', priority=True)
+        self.julabo.submit(self.measure_temperature, callback=self.show_temperature, key='temperature')
         
-        if self.on == True:
-            self.plot(temperature)
         if self.valve_disable == False:
-            self.get_valve_state()
+            for error in self.valves.poll():
+                self.add_to_log('Valves: ' + str(error) + '\n', priority=True)
+            self.valves.submit(self.get_valve_state, callback=self.show_valve_state, key='valves')
                 
                 
             
@@ -384,4 +403,5 @@ class errMsg(object):
         sys.exit(1)
         
         
-gui()
+if __name__ == '__main__':
+    gui()
@@ -0,0 +1,251 @@
+#
+# livePlot.py
+# Version 1.0, Oct 2026
+#
+# Fast real-time line plots for the sensor (sensorShield.py) and
+# heater/chiller (julaboGUI.py) dashboards.
+#
+# The lines are created once and updated in place with set_data(). Only the
+# lines are redrawn on each frame, over a saved copy of the rest of the
+# figure (blitting). The whole figure, with its axes, ticks and legend, is
+# redrawn only when the axis limits or the visible lines change. The time
+# axis is numeric (seconds since the epoch, labelled with the clock time),
+# and its limits move on in steps of a tenth of the window rather than on
+# every frame. Lines with more points than the axes are wide in pixels are
+# reduced to the minimum and maximum in each pixel column, which looks the
+# same but is much faster to draw.
+#
+# Usage:
+#   plot = livePlot.livePlot(fig)
+#   plot.addLine(ax, 'temp', color='g', label='Temperature')
+#   plot.update(times, {'temp': temps}, limits={ax: (20, 30)})
+#
+# Run this file for a headless benchmark of the old (clear and redraw every
+# frame) and new plotting methods:
+#   python livePlot.py [points] [frames]
+#
+
+import sys, time
+import numpy as np
+import matplotlib
+import matplotlib.ticker as ticker
+
+
+def clockTime(x, pos=None):
+    return time.strftime('%H:%M:%S', time.localtime(x))
+
+
+def decimate(x, y, columns):
+    # Minimum and maximum of y in each of columns bins, in order, so that
+    # peaks are kept. Returns x and y unchanged if they are short enough.
+    n = len(x)
+    if columns <= 0 or n <= 2 * columns:
+        return x, y
+    size = int(np.ceil(n / float(columns)))
+    starts = np.arange(0, n, size)
+    low = np.minimum.reduceat(y, starts)
+    high = np.maximum.reduceat(y, starts)
+    xs = np.repeat(x[starts], 2)
+    ys = np.empty(2 * len(starts))
+    ys[0::2] = low
+    ys[1::2] = high
+    return xs, ys
+
+
+
+class livePlot(object):
+
+    def __init__(self, fig, step=0.1):
+        self.fig = fig
+        self.canvas = fig.canvas
+        self.step = step
+        self.lines = {}
+        self.legendAxes = None
+        self.legendOptions = {}
+        self.background = None
+        self.redraw = True
+        self.canvas.mpl_connect('draw_event', self._onDraw)
+
+        # Statistics
+        self.frames = 0
+        self.fullDraws = 0
+
+
+    def addLine(self, ax, name, **style):
+        line, = ax.plot([], [], animated=True, **style)
+        ax.xaxis.set_major_formatter(ticker.FuncFormatter(clockTime))
+        self.lines[name] = line
+        return line
+
+
+    def legend(self, ax, **options):
+        # Legend on ax of all visible lines, updated when lines are shown or hidden
+        self.legendAxes = ax
+        self.legendOptions = options
+        self._updateLegend()
+
+
+    def _updateLegend(self):
+        if self.legendAxes is None:
+            return
+        ax = self.legendAxes
+        lines = [line for line in self.lines.values() if line.get_visible()]
+        if ax.get_legend() is not None:
+            ax.get_legend().remove()
+        if len(lines) > 0:
+            ax.legend(lines, [line.get_label() for line in lines], **self.legendOptions)
+
+
+    def dataLimits(self, ax):
+        # Minimum and maximum of the visible lines on ax, or None if there is no data
+        values = [line.get_ydata() for line in self.lines.values() if line.axes is ax and line.get_visible()]
+        values = [v for v in values if len(v) > 0]
+        if len(values) == 0:
+            return None
+        values = np.concatenate(values)
+        if np.all(np.isnan(values)):
+            return None
+        return float(np.nanmin(values)), float(np.nanmax(values))
+
+
+    def setVisible(self, name, visible):
+        line = self.lines[name]
+        if line.get_visible() != bool(visible):
+            line.set_visible(bool(visible))
+            self._updateLegend()
+            self.redraw = True
+
+
+    def _onDraw(self, event):
+        # Save the figure without the lines, then draw the lines on top
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self._drawLines()
+
+
+    def _drawLines(self):
+        for line in self.lines.values():
+            if line.get_visible():
+                line.axes.draw_artist(line)
+
+
+    def _setLimits(self, ax, xlim, ylim):
+        if xlim is not None and tuple(ax.get_xlim()) != xlim:
+            ax.set_xlim(xlim)
+            self.redraw = True
+        if ylim is not None and tuple(ax.get_ylim()) != ylim:
+            ax.set_ylim(ylim)
+            self.redraw = True
+
+
+    def timeLimits(self, ax, t):
+        # x limits covering times t, moved on in steps of a tenth of the window
+        if len(t) == 0:
+            return None
+        left, right = ax.get_xlim()
+        span = max(t[-1] - t[0], 1.0)
+        if t[0] < left or t[-1] > right or t[0] - left > 2 * self.step * span:
+            return (float(t[0]), float(t[0] + span * (1 + self.step)))
+        return (left, right)
+
+
+    def update(self, t, series, limits=None):
+        # Show series (dict of name: values) against times t (s since the
+        # epoch). limits is an optional dict of axes: (ymin, ymax).
+        t = np.asarray(t, dtype=float)
+        axes = set([line.axes for line in self.lines.values()])
+        for ax in axes:
+            self._setLimits(ax, self.timeLimits(ax, t), None if limits is None else limits.get(ax))
+
+        for name, values in series.items():
+            line = self.lines[name]
+            columns = int(line.axes.bbox.width)
+            line.set_data(*decimate(t, np.asarray(values, dtype=float), columns))
+
+        self.frames += 1
+        if self.redraw or self.background is None:
+            self.redraw = False
+            self.fullDraws += 1
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self.background)
+            self._drawLines()
+            self.canvas.blit(self.fig.bbox)
+        return list(self.lines.values())
+
+
+
+def _benchmark(points, frames):
+    # Time the old and new plotting methods with sensorShield's layout:
+    # two axes and six series of points samples, one sample added per frame
+    import datetime as dt
+    import matplotlib.pyplot as plt
+
+    names = ['PT100_1', 'PT100_2', 'PT100_3', 'Hall sensor', 'Set temperature', 'Sample temperature']
+    colors = ['#cf81d6', '#e5ea3f', '#cb4c3b', '#4986ae', '#6c49da', '#dbc2ba']
+    start = time.time() - points
+    t = list(start + np.arange(points, dtype=float))
+    data = [list(20 + np.random.randn(points)) for name in names]
+    labels = [dt.datetime.fromtimestamp(x).strftime('%H:%M:%S') for x in t]
+
+    def addSample(i):
+        t.append(t[-1] + 1)
+        labels.append(dt.datetime.fromtimestamp(t[-1]).strftime('%H:%M:%S'))
+        for values in data:
+            values.append(20 + np.random.randn())
+        del t[:-points], labels[:-points]
+        for values in data:
+            del values[:-points]
+
+    results = {}
+
+    # Old method: clear and replot everything with categorical time labels
+    fig = plt.figure(figsize=(12,5))
+    ax1 = fig.add_subplot(1, 2, 1)
+    ax2 = fig.add_subplot(1, 2, 2)
+    wall, cpu = time.time(), time.process_time()
+    for i in range(frames):
+        addSample(i)
+        ax1.clear()
+        ax2.clear()
+        lns = []
+        for n in range(len(names)):
+            ax = ax2 if n == 3 else ax1
+            lns += ax.plot(labels, data[n], color=colors[n], label=names[n])
+        ax1.tick_params(axis='x', rotation=90)
+        ax1.xaxis.set_major_locator(plt.MaxNLocator(10))
+        ax2.tick_params(axis='x', rotation=90)
+        ax2.xaxis.set_major_locator(plt.MaxNLocator(10))
+        ax1.legend(lns, [l.get_label() for l in lns], loc='upper center', bbox_to_anchor=(1.1, -0.35), ncol=6)
+        fig.canvas.draw()
+    results['old'] = (frames / (time.time() - wall), 1000 * (time.process_time() - cpu) / frames)
+    plt.close(fig)
+
+    # New method
+    fig = plt.figure(figsize=(12,5))
+    ax1 = fig.add_subplot(1, 2, 1)
+    ax2 = fig.add_subplot(1, 2, 2)
+    plot = livePlot(fig)
+    for n in range(len(names)):
+        plot.addLine(ax2 if n == 3 else ax1, names[n], color=colors[n], label=names[n])
+    plot.legend(ax1, loc='upper center', bbox_to_anchor=(1.1, -0.35), ncol=6)
+    limits = {ax1: (0.0, 40.0), ax2: (0.0, 40.0)}
+    wall, cpu = time.time(), time.process_time()
+    for i in range(frames):
+        addSample(i)
+        plot.update(t, dict(zip(names, data)), limits)
+    results['new'] = (frames / (time.time() - wall), 1000 * (time.process_time() - cpu) / frames)
+    plt.close(fig)
+    return results, plot.fullDraws
+
+
+
+if __name__ == '__main__':
+    matplotlib.use('Agg')
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 1500
+    frames = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    results, fullDraws = _benchmark(points, frames)
+    print(str(points) + " points, 6 series, " + str(frames) + " frames")
+    for method in ('old', 'new'):
+        fps, cpu = results[method]
+        print(method.capitalize() + ": " + str(round(fps,1)) + " frames per second, " + str(round(cpu,1)) + " ms CPU per frame")
+    print("Full redraws with new method: " + str(fullDraws))
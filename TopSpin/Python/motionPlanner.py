@@ -0,0 +1,317 @@
+#
+# motionPlanner.py
+# Version 1.0, Oct 2026
+#
+# Motion planner for the NMR shuttle.
+#
+# Calculates the trajectory (time, position, velocity and field strength) of
+# the sample for all three operation modes, taking into account the
+# acceleration limit and the rounding of speed and acceleration to TMCM motor
+# units. In velocity sweep mode the trajectory follows the same speed table
+# that is uploaded to the motor (see speedTable.py). The trajectory is made of
+# phases of constant acceleration, so the motion time (D10) is exact rather
+# than estimated by numerical integration. Points along the trajectory are
+# placed more densely where the field changes quickly.
+#
+# Can be run from the command line (used by runNMRShuttle.py for velocity
+# sweep and constant time modes when the shuttle service is not running,
+# since TopSpin's Jython interpreter does not have NumPy):
+#   python motionPlanner.py mode distance speed accel motionTime 'ramp'
+# Prints the result as one line of JSON and writes the predicted trajectory to
+# shuttleTrajectory.csv. distance may be a comma separated list (one
+# distance per 2D slice, from a VB list), in which case every distance is
+# planned: the result gives the speed and motion time of each ('speeds',
+# 'motionTimes'), the longest motion time ('motionTime') and the highest
+# speed ('speed'), and the trajectory of the longest move is saved.
+# In velocity sweep mode the ramp 'optimal' uses the time-optimal speed table
+# (see trajectoryOptimizer.py).
+#
+# The time of a constant velocity move (motionTime) needs no NumPy, so
+# runNMRShuttle.py plans constant velocity mode itself in TopSpin.
+#
+
+import json, math, sys
+import NMRShuttleSetup
+import fieldMapTable
+
+try:
+    import numpy as np
+    import speedTable
+    import trajectoryOptimizer
+    import velocityRamp
+except ImportError:
+    # TopSpin's Jython interpreter: only motionTime() may be used
+    np = None
+
+
+class motorUnits(object):
+    # Conversion between real units (cm/s, cm/s^2) and motor units.
+    # The TMCM-1060 works in internal units of pps/s whilst the TMCM-1160 uses arbitary 12 bit internal units
+    # These calculations are taken from pages 91 - 95 of the TMCM-1160 manual.
+
+    def __init__(self, model, circ, fullStepRot, uStepRes=8, pulseDiv=3, rampDiv=7):
+        if model not in ('TMCM-1160', 'TMCM-1060'):
+            raise ValueError("Invalid motor model.")
+        self.model = model
+        self.circ = float(circ)
+        self.NStep = fullStepRot * 2**uStepRes
+        if model == 'TMCM-1160':
+            self.speedFactor = (self.NStep * (2**pulseDiv) * 2048 * 32) / (16 * (10**6) * self.circ)
+            self.accelFactor = (self.NStep * (2**(rampDiv + pulseDiv + 29))) / ((16 * (10**6))**2 * self.circ)
+        else:
+            self.speedFactor = self.NStep / self.circ
+            self.accelFactor = self.NStep / self.circ
+
+    def speedToMotor(self, speed):
+        return int(speed * self.speedFactor)
+
+    def speedFromMotor(self, speed):
+        return speed / self.speedFactor
+
+    def accelToMotor(self, accel):
+        return int(accel * self.accelFactor)
+
+    def accelFromMotor(self, accel):
+        return accel / self.accelFactor
+
+    def steps(self, distance):
+        return int((distance * self.NStep) / self.circ)
+
+
+
+class motionPlan(object):
+    # Result of planMotion()
+
+    def __init__(self, phases, motorSpeed, motorAccel, table, fieldMap, points):
+        self.phases = phases
+        self.motorSpeed = motorSpeed
+        self.motorAccel = motorAccel
+        self.table = table
+        self.motionTime = sum([phase[3] for phase in phases])
+
+        # Sample each phase of constant acceleration. Phases in which the
+        # field changes a lot get more points.
+        fieldChange = [abs(fieldMap.fieldAt(z1) - fieldMap.fieldAt(z0)) if fieldMap is not None else 0.0
+                       for (z0, z1, v0, dt, a) in phases]
+        totalChange = sum(fieldChange) or 1.0
+        t = []
+        z = []
+        v = []
+        start = 0.0
+        for (z0, z1, v0, dt, a), change in zip(phases, fieldChange):
+            n = 2 + int(math.ceil(points * (0.5 * dt / (self.motionTime or 1.0) + 0.5 * change / totalChange)))
+            tLocal = np.linspace(0, dt, n)
+            t.append(start + tLocal)
+            z.append(z0 + v0 * tLocal + 0.5 * a * tLocal**2)
+            v.append(v0 + a * tLocal)
+            start += dt
+        if len(t) > 0:
+            self.t = np.concatenate(t)
+            self.z = np.concatenate(z)
+            self.v = np.concatenate(v)
+        else:
+            self.t = self.z = self.v = np.zeros(1)
+        self.B = fieldMap.fieldAt(self.z) if fieldMap is not None else None
+
+
+    def save(self, path):
+        if self.B is None:
+            data = np.column_stack((self.t, self.z, self.v))
+            header = "Time (s), Position (cm), Velocity (cm/s)"
+        else:
+            data = np.column_stack((self.t, self.z, self.v, self.B))
+            header = "Time (s), Position (cm), Velocity (cm/s), Field Strength (mT)"
+        np.savetxt(path, data, delimiter=',', newline='\n', header=header)
+
+
+
+def _limitPhases(bounds, limits, accel):
+    # Phases for a move from rest, where the speed limit changes at each
+    # position in bounds. As in the motor firmware, the speed only starts to
+    # change once the sample reaches the next position. Phases are given as
+    # (start, end, squared speed at start, d(speed^2)/dz).
+    phases = []
+    w = 0.0
+    for i in range(len(limits)):
+        z = bounds[i]
+        end = bounds[i+1]
+        wLimit = limits[i]**2
+        while z < end:
+            if w < wLimit:
+                z1 = min(end, z + (wLimit - w) / (2 * accel))
+                phases.append((z, z1, w, 2 * accel))
+                w = wLimit if z1 < end else w + 2 * accel * (z1 - z)
+            elif w > wLimit:
+                z1 = min(end, z + (w - wLimit) / (2 * accel))
+                phases.append((z, z1, w, -2 * accel))
+                w = wLimit if z1 < end else w - 2 * accel * (z1 - z)
+            else:
+                z1 = end
+                phases.append((z, z1, w, 0.0))
+            z = z1
+    return phases
+
+
+def _brake(phases, distance, accel):
+    # Limit the speed so that the sample can stop at the end of the move.
+    # Braking speed is given by w = 2 * accel * (distance - z).
+    result = []
+    for (z0, z1, w0, k) in phases:
+        f0 = w0 - 2 * accel * (distance - z0)
+        slope = k + 2 * accel
+        f1 = f0 + slope * (z1 - z0)
+        if f1 <= 0:
+            result.append((z0, z1, w0, k))
+        elif f0 >= 0:
+            result.append((z0, z1, 2 * accel * (distance - z0), -2 * accel))
+        else:
+            zc = z0 - f0 / slope
+            result.append((z0, zc, w0, k))
+            result.append((zc, z1, 2 * accel * (distance - zc), -2 * accel))
+
+    # Convert to (start, end, start speed, duration, acceleration)
+    phases = []
+    for (z0, z1, w0, k) in result:
+        if z1 <= z0:
+            continue
+        w1 = max(w0 + k * (z1 - z0), 0.0)
+        v0 = math.sqrt(max(w0, 0.0))
+        v1 = math.sqrt(w1)
+        if k == 0:
+            dt = (z1 - z0) / v0
+        else:
+            dt = (v1 - v0) / (k / 2)
+        phases.append((z0, z1, v0, dt, k / 2))
+    return phases
+
+
+def planMotion(distance, speed, accel, units, maxSpeed=None, ramp=None, fieldMap=None, points=200, table=None):
+    # Plan a move of distance (cm) at target speed (cm/s) and acceleration
+    # (cm/s^2). If ramp (a velocityRamp.velocityRamp) is given, the speed
+    # follows the speed table for the ramp (velocity sweep mode). A speed
+    # table (positions, speeds) may be given instead of the ramp (see
+    # trajectoryOptimizer.py).
+    phases, motorSpeed, motorAccel, table = _planPhases(distance, speed, accel, units, maxSpeed, ramp, table)
+    return motionPlan(phases, motorSpeed, motorAccel, table, fieldMap, points)
+
+
+def motionTime(distance, speed, accel, units, maxSpeed=None):
+    # Time (s) of a constant velocity move, as planned by planMotion()
+    phases = _planPhases(distance, speed, accel, units, maxSpeed, None, None)[0]
+    return sum([phase[3] for phase in phases])
+
+
+def _planPhases(distance, speed, accel, units, maxSpeed, ramp, table):
+    # Phases of the move, with the motor speed, acceleration and speed table
+    motorSpeed = units.speedToMotor(speed)
+    motorAccel = units.accelToMotor(accel)
+    if motorAccel <= 0:
+        raise ValueError("Acceleration is too low for the motor (CNST31).")
+    accel = units.accelFromMotor(motorAccel)
+    motorMaxSpeed = units.speedToMotor(maxSpeed) if maxSpeed is not None else None
+
+    if ramp is not None or table is not None:
+        if table is None:
+            positions, speeds = speedTable.buildSpeedTable(ramp, distance, motorSpeed, units.NStep, units.circ)
+        else:
+            positions, speeds = table
+        if motorMaxSpeed is not None:
+            speeds = [min(s, motorMaxSpeed) for s in speeds]
+        table = (positions, speeds)
+        bounds = [p * units.circ / units.NStep for p in positions]
+    else:
+        if motorSpeed <= 0:
+            raise ValueError("Speed is too low for the motor (CNST30).")
+        speeds = [min(motorSpeed, motorMaxSpeed) if motorMaxSpeed is not None else motorSpeed]
+        table = None
+        bounds = [0.0]
+
+    bounds = [b for b in bounds if b < distance] + [distance]
+    limits = [units.speedFromMotor(s) for s in speeds[:len(bounds) - 1]]
+    phases = []
+    if distance > 0:
+        phases = _brake(_limitPhases(bounds, limits, accel), distance, accel)
+    return phases, motorSpeed, motorAccel, table
+
+
+def speedForTime(distance, motionTime, accel, units, maxSpeed=None):
+    # Speed (cm/s) needed to complete a move in motionTime (constant time
+    # mode). The speed is rounded up to whole motor units so that the move
+    # does not take longer than motionTime, and is returned as the middle of
+    # that motor unit so that it converts back to the same value.
+    # The shortest possible time is set by the acceleration as rounded to
+    # motor units (accelerate to the middle of the move, then brake), and
+    # the speed may not exceed maxSpeed (cm/s).
+    motorAccel = units.accelToMotor(accel)
+    if motorAccel <= 0:
+        raise ValueError("Acceleration is too low for the motor (CNST31).")
+    accel = units.accelFromMotor(motorAccel)
+    minimumTime = 2 * math.sqrt(distance / accel)
+    if motionTime < minimumTime:
+        raise ValueError("Speed out of range! (CNST30)\nIncrease the sample motion time (D10) to at least " + str(round(minimumTime,3)) + " s.")
+    speed = 0.5 * (accel * motionTime - math.sqrt(accel) * math.sqrt(max(0.0, -4 * distance + accel * motionTime**2)))
+
+    # No higher speed is reached than at the middle of the move
+    limit = units.speedToMotor(math.sqrt(accel * distance)) + 1
+    if maxSpeed is not None:
+        limit = min(limit, units.speedToMotor(maxSpeed))
+    motorSpeed = units.speedToMotor(speed)
+    while motorSpeed <= limit and planMotion(distance, units.speedFromMotor(motorSpeed + 0.5), accel, units).motionTime > motionTime:
+        motorSpeed += 1
+    if motorSpeed > limit:
+        raise ValueError("Speed out of range! (CNST30)\nIncrease the sample motion time (D10).")
+    return units.speedFromMotor(motorSpeed + 0.5)
+
+
+
+def planArguments(arguments, setup, fieldMap=None, trajectory='shuttleTrajectory.csv'):
+    # Plan from the command line arguments of this program (mode distance
+    # speed accel motionTime ramp, as strings). Returns the result that is
+    # printed as JSON, with the message under 'error' if the motion cannot be
+    # planned. Also used by shuttleService.py, which has the field map loaded.
+    result = {}
+    try:
+        mode = int(arguments[0])
+        distances = [float(distance) for distance in str(arguments[1]).split(',')]
+        speed = float(arguments[2])
+        accel = float(arguments[3])
+        motionTime = float(arguments[4])
+        ramp = str(arguments[5])
+        units = motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)
+        if fieldMap is None:
+            fieldMap = fieldMapTable.load('fieldMap.csv')
+        rampProfile = None
+        optimal = mode == 2 and trajectoryOptimizer.isOptimal(ramp)
+        if optimal:
+            rateLimit = trajectoryOptimizer.sweepRateLimit(setup.sweepRateLimit, fieldMap)
+        elif mode == 2:
+            rampProfile = velocityRamp.velocityRamp(ramp, fieldMap)
+        elif mode not in (1, 3):
+            raise ValueError("Invalid value for operation mode (CNST11).")
+        plans = []
+        speeds = []
+        for distance in distances:
+            table = None
+            if optimal:
+                table = trajectoryOptimizer.optimalTable(distance, speed, accel, units, fieldMap, rateLimit, maxSpeed=setup.maxSpeed)
+            elif mode == 2:
+                rampProfile.validate(distance)
+            elif mode == 3:
+                speed = speedForTime(distance, motionTime, accel, units, maxSpeed=setup.maxSpeed)
+            plans.append(planMotion(distance, speed, accel, units, maxSpeed=setup.maxSpeed, ramp=rampProfile, fieldMap=fieldMap, table=table))
+            speeds.append(speed)
+        motionTimes = [plan.motionTime for plan in plans]
+        plans[motionTimes.index(max(motionTimes))].save(trajectory)
+        result['speed'] = max(speeds)
+        result['motionTime'] = max(motionTimes)
+        result['speeds'] = speeds
+        result['motionTimes'] = motionTimes
+    except (IOError, ValueError, IndexError) as err:
+        result['error'] = str(err)
+    return result
+
+
+
+if __name__ == '__main__':
+    setup = NMRShuttleSetup.NMRShuttle()
+    print(json.dumps(planArguments(sys.argv[1:7], setup)))
@@ -0,0 +1,300 @@
+#
+# motorSupervisor.py
+# Version 1.0, Oct 2026
+#
+# Adaptive supervision of the NMR shuttle motor.
+#
+# The firmware (NMRshuttle_1160_v4.tmc / NMRShuttle_1060_v4.tmc) increments
+# UserVariable12 each time the sample starts or stops moving or an error flag
+# is set. While the sample is parked the supervisor only reads this counter,
+# at a slower rate (50 ms, so that a move is seen to start within 50 ms of
+# the trigger). When the counter changes the position and error flag are
+# read, and while the sample is moving the light gate and stall flags are
+# checked at a fast rate as well, since the firmware does not check them
+# during a move. After any change of the counter (a move starting or ending,
+# or an error flag being set) the supervisor keeps polling at the fast rate
+# for fastPeriod seconds, since events come close together. Between polls the
+# supervisor waits on stdin, so that a STOP from TopSpin is handled
+# immediately.
+#
+# If a tmclBatch is given, the queries for each poll are sent together in one
+# round trip (see tmclBatch.py).
+#
+# Each move adds two to the counter (start and finish), so the number of moves
+# finished since the supervisor was started (while the sample was parked) is
+# half the change in the counter. A short move may start and finish between
+# two slow polls, leaving the position unchanged, so the caller counts moves
+# from self.arrivals rather than from changes of the position.
+#
+# When the firmware holds the next upward move until new settings have been
+# written (UserVariable15, e.g. between the slices of a variable field
+# experiment), the caller sets self.hold and the supervisor polls quickly
+# while the sample is parked as well, so that the end of the previous move
+# is seen without delay.
+#
+# The firmware also saves its tick timer (ms) when each move is triggered and
+# when it finishes (UserVariables 13 and 14). These are read with each event
+# and converted to host time, so that shuttleTelemetry.py can record exact
+# transit times.
+#
+# The number of TMCL queries and round trips and the time taken by each round
+# trip are recorded. The time between the poll that detected each event and
+# the poll before it is kept in self.latencies (an upper bound on how late the
+# event was seen), for comparing polling schemes, and its mean and maximum are
+# given by summary(). The time from each trigger
+# to the end of the move is recorded by shuttleTelemetry.py.
+#
+# Usage:
+#   supervisor = motorSupervisor.motorSupervisor(module)
+#   while ...:
+#       line = supervisor.wait()
+#       if supervisor.update(): ...
+#       while handled < supervisor.arrivals: ...
+#
+# Run this file to compare the bus load and latency with fixed 20 ms polling
+# using the simulated motor.
+#
+
+import select, sys, time
+
+
+POSITION = 8
+ERRFLAG = 9
+EVENTS = 12
+TRIGGER_TICK = 13
+ARRIVAL_TICK = 14
+
+# Global parameter holding the module tick timer (ms)
+TICK_TIMER = 132
+
+# Position states used by the firmware
+DOWN = 0
+UP = 1
+MOVING = 2
+
+# Error states (same as firmware error flag)
+NO_ERROR = 0
+SHUTDOWN = 1
+STALL = 2
+
+
+class motorSupervisor(object):
+
+    def __init__(self, module, fastInterval=0.02, slowInterval=0.05, stdin=None, batch=None, fastPeriod=1.0):
+        self.module = module
+        self.batch = batch
+        self.fastInterval = fastInterval
+        self.slowInterval = slowInterval
+        self.fastPeriod = fastPeriod
+        self.stdin = stdin
+        self.hold = False
+        self.fastUntil = 0.0
+
+        # Statistics
+        self.queries = 0
+        self.transfers = 0
+        self.missed = 0
+        self.latencies = []
+        self.roundTrips = []
+        self.startTime = time.time()
+        self.lastPoll = self.startTime
+
+        # Offset between host time (s) and module tick timer (ms)
+        sent = time.time()
+        tick = self.module.getGlobalParameter(TICK_TIMER, 0)
+        self.queries += 1
+        self.transfers += 1
+        self.tickOffset = (sent + time.time()) / 2 - tick / 1000.0
+
+        self.events = self._read(EVENTS)
+        self.startEvents = self.events
+        self.arrivals = 0
+        self.position = self._read(POSITION)
+        self.error = self._read(ERRFLAG)
+        self.triggerTick = self._read(TRIGGER_TICK)
+        self.arrivalTick = self._read(ARRIVAL_TICK)
+
+
+    def _read(self, index):
+        self.queries += 1
+        self.transfers += 1
+        return self.module.userVariable(index)
+
+
+    def tickToTime(self, tick):
+        # Convert module tick timer value to host time (s)
+        return self.tickOffset + tick / 1000.0
+
+
+    def interval(self):
+        # Poll quickly while the sample is moving or the next move is held,
+        # and for a while after any event; otherwise slowly
+        if self.position == MOVING or self.hold or self.lastPoll < self.fastUntil:
+            return self.fastInterval
+        return self.slowInterval
+
+
+    def wait(self):
+        # Wait until the next poll is due. Returns a line from stdin if one
+        # arrives in the meantime, otherwise None.
+        timeout = max(0.0, self.lastPoll + self.interval() - time.time())
+        if self.stdin is not None:
+            try:
+                ready = select.select([self.stdin], [], [], timeout)[0]
+            except (ValueError, OSError):
+                ready = []
+                time.sleep(timeout)
+            if ready:
+                line = self.stdin.readline()
+                if line == '':
+                    self.stdin = None    # stdin closed
+                return line.strip()
+        else:
+            time.sleep(timeout)
+        return None
+
+
+    def update(self):
+        # Poll the motor. Returns True if the position or error state changed.
+        now = time.time()
+        previous = self.lastPoll
+        self.lastPoll = now
+        if self.batch is not None:
+            changed = self._pollBatch()
+        else:
+            changed = self._poll()
+
+        # Moves finished since the start, including any that started and
+        # finished between this poll and the last one
+        arrivals = (self.events - self.startEvents) // 2
+        if arrivals > self.arrivals + 1:
+            self.missed += arrivals - self.arrivals - 1
+        self.arrivals = arrivals
+
+        if changed:
+            self.latencies.append(now - previous)
+            self.fastUntil = now + self.fastPeriod
+        return changed
+
+
+    def _poll(self):
+        changed = False
+        sent = time.time()
+        events = self._read(EVENTS)
+        self.roundTrips.append(time.time() - sent)
+        if events != self.events:
+            self.events = events
+            self.position = self._read(POSITION)
+            self.error = self._read(ERRFLAG)
+            self.triggerTick = self._read(TRIGGER_TICK)
+            self.arrivalTick = self._read(ARRIVAL_TICK)
+            changed = True
+
+        # The firmware only checks the light gate and stall flags while the
+        # sample is parked, so check them here during a move.
+        if self.position == MOVING and self.error == NO_ERROR:
+            self.queries += 1
+            self.transfers += 1
+            if self.module.digitalInput(10) == 0:
+                self.error = SHUTDOWN
+                return True
+            self.queries += 1
+            self.transfers += 1
+            if self.module.statusFlags() != 0:
+                self.error = STALL
+                return True
+        return changed
+
+
+    def _pollBatch(self):
+        # Same as _poll(), but read everything that might be needed in one round trip
+        moving = self.position == MOVING
+        self.batch.userVariable(EVENTS)
+        self.batch.userVariable(POSITION)
+        self.batch.userVariable(ERRFLAG)
+        self.batch.userVariable(TRIGGER_TICK)
+        self.batch.userVariable(ARRIVAL_TICK)
+        if moving:
+            self.batch.digitalInput(10)
+            self.batch.statusFlags()
+        sent = time.time()
+        values = self.batch.execute()
+        self.roundTrips.append(time.time() - sent)
+        self.queries += len(values)
+        self.transfers += 1
+
+        changed = False
+        if values[0] != self.events:
+            self.events, self.position, self.error, self.triggerTick, self.arrivalTick = values[:5]
+            changed = True
+        if moving and self.error == NO_ERROR:
+            if values[5] == 0:
+                self.error = SHUTDOWN
+                changed = True
+            elif values[6] != 0:
+                self.error = STALL
+                changed = True
+        return changed
+
+
+    def summary(self):
+        elapsed = time.time() - self.startTime
+        text = str(self.queries) + " motor queries (" + str(self.transfers) + " round trips) in " + str(round(elapsed,1)) + " s (" + str(round(self.transfers/max(elapsed, 1e-9),1)) + " round trips per second)"
+        if len(self.latencies) > 0:
+            text += ", events seen within " + str(round(1000*sum(self.latencies)/len(self.latencies),1)) + " ms mean, " + str(round(1000*max(self.latencies),1)) + " ms max"
+        if self.missed > 0:
+            text += ", " + str(self.missed) + " moves finished between polls"
+        return text
+
+
+
+def _fixedPolling(module, duration, interval=0.02):
+    # Previous supervision loop: four queries every 20 ms
+    queries = 0
+    latencies = []
+    position = module.userVariable(POSITION)
+    last = time.time()
+    end = last + duration
+    while time.time() < end:
+        now = time.time()
+        module.digitalInput(10)
+        module.statusFlags()
+        current = module.userVariable(POSITION)
+        module.actualPosition()
+        queries += 4
+        if current != position:
+            latencies.append(now - last)
+            position = current
+        last = now
+        time.sleep(interval)
+    return queries, latencies
+
+
+
+if __name__ == '__main__':
+    import tmcmSimulator, tmclBatch
+    duration = float(sys.argv[1]) if len(sys.argv) > 1 else 20.0
+
+    for name in ('Fixed 20 ms polling', 'Adaptive supervision', 'Adaptive supervision (batched)'):
+        myInterface = tmcmSimulator.simulatedInterface(upDelay=3.0, downDelay=3.0)
+        module = tmcmSimulator.simulatedTMCM(myInterface)
+        module.setMaxAcceleration(2000)
+        module.setMaxVelocity(1500)
+        module.setUserVariable(1, 50000)
+        startCommands = myInterface.commands
+        startTime = time.time()
+        if name == 'Fixed 20 ms polling':
+            queries, latencies = _fixedPolling(module, duration)
+        else:
+            batch = tmclBatch.tmclBatch(myInterface) if 'batched' in name else None
+            supervisor = motorSupervisor(module, batch=batch)
+            latencies = supervisor.latencies
+            while time.time() - startTime < duration:
+                supervisor.wait()
+                supervisor.update()
+        elapsed = time.time() - startTime
+        commands = myInterface.commands + myInterface.serial.writes - startCommands
+        myInterface.close()
+        print(name + ": " + str(commands) + " round trips in " + str(round(elapsed,1)) + " s (" + str(round(commands/elapsed,1)) + " per second), "
+              + str(len(latencies)) + " events, latency " + str(round(1000*sum(latencies)/max(len(latencies),1),1)) + " ms mean, "
+              + str(round(1000*max(latencies + [0]),1)) + " ms max")
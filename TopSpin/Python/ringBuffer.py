@@ -0,0 +1,141 @@
+#
+# ringBuffer.py
+# Version 1.0, Oct 2026
+#
+# Fixed capacity, thread safe buffer of the most recent samples (rows of a
+# NumPy structured array), shared by a reader thread which appends samples
+# and any number of consumers (plots, file writers, measurements) which take
+# snapshots of it.
+#
+# Samples are numbered in the order they are appended. count is the number
+# of samples appended so far, so a consumer can collect everything new with
+#   rows, index = buffer.since(index)
+# as long as it does so before the buffer has wrapped round (lost counts the
+# samples which were overwritten before a consumer read them).
+#
+# Each row is stored twice, at its slot and at slot + capacity, so the most
+# recent samples are always one contiguous block of memory. Appending costs
+# the same however full the buffer is, and view() returns them oldest first
+# without copying, e.g. for plotting or export. A view is only guaranteed
+# to be consistent if no other thread appends while it is in use; use
+# snapshot() for a copy. The capacity can be changed with resize(), which
+# keeps the most recent samples.
+#
+# Usage:
+#   buffer = ringBuffer.ringBuffer(1000, [('time', 'f8'), ('value', 'f8')])
+#   buffer.append((time.monotonic(), 1.0))
+#   rows = buffer.snapshot()            # chronological copy
+#   values = buffer.view()['value']     # chronological view, no copy
+#
+
+import threading, time
+import numpy as np
+
+
+class ringBuffer(object):
+
+    def __init__(self, capacity, dtype):
+        self.data = np.zeros(2 * capacity, dtype=dtype)
+        self.capacity = capacity
+        self.count = 0
+        self.held = 0
+        self.lost = 0
+        self.condition = threading.Condition()
+
+
+    def __len__(self):
+        return self.held
+
+
+    def _end(self):
+        # The last len(self) rows of data[:end] are the samples held, oldest first
+        return self.count % self.capacity + self.capacity
+
+
+    def _store(self, rows):
+        # Write rows (at most capacity) after the latest sample
+        slots = (self.count + np.arange(len(rows))) % self.capacity
+        self.data[slots] = rows
+        self.data[slots + self.capacity] = rows
+
+
+    def append(self, row):
+        with self.condition:
+            slot = self.count % self.capacity
+            self.data[slot] = row
+            self.data[slot + self.capacity] = row
+            self.count += 1
+            self.held = min(self.held + 1, self.capacity)
+            self.condition.notify_all()
+
+
+    def extend(self, rows):
+        rows = np.asarray(rows, dtype=self.data.dtype)
+        if len(rows) == 0:
+            return
+        with self.condition:
+            # Only the last capacity rows can be kept
+            skip = max(0, len(rows) - self.capacity)
+            self.count += skip
+            rows = rows[skip:]
+            self._store(rows)
+            self.count += len(rows)
+            self.held = min(self.held + len(rows) + skip, self.capacity)
+            self.condition.notify_all()
+
+
+    def resize(self, capacity):
+        # Change the capacity, keeping the most recent samples
+        with self.condition:
+            if capacity == self.capacity:
+                return
+            n = min(len(self), capacity)
+            rows = self.view(n).copy()
+            self.data = np.zeros(2 * capacity, dtype=self.data.dtype)
+            self.capacity = capacity
+            self.count -= n
+            self._store(rows)
+            self.count += n
+            self.held = n
+
+
+    def view(self, n=None):
+        # The last n samples (all samples held if n is None), oldest first,
+        # without copying
+        n = len(self) if n is None else max(0, min(n, len(self)))
+        end = self._end()
+        return self.data[end - n:end]
+
+
+    def snapshot(self, n=None):
+        # Copy of the last n samples (all samples held if n is None), oldest first
+        with self.condition:
+            return self.view(n).copy()
+
+
+    def since(self, index):
+        # Samples appended since sample number index, and the new index
+        with self.condition:
+            if index < self.count - self.held:
+                self.lost += self.count - self.held - index
+            return self.view(self.count - index).copy(), self.count
+
+
+    def latest(self):
+        with self.condition:
+            if self.count == 0:
+                return None
+            return self.data[self._end() - 1].copy()
+
+
+    def wait(self, index, timeout=None):
+        # Wait until there are samples after sample number index. Returns
+        # True if there are.
+        end = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.count <= index:
+                remaining = None if end is None else end - time.time()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return self.count > index
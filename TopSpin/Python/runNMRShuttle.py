@@ -13,29 +13,24 @@
 #	'popt'		- prompts user to enter number of experiments but will not execute 'zg'.
 #	'no_zg' 	- starts the motor script but will not execute 'zg'.
 #	'NO_TEMP'	- starts the motor script but not the temperature control.
+#	'SERIES'	- run by runNMRShuttleSeries.py, which has already set the temperature
+#			  and calculated the sample motion (D10 and CNST30). The result is
+#			  written to seriesStatus.json for runNMRShuttleSeries.py to check.
 #
 
 
 #Import libraries
-import os, math, time, subprocess, sys
+import os, math, time, subprocess, sys, json
 import NMRShuttleSetup
+import shuttleClient
+import acquisitionMonitor
+import fieldMapTable
+import motionPlanner
 
+#TopSpin keeps modules loaded between scripts, so pick up changes to the setup file (e.g. stall guard settings added by stallTuning.py)
+reload(NMRShuttleSetup)
 setup = NMRShuttleSetup.NMRShuttle()
 
-def interp(x, x_arr, y_arr):
-	for i, xi in enumerate(x_arr):
-		if xi >= x:
-			break    
-	else:
-		return None
-	if i == 0:
-		return None
-	x_min = x_arr[i-1]
-	y_min = y_arr[i-1]
-	y_max = y_arr[i]
-	factor = (x - x_min) / (xi - x_min)
-	return y_min + (y_max - y_min) * factor 
-	
 #Get current dataset
 curdat = CURDATA(cmdthread = None)
 if curdat == None:
@@ -46,20 +41,25 @@ if curdat == None:
 path = root.UtilPath.getTopspinHome()
 pypath = path + r'/exp/stan/nmr/py/user'
 
+#In a series, report the result to runNMRShuttleSeries.py, which runs this script with XCMD.
+#Until the acquisition completes the result is a failure, so any EXIT() stops the series.
+def reportStatus(status, message):
+	if "SERIES" in sys.argv:
+		statusFile = open(pypath + r'/seriesStatus.json', 'w')
+		json.dump({"status": status, "message": message}, statusFile)
+		statusFile.close()
+
+reportStatus("failed", "runNMRShuttle.py stopped before the acquisition completed.")
+
 #Set verion of python to use
 pyversion = 'python' + setup.pyversion
 
 #Open file containing experimental field map
-fieldMap = open(pypath+r'/fieldMap.csv', 'r') #Change the path here to the correct location of the field map file
-distanceValues = []
-fieldValues = []
-fieldMapValues = fieldMap.readlines()
-del fieldMapValues[0]		#Remove header line
-for i in fieldMapValues:
-	value = i.split(',')
-	distanceValues.append(float(value[0]))
-	fieldValues.append(float(value[1]))
-fieldMap.close()
+try:
+	fieldMap = fieldMapTable.load(pypath+r'/fieldMap.csv') #Change the path here to the correct location of the field map file
+except (IOError, ValueError) as err:
+	ERRMSG("Could not read field map (fieldMap.csv).\n" + str(err), modal=1, title="NMR Shuttle Error")
+	EXIT()
 
 #Get parameters from TopSpin and NMRShuttleSetup.py
 mode = int(GETPAR("CNST 11"))		#Operation mode: 1=Constant speed, 2=Variable speed, 3=Constant time
@@ -71,6 +71,13 @@ motionTime = float(GETPAR("D 10"))	#Time taken for sample motion (s)
 setpoint = float(GETPAR("TE"))		#Temperature (K)
 flowSwitchDelay = float(GETPAR("D 30"))	#Delay for flow direction switching (s)
 
+#Stall guard settings for the tube type (class stallGuard_<CNST12> in NMRShuttleSetup.py). Settings
+#tuned by stallTuning.py also give the default speed and acceleration for the tube.
+stallGuard = getattr(NMRShuttleSetup, 'stallGuard_' + str(stallSetting), None)
+if stallGuard == None:
+	ERRMSG("Invalid value for stall setting (CNST12).", modal=1, title="NMR Shuttle Error")
+	EXIT()
+
 #Get ramp equation used for variable speed experiments
 if str(GETPAR("USERA1")) != "":
 	ramp = str(GETPAR("USERA1"))
@@ -82,7 +89,7 @@ if GETPAR("CNST 30") != "0":
 	speed = float(GETPAR("CNST 30"))	
 else:
 	print("No target speed set by user (CNST30). If using constant time mode target speed will be calculated, otherwise default value from setup file will be used.")
-	speed = setup.speed
+	speed = getattr(stallGuard, 'speed', setup.speed)
 	PUTPAR("CNST 30",str(speed))
 
 #Check if user has set an acceleration rate, if not use default. Make sure it is within the limits of the motor.
@@ -90,7 +97,7 @@ if GETPAR("CNST 31") != "0":
 	accel = float(GETPAR("CNST 31"))
 else:
 	print("No acceleration set by user (CNST31). Default value from setup file will be used.")
-	accel = setup.accel
+	accel = getattr(stallGuard, 'accel', setup.accel)
 	PUTPAR("CNST 31",str(accel))
 max_accel = setup.circ*((1.024*10**13)/(2**(setup.rampDiv+setup.pulDiv+29)))
 if (accel < 0) or (accel > max_accel):
@@ -118,83 +125,104 @@ if "popt" in sys.argv:
 	td = result[0]
 
 
-#Calculate distance that motor needs to move to achieve the desired field strength.
-if BSample == setup.lowFieldCoil_Field:
-	distance = setup.lowFieldCoil_Dist
-elif BSample == setup.B0:
-	distance = 0
-else:
-	distance = interp(BSample,fieldValues[::-1],distanceValues[::-1])
-if (distance < 0) or (distance > setup.maxHeight):
-	ERRMSG("Field strength out of range! (CNST20)", modal=1, title="NMR Shuttle Error")
-	ct = XCMD("STOP")
-	EXIT()
+#For variable field experiments, get the list of field strengths (VB list) from USERA2. This is either
+#the name of a file in the python directory with one field strength (mT) per line, or the field strengths
+#separated by commas. Each 2D slice uses the next field strength in the list, in one motor sequence.
+fields = [BSample]
+vbList = str(GETPAR("USERA2")).strip()
+if vbList != "" and "SERIES" not in sys.argv:
+	try:
+		if os.path.isfile(os.path.join(pypath, vbList)):
+			vbFile = open(os.path.join(pypath, vbList), 'r')
+			vbList = " ".join([line.split('#')[0] for line in vbFile])
+			vbFile.close()
+		fields = [float(field) for field in vbList.replace(',', ' ').split()]
+	except (IOError, ValueError):
+		ERRMSG("Could not read VB list (USERA2): " + vbList, modal=1, title="NMR Shuttle Error")
+		EXIT()
+	if len(fields) == 0:
+		ERRMSG("VB list (USERA2) is empty.", modal=1, title="NMR Shuttle Error")
+		EXIT()
+	print("Variable field experiment with " + str(len(fields)) + " field strengths (USERA2)")
+	if dim == 0 and len(fields) > 1:
+		ERRMSG("1D experiment: only the first field strength in the VB list will be used.", title="NMR Shuttle")
+
+#Calculate distance that motor needs to move to achieve each field strength.
+distances = []
+for BSample in fields:
+	if BSample == setup.lowFieldCoil_Field:
+		distance = setup.lowFieldCoil_Dist
+	elif BSample == setup.B0:
+		distance = 0
+	else:
+		distance = fieldMap.distanceAt(BSample)
+	if (distance is None) or (distance < 0) or (distance > setup.maxHeight):
+		ERRMSG("Field strength out of range! (" + str(BSample) + " mT, CNST20 or USERA2)", modal=1, title="NMR Shuttle Error")
+		ct = XCMD("STOP")
+		EXIT()
+	distances.append(distance)
+BSample = fields[0]
 
 print('\n\n----------------------------------------------------')
 
-#For constant velocity and velocity sweep modes, estimate the amount of time needed to complete sample motion. 
+#For constant velocity and velocity sweep modes, calculate the amount of time needed to complete sample motion.
 #For constant time mode, calculate the speed that the motor needs to run at.
+#The trajectory is calculated by motionPlanner.py. The shuttle service (shuttleService.py) plans it if it is running, as it has
+#NumPy and the field map loaded. Otherwise constant velocity moves are planned here (no NumPy needed, but shuttleTrajectory.csv
+#is not written), and for the other modes motionPlanner.py is run with the external python installation.
 if mode == 1:
 	print("Constant velocity mode")
-	if (accel * (speed/accel)**2) >= distance:
-		motionTime = 2 * math.sqrt(distance/accel)
-	else:
-		motionTime = 2 * (speed/accel) + (distance - accel*((speed/accel)**2))/speed
-	PUTPAR("D 10",str(motionTime))
-	
-elif mode == 2:		#NB. Calculations in this mode assume a high acceleration rate
+elif mode == 2:
 	print("Velocity sweep mode")
-	motionTime = 0
-	Bz = setup.B0
-	z = 0
-	currSpeed = speed*float(eval(ramp))
-	dDistance = 0
-	if ramp.find("Bz") != -1:
-		while Bz >= BSample:
-			lastZ = z
-			z = interp(Bz,fieldValues[::-1],distanceValues[::-1])
-			dDistance = z - lastZ
-			lastSpeed = currSpeed
-			currSpeed = speed*float(eval(ramp))
-			avgSpeed = (currSpeed + lastSpeed)/2
-			motionTime += dDistance/avgSpeed
-			Bz -= (0.01*(setup.B0-BSample))
-	elif ramp.find('z') != -1:
-		while z <= distance:
-			dDistance = 0.01*distance
-			lastSpeed = currSpeed
-			currSpeed = speed*float(eval(ramp))
-			avgSpeed = (currSpeed + lastSpeed)/2
-			motionTime += dDistance/avgSpeed
-			z += 0.01*distance
+elif mode == 3:
+	print("Constant time mode")
+else:
+	ERRMSG("Invalid value for operation mode (CNST11).", modal=1, title="NMR Shuttle Error")
+	EXIT()
+
+#With a VB list every field strength is planned, D10 is the longest motion time and in
+#constant time mode each field strength has its own speed.
+#In a series (runNMRShuttleSeries.py) this has already been done while the temperature settled.
+if "SERIES" in sys.argv:
+	plan = {"motionTime": motionTime, "speed": speed, "speeds": [speed]}
+else:
+	plannerArguments = [str(mode), ",".join([str(distance) for distance in distances]), str(speed), str(accel), str(motionTime), ramp]
+	plan = shuttleClient.plan(plannerArguments, setup.servicePort)
+	if plan is not None:
+		print("Sample trajectory calculated by shuttle service")
+	elif mode == 1:
+		units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)
+		try:
+			motionTimes = [motionPlanner.motionTime(distance, speed, accel, units, maxSpeed=setup.maxSpeed) for distance in distances]
+			plan = {"motionTime": max(motionTimes), "speed": speed, "speeds": [speed]}
+		except ValueError as err:
+			plan = {"error": str(err)}
 	else:
-		ERRMSG("Invalid equation for velocity sweep ramp.\nEquation must be expressed in terms of sample position (z) or local field strength (currField).", modal=1, title="NMR Shuttle Error")
-		EXIT()
-	PUTPAR("D 10",str(motionTime))
-	
-elif mode == 3:	
-	print("Constant time mode") 
-	if 4 * distance > accel * (motionTime**2):
-		ERRMSG("Speed out of range! (CNST30)\nIncrease the sample motion time (D10).", modal=1, title="NMR Shuttle Error")
+		command = pyversion + " motionPlanner.py "
+		arguments = " ".join(plannerArguments[:-1]) + " '" + ramp + "'"
+		print(command + arguments)
+		try:
+			planner = subprocess.Popen(command + arguments, cwd=pypath, shell=True, stdout=subprocess.PIPE)
+			plan = json.loads(planner.communicate()[0].strip().splitlines()[-1])
+		except (OSError, ValueError, IndexError):
+			ERRMSG("Could not calculate sample trajectory (motionPlanner.py).", modal=1, title="NMR Shuttle Error")
+			EXIT()
+	if "error" in plan:
+		ERRMSG(str(plan["error"]), modal=1, title="NMR Shuttle Error")
 		EXIT()
-	else:
-		speed = 0.5 * (accel * motionTime - math.sqrt(accel) * math.sqrt(-4 * distance + accel * motionTime**2))
+
+if mode == 3:
+	speed = float(plan["speed"])
+	speeds = ",".join([str(value) for value in plan["speeds"]])
 	PUTPAR("CNST 30",str(speed))
 else:
-	ERRMSG("Invalid value for operation mode (CNST11).", modal=1, title="NMR Shuttle Error")
-	EXIT()
+	speeds = str(speed)
+	motionTime = float(plan["motionTime"])
+	PUTPAR("D 10",str(motionTime))
 
 
 #Error messages
-if stallSetting == 1:
-	print("Stall setting 1")
-elif stallSetting == 2:
-	print("Stall setting 2")
-elif stallSetting == 3:
-	print("Stall setting 3")
-else:
-	ERRMSG("Invalid value for stall setting (CNST12).", modal=1, title="NMR Shuttle Error")
-	EXIT()
+print("Stall setting " + str(stallSetting))
 if setup.maxSpeed > setup.circ*(9.765625/(2**setup.pulDiv)):
 	ERRMSG("Maximum speed out of range!\nCheck the settings in the setup file.", modal=1, title="NMR Shuttle Error")
 	EXIT()
@@ -203,6 +231,11 @@ if (speed < 0)  or (speed > setup.maxSpeed):
                 buttons=["OVERRIDE", "CANCEL"], title="NMR Shuttle Error")
 	if value == 1 or value < 0:
 		EXIT()
+if hasattr(stallGuard, 'speed') and (speed > stallGuard.speed or accel > stallGuard.accel):
+	value = SELECT(message = "Speed (CNST30) or acceleration (CNST31) is higher than stall setting " + str(stallSetting) + " was tuned for (" + str(stallGuard.speed) + " cm/s, " + str(stallGuard.accel) + " cm/s^2).",
+                buttons=["OVERRIDE", "CANCEL"], title="NMR Shuttle Error")
+	if value == 1 or value < 0:
+		EXIT()
   		
 #Set temperature and wait for ready
 command = pyversion + " Dyneo.py "
@@ -214,7 +247,9 @@ elif flowSwitchDelay < 30:  # Minimum delay is 30s to avoid valves switching too
 	EXIT()   
 arguments = str(round(setpoint-273, 2)) + " " + str(flowSwitchDelay)
 
-if "NO_TEMP" in sys.argv:
+if "SERIES" in sys.argv:
+	pass	#Temperature already set by runNMRShuttleSeries.py
+elif "NO_TEMP" in sys.argv:
 	ERRMSG("Temperature control disabled by user", title="NMR Shuttle")
 else:
 	try:
@@ -223,33 +258,58 @@ else:
 	except:
 		ERRMSG("Dyneo heater/chiller not found. Temperature will not be controlled.", title="NMR Shuttle")
 	else:
-		print(' Waiting for temperature to equilibriate...\n')
-		time.sleep(setup.equilibTime)
+		#Dyneo.py returns once the temperature has settled (see equilibration.py)
+		if setup.equilibTime > 0:
+			print(' Waiting for temperature to equilibriate...\n')
+			time.sleep(setup.equilibTime)
 
 
-#Call NMRShuttle.py with arguments 
-command = pyversion + " NMRShuttle.py "
-arguments = str(mode) + " " + str(stallSetting) + " " + str(BSample) + " " + str(ns) + " " + td + " " + str(speed) + " " + str(accel) + " " + str(distance) + " '" + ramp + "'"
-print(command + arguments)
-proc = subprocess.Popen(command + arguments, cwd=pypath, shell=True, stdin=subprocess.PIPE)
+#Start the motor sequence with the shuttle service (shuttleService.py) if it is running,
+#otherwise call NMRShuttle.py with arguments
+#Field strength, speed and distance are comma separated lists (one value per 2D slice) for a VB list
+arguments = [str(mode), str(stallSetting), ",".join([str(field) for field in fields]), str(ns), td, speeds, str(accel),
+             ",".join([str(distance) for distance in distances]), ramp]
+proc = shuttleClient.connect(arguments, setup.servicePort)
+if proc != None:
+	print("Connected to shuttle service on port " + str(setup.servicePort))
+else:
+	command = pyversion + " NMRShuttle.py "
+	arguments = " ".join(arguments[:-1]) + " '" + ramp + "'"
+	print(command + arguments)
+	proc = subprocess.Popen(command + arguments, cwd=pypath, shell=True, stdin=subprocess.PIPE)
 
 #Start acquisition
 if acquire:
 	print("Starting acquisition")
 	zg = ZG(wait=NO_WAIT_TILL_DONE)
 
-	#Send terminate to motor if acquisition fails/Abort acquisition if motor returns an error
-	while zg.getResult() != 0:
+	#Sleep until the acquisition or the motor sequence finishes (see acquisitionMonitor.py)
+	monitor = acquisitionMonitor.acquisitionMonitor(proc, zg)
+
+	#Abort acquisition if motor returns an error
+	while monitor.wait() == 'motor':
 		if proc.poll() > 0:
 			ct = XCMD("STOP")
+			print(monitor.summary())
+			reportStatus("failed", "Acquisition halted due to error in motor driver.")
 			ERRMSG("Acquisition halted due to error in motor driver.", modal=1, title="NMR Shuttle Error")
 			EXIT()
 
-	if proc.poll() != 0:
+	#Send terminate to motor if acquisition fails. Allow time for the last sample motion to finish.
+	if not monitor.waitForMotor(motionTime + 5):
 		proc.communicate(b'STOP')
+		print(monitor.summary())
+		reportStatus("stopped", "Acquisition stopped by TopSpin.")
 		ERRMSG("Acquistion stopped by Topspin.", title="NMR Shuttle", modal=1)
+	elif proc.poll() != 0:
+		print(monitor.summary())
+		reportStatus("failed", "Acquisition halted due to error in motor driver.")
+		ERRMSG("Acquisition halted due to error in motor driver.", modal=1, title="NMR Shuttle Error")
 	else:
-		ERRMSG("Acquistion completed successfully!", title="NMR Shuttle", modal=0)
+		print(monitor.summary())
+		reportStatus("completed", "")
+		if "SERIES" not in sys.argv:
+			ERRMSG("Acquistion completed successfully!", title="NMR Shuttle", modal=0)
 
 else:
 	MSG("NMR Shuttle ready.\nAcquisition NOT started.", title="NMR Shuttle Error")
@@ -0,0 +1,193 @@
+#
+# runNMRShuttleSeries.py
+# Version 1.0, Oct 2026
+#
+# Python script for running a series of NMR shuttle experiments at different
+# temperatures (TE) and field strengths (CNST20) in Topspin.
+#
+# The points are read from a series file (see seriesScheduler.py) and
+# ordered to reduce the total temperature change. Each point is acquired in
+# a new experiment number (the first in the current one) by runNMRShuttle.py,
+# with the parameters of the current dataset except those given for the
+# point. While the temperature settles for a point, the field map lookup and
+# sample motion for it are calculated, and near the end of each acquisition
+# the heater/chiller starts moving to the next temperature. The series stops
+# if runNMRShuttle.py does not report that the acquisition completed
+# (seriesStatus.json).
+#
+# Input arguments:
+#	series file	- path of the series file (otherwise asked for)
+#	'given'		- acquire the points in the order of the file.
+#
+
+#Import libraries
+import os, time, subprocess, sys, json
+import NMRShuttleSetup
+import fieldMapTable
+import motionPlanner
+import seriesScheduler
+import shuttleClient
+
+#TopSpin keeps modules loaded between scripts, so pick up changes to the setup file (e.g. stall guard settings added by stallTuning.py)
+reload(NMRShuttleSetup)
+setup = NMRShuttleSetup.NMRShuttle()
+
+#Get current dataset
+curdat = CURDATA(cmdthread = None)
+if curdat == None:
+	ERRMSG("Please open or activate a dataset!", modal=1, title="NMR Shuttle Error")
+	EXIT()
+
+#Set TopSpin installation directory
+path = root.UtilPath.getTopspinHome()
+pypath = path + r'/exp/stan/nmr/py/user'
+
+#Set verion of python to use
+pyversion = 'python' + setup.pyversion
+
+#Open file containing experimental field map
+try:
+	fieldMap = fieldMapTable.load(pypath+r'/fieldMap.csv')
+except (IOError, ValueError) as err:
+	ERRMSG("Could not read field map (fieldMap.csv).\n" + str(err), modal=1, title="NMR Shuttle Error")
+	EXIT()
+
+#Read the series file
+arguments = [argument for argument in sys.argv[1:] if argument != 'given']
+if len(arguments) > 0:
+	seriesPath = arguments[0]
+else:
+	result = INPUT_DIALOG(title="NMR Shuttle", header="Temperature/field series file:", values=[pypath + r'/series.txt'])
+	if result == None:
+		EXIT()
+	seriesPath = result[0]
+try:
+	points = seriesScheduler.readSeries(seriesPath)
+except (IOError, ValueError) as err:
+	ERRMSG("Could not read series file.\n" + str(err), modal=1, title="NMR Shuttle Error")
+	EXIT()
+
+#Parameters of the current dataset, used for every point unless given in the series file
+names = ["CNST 11", "CNST 12", "CNST 30", "CNST 31", "D 10", "D 30", "USERA1", "TE", "CNST 20"]
+base = {}
+for name in names:
+	base[name] = str(GETPAR(name))
+
+def parameter(point, name):
+	return point.parameters.get(name, base[name])
+
+#Order the points to reduce the total temperature change
+ordering = 'given' if 'given' in sys.argv else setup.seriesOrdering
+start = float(base["TE"])
+given = seriesScheduler.thermalSlew(points, start)
+points = seriesScheduler.orderPoints(points, start, ordering, field=float(base["CNST 20"]))
+print(str(len(points)) + " points. Total temperature change " + str(round(seriesScheduler.thermalSlew(points, start),1)) + " K (" + str(round(given,1)) + " K in file order).")
+
+
+def dyneoArguments(point):
+	flowSwitchDelay = float(parameter(point, "D 30"))
+	if flowSwitchDelay == 0:	# 0 is interpreted as an infinite delay (ie. valves do not switch)
+		flowSwitchDelay = 'OFF'
+	return str(round(point.temperature-273, 2)) + " " + str(flowSwitchDelay)
+
+
+def settle(point):
+	#Set the temperature and wait for it to settle (see equilibration.py)
+	command = pyversion + " Dyneo.py " + dyneoArguments(point)
+	print(command)
+	subprocess.check_call(command, cwd=pypath, shell=True)
+	if setup.equilibTime > 0:
+		time.sleep(setup.equilibTime)
+
+
+def preRamp(point):
+	#Start moving to the temperature of the next point
+	command = pyversion + " Dyneo.py " + dyneoArguments(point) + " NOWAIT"
+	print(command)
+	subprocess.call(command, cwd=pypath, shell=True)
+
+
+def prepare(point):
+	#Field map lookup and sample motion, as in runNMRShuttle.py
+	BSample = point.field
+	if BSample == setup.lowFieldCoil_Field:
+		distance = setup.lowFieldCoil_Dist
+	elif BSample == setup.B0:
+		distance = 0
+	else:
+		distance = fieldMap.distanceAt(BSample)
+	if (distance is None) or (distance < 0) or (distance > setup.maxHeight):
+		raise ValueError("Field strength out of range! (CNST20 = " + str(BSample) + ")")
+
+	mode = int(float(parameter(point, "CNST 11")))
+	stallGuard = getattr(NMRShuttleSetup, 'stallGuard_' + str(int(float(parameter(point, "CNST 12")))), None)
+	speed = float(parameter(point, "CNST 30")) or getattr(stallGuard, 'speed', setup.speed)
+	accel = float(parameter(point, "CNST 31")) or getattr(stallGuard, 'accel', setup.accel)
+	motionTime = float(parameter(point, "D 10"))
+	ramp = parameter(point, "USERA1") or setup.ramp
+	plannerArguments = [str(mode), str(distance), str(speed), str(accel), str(motionTime), ramp]
+	plan = shuttleClient.plan(plannerArguments, setup.servicePort)
+	if plan is None and mode == 1:
+		#Shuttle service not running; constant velocity moves need no NumPy
+		units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)
+		plan = {"speed": speed, "motionTime": motionPlanner.motionTime(distance, speed, accel, units, maxSpeed=setup.maxSpeed)}
+	elif plan is None:
+		#Shuttle service not running
+		command = pyversion + " motionPlanner.py "
+		arguments = " ".join(plannerArguments[:-1]) + " '" + ramp + "'"
+		planner = subprocess.Popen(command + arguments, cwd=pypath, shell=True, stdout=subprocess.PIPE)
+		plan = json.loads(planner.communicate()[0].strip().splitlines()[-1])
+	if "error" in plan:
+		raise ValueError(str(plan["error"]))
+	plan["mode"] = mode
+	return plan
+
+
+acquired = []
+def acquire(point, plan):
+	#New experiment number for each point after the first
+	if len(acquired) > 0:
+		XCMD("iexpno")
+	PUTPAR("TE", str(point.temperature))
+	PUTPAR("CNST 20", str(point.field))
+	for name in point.parameters:
+		PUTPAR(name, str(point.parameters[name]))
+	if plan["mode"] == 3:
+		PUTPAR("CNST 30", str(plan["speed"]))
+	else:
+		PUTPAR("D 10", str(plan["motionTime"]))
+	print("\nPoint " + str(len(acquired) + 1) + " of " + str(len(points)) + ": TE = " + str(point.temperature) + " K, CNST20 = " + str(point.field) + " mT")
+	#runNMRShuttle.py writes the result to the status file (no file if it could not start)
+	statusPath = pypath + r'/seriesStatus.json'
+	if os.path.exists(statusPath):
+		os.remove(statusPath)
+	XCMD("runNMRShuttle SERIES")
+	try:
+		statusFile = open(statusPath, 'r')
+		status = json.load(statusFile)
+		statusFile.close()
+	except (IOError, ValueError):
+		status = {"status": "failed", "message": "runNMRShuttle.py did not report a result."}
+	if status["status"] != "completed":
+		raise RuntimeError("Point " + str(len(acquired) + 1) + ": " + status["message"])
+	acquired.append(point)
+
+
+scheduler = seriesScheduler.seriesScheduler(points, settle, prepare, acquire, preRamp, setup.seriesPreRamp)
+try:
+	scheduler.run()
+except (subprocess.CalledProcessError, OSError) as err:
+	print(scheduler.summary())
+	ERRMSG("Dyneo heater/chiller not found. Series stopped.\n" + str(err), modal=1, title="NMR Shuttle Error")
+	EXIT()
+except (ValueError, IndexError) as err:
+	print(scheduler.summary())
+	ERRMSG("Could not calculate sample trajectory (motionPlanner.py). Series stopped.\n" + str(err), modal=1, title="NMR Shuttle Error")
+	EXIT()
+except RuntimeError as err:
+	print(scheduler.summary())
+	ERRMSG("Acquisition did not complete. Series stopped.\n" + str(err), modal=1, title="NMR Shuttle Error")
+	EXIT()
+
+print(scheduler.summary())
+ERRMSG("Series completed successfully!", title="NMR Shuttle", modal=0)
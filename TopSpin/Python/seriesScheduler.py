@@ -0,0 +1,216 @@
+#
+# seriesScheduler.py
+# Version 1.0, Oct 2026
+#
+# Runs a series of experiments at different temperatures (TE) and sample
+# field strengths (CNST20), for runNMRShuttleSeries.py. Works with TopSpin's
+# Jython interpreter.
+#
+# The points are ordered to keep the total temperature change small: the
+# temperatures are visited in one direction, starting from the end nearer
+# the present temperature, and the fields at each temperature alternate
+# between ascending and descending order (serpentine), so that the sample
+# does not move further than needed between points.
+#
+# Each point goes through four steps, given as functions:
+#   settle(point)             set the temperature and wait for it to settle
+#   prepare(point)            field map lookup and motion plan for the point
+#   acquire(point, prepared)  run the experiment (in the calling thread)
+#   preRamp(point)            set the temperature without waiting
+# settle() and prepare() for the next point run at the same time, in
+# background threads, once the previous acquisition has finished. During the
+# last preRampTime seconds of an acquisition (estimated from the previous
+# one), preRamp() moves the heater/chiller towards the next temperature.
+#
+# Series file format, one point per line (# starts a comment):
+#   TE (K)  CNST20 (mT)  [PARAMETER=value ...]
+# e.g.
+#   298  100
+#   310  500  D10=0.5  NS=16
+#
+# Usage:
+#   points = seriesScheduler.orderPoints(seriesScheduler.readSeries('series.txt'), start=298.0)
+#   scheduler = seriesScheduler.seriesScheduler(points, settle, prepare, acquire, preRamp, preRampTime=30)
+#   scheduler.run()
+#   print(scheduler.summary())
+#
+
+import collections, re, threading, time
+
+
+# temperature (K), field (mT), other TopSpin parameters {name: value}
+seriesPoint = collections.namedtuple('seriesPoint', ('temperature', 'field', 'parameters'))
+
+
+def parameterName(name):
+    # TopSpin name of a parameter, e.g. 'D10' -> 'D 10'
+    match = re.match(r'^([A-Za-z]+)\s*(\d+)$', name.strip())
+    if match and match.group(1).upper() in ('CNST', 'D', 'P', 'PL', 'L', 'SP', 'SPNAM', 'GPZ', 'IN', 'INP'):
+        return match.group(1).upper() + " " + match.group(2)
+    return name.strip().upper()
+
+
+def readSeries(path):
+    # Read a series file. Returns the list of seriesPoints in file order.
+    points = []
+    with open(path, 'r') as series:
+        for number, line in enumerate(series):
+            words = line.split('#')[0].split()
+            if len(words) == 0:
+                continue
+            try:
+                temperature, field = float(words[0]), float(words[1])
+                parameters = {}
+                for word in words[2:]:
+                    name, value = word.split('=')
+                    parameters[parameterName(name)] = value
+            except (IndexError, ValueError):
+                raise ValueError("Line " + str(number + 1) + " of " + path + " should be: TE CNST20 [PARAMETER=value ...]")
+            points.append(seriesPoint(temperature, field, parameters))
+    if len(points) == 0:
+        raise ValueError("No points in " + path)
+    return points
+
+
+def thermalSlew(points, start=None):
+    # Total temperature change (K) to visit points in order from start
+    slew = 0.0
+    previous = start
+    for point in points:
+        if previous is not None:
+            slew += abs(point.temperature - previous)
+        previous = point.temperature
+    return slew
+
+
+def orderPoints(points, start=None, method='serpentine', field=None):
+    # Order points to reduce the total temperature change from start (K).
+    #   'given'       unchanged
+    #   'monotone'    temperatures in one direction, fields ascending
+    #   'serpentine'  temperatures in one direction, fields alternately
+    #                 ascending and descending, starting from the end
+    #                 nearer field (mT)
+    if method == 'given':
+        return list(points)
+    if method not in ('monotone', 'serpentine'):
+        raise ValueError("Unknown ordering: " + str(method))
+
+    # Points at the same temperature (to 0.01 K) are grouped together
+    groups = {}
+    for point in points:
+        groups.setdefault(round(point.temperature, 2), []).append(point)
+    temperatures = sorted(groups.keys())
+    if start is not None and abs(start - temperatures[-1]) < abs(start - temperatures[0]):
+        temperatures.reverse()
+
+    ordered = []
+    for temperature in temperatures:
+        group = sorted(groups[temperature], key=lambda point: point.field)
+        if method == 'serpentine':
+            last = ordered[-1].field if len(ordered) > 0 else field
+            if last is not None and abs(last - group[-1].field) < abs(last - group[0].field):
+                group.reverse()
+        ordered += group
+    return ordered
+
+
+
+class _task(object):
+    # Runs function(*args) in a background thread
+
+    def __init__(self, function, *args):
+        self.result = None
+        self.error = None
+        self.duration = None
+        self.thread = threading.Thread(target=self._run, args=(function, args))
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def _run(self, function, args):
+        start = time.time()
+        try:
+            self.result = function(*args)
+        except Exception as err:
+            self.error = err
+        self.duration = time.time() - start
+
+
+    def wait(self):
+        # Wait for the function to return. Returns its result, or raises its exception.
+        while self.thread.is_alive():
+            self.thread.join(0.5)
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+
+class seriesScheduler(object):
+
+    def __init__(self, points, settle, prepare, acquire, preRamp=None, preRampTime=0.0):
+        self.points = list(points)
+        self.settle = settle
+        self.prepare = prepare
+        self.acquire = acquire
+        self.preRamp = preRamp
+        self.preRampTime = preRampTime
+        self.timings = []
+        self.startTime = None
+        self.endTime = None
+
+
+    def _start(self, point):
+        # Start settling and preparing point together
+        return _task(self.settle, point), _task(self.prepare, point)
+
+
+    def run(self):
+        # Run every point in order. An exception from any step stops the
+        # series and is raised here.
+        self.startTime = time.time()
+        expected = None
+        settling, preparing = self._start(self.points[0])
+        for i, point in enumerate(self.points):
+            waitStart = time.time()
+            prepared = preparing.wait()
+            settling.wait()
+            timing = {'point': i + 1, 'temperature': point.temperature, 'field': point.field,
+                      'settle': settling.duration, 'prepare': preparing.duration,
+                      'wait': time.time() - waitStart}
+
+            # Move towards the next temperature near the end of the acquisition
+            timer = None
+            if (self.preRamp is not None and self.preRampTime > 0 and expected is not None
+                    and i + 1 < len(self.points) and self.points[i + 1].temperature != point.temperature):
+                timer = threading.Timer(max(0.0, expected - self.preRampTime), self.preRamp, (self.points[i + 1],))
+                timer.daemon = True
+                timer.start()
+
+            acquireStart = time.time()
+            try:
+                self.acquire(point, prepared)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+            timing['acquire'] = time.time() - acquireStart
+            expected = timing['acquire']
+            self.timings.append(timing)
+
+            if i + 1 < len(self.points):
+                settling, preparing = self._start(self.points[i + 1])
+        self.endTime = time.time()
+
+
+    def summary(self):
+        if self.startTime is None:
+            return "Series not started."
+        end = self.endTime if self.endTime is not None else time.time()
+        total = end - self.startTime
+        # Time the same steps would take one after another
+        serial = sum([t['settle'] + t['prepare'] + t['acquire'] for t in self.timings])
+        text = str(len(self.timings)) + " of " + str(len(self.points)) + " points in " + str(round(total)) + " s. "
+        text += "Settling " + str(round(sum([t['settle'] for t in self.timings]))) + " s, "
+        text += "acquisition " + str(round(sum([t['acquire'] for t in self.timings]))) + " s. "
+        text += "Overlapping steps saved " + str(round(max(0.0, serial - total))) + " s."
+        return text
@@ -0,0 +1,104 @@
+#
+# shuttleClient.py
+# Version 1.0, Oct 2026
+#
+# Client for the NMR shuttle service (shuttleService.py), used by
+# runNMRShuttle.py. Works with TopSpin's Jython interpreter.
+#
+# shuttleProcess has the same poll()/communicate()/wait() methods as the
+# subprocess.Popen object that runNMRShuttle.py uses when NMRShuttle.py is
+# started directly, so the acquisition code is the same in both cases.
+#
+# plan() asks the service for the result of motionPlanner.py, which saves
+# starting python with NumPy for every experiment.
+#
+
+import json, socket, sys, threading
+
+
+class shuttleProcess(object):
+
+    def __init__(self, arguments, port, host='localhost', timeout=2.0):
+        # Raises socket.error if the service is not running
+        self.connection = socket.create_connection((host, port), timeout)
+        self.connection.settimeout(None)
+        self.returncode = None
+        self.finished = threading.Event()
+        self.connection.sendall((json.dumps([str(argument) for argument in arguments]) + "\n").encode('utf-8'))
+        self.thread = threading.Thread(target=self._read)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def _read(self):
+        # Print output from the service until it sends the exit status
+        returncode = 1
+        try:
+            for line in self.connection.makefile('r'):
+                if line.startswith("EXIT "):
+                    returncode = int(line.split()[1])
+                    break
+                sys.stdout.write(line)
+        except (IOError, ValueError):
+            pass
+        self.returncode = returncode
+        self.finished.set()
+
+
+    def poll(self):
+        return self.returncode
+
+
+    def wait(self, timeout=None):
+        self.finished.wait(timeout)
+        return self.returncode
+
+
+    def communicate(self, data=None):
+        # Send STOP (or other input) to the service and wait for the sequence to end
+        if data is not None and self.returncode is None:
+            try:
+                self.connection.sendall(data.strip() + b"\n")
+            except (IOError, socket.error):
+                pass
+        self.wait()
+        self.close()
+        return (None, None)
+
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.connection.close()
+        except (IOError, socket.error):
+            pass
+
+
+
+def connect(arguments, port, host='localhost'):
+    # Start a sequence with the shuttle service. Returns None if the service is not running.
+    try:
+        return shuttleProcess(arguments, port, host)
+    except (IOError, socket.error):
+        return None
+
+
+def plan(arguments, port, host='localhost', timeout=2.0, planTimeout=60.0):
+    # Plan the sample motion with the shuttle service (arguments as for
+    # motionPlanner.py). Returns the result, or None if the service is not
+    # running or does not reply.
+    try:
+        connection = socket.create_connection((host, port), timeout)
+    except (IOError, socket.error):
+        return None
+    try:
+        connection.settimeout(planTimeout)
+        connection.sendall((json.dumps({'plan': [str(argument) for argument in arguments]}) + "\n").encode('utf-8'))
+        return json.loads(connection.makefile('r').readline())
+    except (IOError, socket.error, ValueError):
+        return None
+    finally:
+        try:
+            connection.close()
+        except (IOError, socket.error):
+            pass
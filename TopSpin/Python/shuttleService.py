@@ -0,0 +1,243 @@
+#
+# shuttleService.py
+# Version 1.0, Oct 2026
+#
+# Long-running NMR shuttle service.
+#
+# Keeps the motor connection and the field map open between experiments, so
+# that runNMRShuttle.py does not need to start a new python interpreter, find
+# the COM port and reconnect to the motor for every acquisition. The service
+# listens on a local TCP port (NMRShuttleSetup.NMRShuttle.servicePort) and
+# runs one experiment per connection with the same code as NMRShuttle.py, so
+# the light gate, stall and STOP checks are unchanged.
+#
+# Protocol (one line each, UTF-8):
+#   client -> service   JSON list of NMRShuttle.py arguments
+#   service -> client   program output, as printed by NMRShuttle.py
+#   client -> service   STOP (optional, aborts the sequence)
+#   service -> client   EXIT <status>
+# If the client disconnects the sequence is stopped as if STOP was sent.
+# The motion can also be planned without starting a sequence, so that
+# runNMRShuttle.py does not need to start python for motionPlanner.py:
+#   client -> service   {"plan": [motionPlanner.py arguments]}
+#   service -> client   result, as printed by motionPlanner.py
+#
+# Start the service with:
+#   python shuttleService.py
+# NMRShuttleSetup.py is reloaded when it changes (e.g. when stallTuning.py
+# adds a stall guard setting), and the field map when fieldMap.csv changes.
+# A new servicePort takes effect when the service is restarted.
+#
+
+import importlib, json, os, socket, sys
+import NMRShuttleSetup
+import NMRShuttle
+import motionPlanner
+import speedTable
+
+
+class clientInput(object):
+    # Input from the client, used in place of stdin. A closed connection is
+    # read as STOP so that the motor is not left running without TopSpin.
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.file = connection.makefile('r')
+
+    def fileno(self):
+        return self.connection.fileno()
+
+    def readline(self):
+        try:
+            line = self.file.readline()
+        except (IOError, OSError):
+            line = ''
+        if line == '':
+            return 'STOP'
+        return line
+
+
+
+class clientOutput(object):
+    # Sends program output to the client as well as the service console
+
+    def __init__(self, connection, console):
+        self.connection = connection
+        self.console = console
+
+    def write(self, text):
+        self.console.write(text)
+        try:
+            self.connection.sendall(text.encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+    def flush(self):
+        self.console.flush()
+
+
+
+class shuttleService(object):
+
+    def __init__(self, setup, fieldMapPath='fieldMap.csv'):
+        self.setup = setup
+        self.setupPath = os.path.splitext(NMRShuttleSetup.__file__)[0] + '.py'
+        self.setupTime = os.stat(self.setupPath).st_mtime
+        self.fieldMapPath = fieldMapPath
+        self.fieldMap = None
+        self.fieldMapTime = None
+        self.myInterface = None
+        self.module = None
+
+
+    def getSetup(self):
+        # Reload NMRShuttleSetup.py if the file has changed. The module is
+        # reloaded in place, so NMRShuttle.py sees new stall guard settings too.
+        mtime = os.stat(self.setupPath).st_mtime
+        if mtime != self.setupTime:
+            try:
+                importlib.reload(NMRShuttleSetup)
+                self.setup = NMRShuttleSetup.NMRShuttle()
+                print("Reloaded " + self.setupPath)
+            except Exception as err:
+                print("Could not reload " + self.setupPath + ", using previous settings: " + type(err).__name__ + ": " + str(err))
+                return self.setup
+            self.setupTime = mtime
+        return self.setup
+
+
+    def getFieldMap(self):
+        # Reload the field map if the file has changed
+        mtime = os.stat(self.fieldMapPath).st_mtime
+        if self.fieldMap is None or mtime != self.fieldMapTime:
+            self.fieldMap = NMRShuttle.loadFieldMap(self.fieldMapPath)
+            self.fieldMapTime = mtime
+        return self.fieldMap
+
+
+    def getMotor(self):
+        # Connect to the motor unless already connected
+        if self.myInterface is None:
+            self.myInterface, self.module = NMRShuttle.connectMotor(self.setup)
+        return self.myInterface, self.module
+
+
+    def disconnect(self):
+        if self.myInterface is not None:
+            try:
+                self.myInterface.close()
+            except Exception:
+                pass
+        self.myInterface = None
+        self.module = None
+
+
+    def run(self, arguments, stdin):
+        # Run one experiment. Returns the exit status that NMRShuttle.py would give.
+        try:
+            setup = self.getSetup()
+            fieldMap = self.getFieldMap()
+            myInterface, module = self.getMotor()
+            return NMRShuttle.runSequence(arguments, setup, fieldMap, myInterface, module, stdin=stdin)
+        except SystemExit as err:
+            status = err.code if isinstance(err.code, int) else 1
+        except Exception as err:
+            # Any other error (e.g. from PyTrinamic) must not skip the clean up
+            print("Shuttle service error: " + type(err).__name__ + ": " + str(err))
+            status = 1
+
+        # Sequence did not complete. Set motor distance back to zero for safety,
+        # and reconnect next time if the motor is no longer responding.
+        if self.module is not None:
+            try:
+                self.module.setUserVariable(1,0)
+                NMRShuttle.cancelHeldMove(self.module)
+                speedTable.clearSpeedTable(self.module)
+            except Exception:
+                print("Motor not responding, will reconnect.")
+                self.disconnect()
+        return status
+
+
+    def plan(self, arguments):
+        # Plan the motion as motionPlanner.py would, with the field map already loaded
+        try:
+            fieldMap = self.getFieldMap()
+        except (SystemExit, IOError, OSError) as err:
+            return {'error': "Could not read field map: " + str(err)}
+        try:
+            return motionPlanner.planArguments(arguments, self.getSetup(), fieldMap)
+        except Exception as err:
+            return {'error': "Could not plan the motion: " + type(err).__name__ + ": " + str(err)}
+
+
+    def handle(self, connection):
+        stdout = sys.stdout
+        stdin = clientInput(connection)
+        try:
+            request = json.loads(stdin.file.readline())
+            if isinstance(request, dict):
+                arguments = [str(argument) for argument in request['plan']]
+            else:
+                arguments = [str(argument) for argument in request]
+        except (IOError, OSError, ValueError, TypeError, KeyError):
+            try:
+                connection.sendall(b"Invalid request\nEXIT 1\n")
+            except (IOError, OSError):
+                pass
+            return
+        if isinstance(request, dict):
+            result = self.plan(arguments)
+            try:
+                connection.sendall((json.dumps(result) + "\n").encode('utf-8'))
+            except (IOError, OSError):
+                pass
+            return
+        print("Starting sequence: " + ' '.join(arguments))
+        sys.stdout = clientOutput(connection, stdout)
+        try:
+            status = self.run(arguments, stdin)
+        finally:
+            sys.stdout = stdout
+        try:
+            connection.sendall(("\nEXIT " + str(status) + "\n").encode('utf-8'))
+        except (IOError, OSError):
+            pass
+        print("\nSequence finished with status " + str(status))
+
+
+    def serve(self, host='localhost', port=None):
+        port = self.setup.servicePort if port is None else port
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server.bind((host, port))
+        server.listen(1)
+        print("NMR shuttle service listening on " + host + ":" + str(port))
+        try:
+            while True:
+                connection, address = server.accept()
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                try:
+                    self.handle(connection)
+                except Exception as err:
+                    # One bad client must not stop the service
+                    print("Error handling request: " + type(err).__name__ + ": " + str(err))
+                finally:
+                    connection.close()
+        except KeyboardInterrupt:
+            print("Shuttle service stopped")
+        finally:
+            server.close()
+            self.disconnect()
+
+
+
+if __name__ == '__main__':
+    setup = NMRShuttleSetup.NMRShuttle()
+    service = shuttleService(setup)
+
+    # Connect to the motor and read the field map straight away, so that the
+    # first experiment starts as quickly as the rest.
+    service.getFieldMap()
+    service.getMotor()
+    service.serve()
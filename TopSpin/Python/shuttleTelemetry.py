@@ -0,0 +1,128 @@
+#
+# shuttleTelemetry.py
+# Version 1.0, Oct 2026
+#
+# Records the timing of every sample transit to a JSON Lines log file (one
+# JSON object per line) and prints a summary at the end of the sequence.
+#
+# Each sequence starts with a 'sequence' record of the experiment settings.
+# Each transit of the sample gives a 'transit' record with:
+#   slice, scan, direction      2D slice and scan number, 'up' or 'down'
+#   trigger                     time of trigger (s since epoch)
+#   triggerToArrival            time from trigger to sample in position (s), from
+#                               the motor tick timer (UserVariables 13 and 14)
+#   predicted                   transit time predicted by motionPlanner.py (s)
+#   lowField                    time spent at low field before this move (s, 'down' only)
+#   roundTripMean, roundTripMax serial round trip times during the transit (ms)
+# The sequence ends with a 'summary' record.
+#
+# Trigger and arrival times come from the motor tick timer (see
+# motorSupervisor.py). With older firmware which does not save these,
+# triggerToArrival is not recorded and the time of detection by the host is
+# used as the arrival time. The same applies to a move which started and
+# finished between two polls of the motor and was followed by another move,
+# as the tick times of the later move have replaced it.
+#
+# Usage:
+#   telemetry = shuttleTelemetry.shuttleTelemetry('shuttleTelemetry.jsonl', settings)
+#   telemetry.transit('up', slice, scan, supervisor)
+#   print(telemetry.summary())
+#
+
+import datetime, json, math, time
+
+
+def _stats(values):
+    # Mean, standard deviation (jitter), min and max of a list
+    if len(values) == 0:
+        return None
+    mean = sum(values) / float(len(values))
+    std = math.sqrt(sum([(v - mean)**2 for v in values]) / float(len(values)))
+    return {'mean': mean, 'std': std, 'min': min(values), 'max': max(values), 'n': len(values)}
+
+
+
+class shuttleTelemetry(object):
+
+    def __init__(self, path, settings=None, predicted=None):
+        self.path = path
+        self.predicted = predicted
+        self.records = []
+        self.lastArrival = None
+        self.roundTripIndex = 0
+        self.file = open(path, 'a') if path else None
+        record = {'type': 'sequence', 'start': datetime.datetime.now().isoformat()}
+        if settings is not None:
+            record.update(settings)
+        self._write(record)
+
+
+    def _write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + "\n")
+            self.file.flush()
+
+
+    def transit(self, direction, slice, scan, supervisor, timed=True):
+        # Record the move that has just finished. timed=False if the tick
+        # times of the supervisor belong to a later move.
+        now = time.time()
+        if timed and supervisor.arrivalTick > supervisor.triggerTick > 0:
+            trigger = supervisor.tickToTime(supervisor.triggerTick)
+            arrival = supervisor.tickToTime(supervisor.arrivalTick)
+            triggerToArrival = (supervisor.arrivalTick - supervisor.triggerTick) / 1000.0
+        else:
+            trigger = None
+            arrival = now
+            triggerToArrival = None
+
+        roundTrips = supervisor.roundTrips[self.roundTripIndex:]
+        self.roundTripIndex = len(supervisor.roundTrips)
+
+        record = {'type': 'transit', 'slice': slice, 'scan': scan, 'direction': direction,
+                  'trigger': trigger,
+                  'triggerToArrival': triggerToArrival,
+                  'predicted': self.predicted,
+                  'lowField': None,
+                  'roundTripMean': 1000 * sum(roundTrips) / len(roundTrips) if len(roundTrips) > 0 else None,
+                  'roundTripMax': 1000 * max(roundTrips) if len(roundTrips) > 0 else None}
+        if direction == 'down' and self.lastArrival is not None:
+            record['lowField'] = (trigger if trigger is not None else arrival) - self.lastArrival
+        self.lastArrival = arrival
+        self.records.append(record)
+        self._write(record)
+        return record
+
+
+    def statistics(self):
+        result = {}
+        for direction in ('up', 'down'):
+            records = [r for r in self.records if r['direction'] == direction]
+            result[direction] = _stats([r['triggerToArrival'] for r in records if r['triggerToArrival'] is not None])
+        result['lowField'] = _stats([r['lowField'] for r in self.records if r['lowField'] is not None])
+        result['roundTrip'] = _stats([r['roundTripMean'] for r in self.records if r['roundTripMean'] is not None])
+        if result['roundTrip'] is not None:
+            result['roundTrip']['max'] = max([r['roundTripMax'] for r in self.records if r['roundTripMax'] is not None])
+        return result
+
+
+    def summary(self):
+        # Write summary record and return it as text
+        result = self.statistics()
+        self._write(dict(result, type='summary'))
+        lines = [str(len(self.records)) + " transits recorded" + (" in " + self.path if self.path else "")]
+        for key, name in (('up', 'Trigger to arrival up'), ('down', 'Trigger to arrival down'), ('lowField', 'Time at low field')):
+            if result[key] is not None:
+                lines.append(name + " = " + str(round(result[key]['mean'],3)) + " s (jitter " + str(round(1000*result[key]['std'],1))
+                             + " ms, range " + str(round(result[key]['min'],3)) + " - " + str(round(result[key]['max'],3)) + " s)")
+        if self.predicted is not None:
+            lines.append("Predicted transit = " + str(round(self.predicted,3)) + " s")
+        if result['roundTrip'] is not None:
+            lines.append("Serial round trip = " + str(round(result['roundTrip']['mean'],2)) + " ms mean, " + str(round(result['roundTrip']['max'],2)) + " ms max")
+        return "\n".join(lines)
+
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -0,0 +1,95 @@
+#
+# speedTable.py
+# Version 1.0, Oct 2026
+#
+# Position-to-speed lookup table for the velocity sweep mode of the NMR shuttle.
+#
+# The velocity ramp is evaluated over the whole distance of travel before the
+# shuttle starts and reduced to a short table of segments. Each segment has a
+# start position (motor steps from the magnet centre) and a speed (motor
+# units). The table is written to TMCL user variables and stepped through by
+# the NMRshuttle_1160_v4.tmc / NMRShuttle_1060_v4.tmc firmware, so no host
+# round trips are needed while the sample is moving.
+#
+# The user variable layout must match the firmware:
+#   UserVariable10          number of table entries (0 = no table)
+#   UserVariable11          current table entry (used by firmware)
+#   UserVariable64...95     segment start positions (steps)
+#   UserVariable96...127    segment speeds (motor units)
+#
+
+import numpy as np
+
+
+TABLE_LENGTH = 10
+TABLE_INDEX = 11
+TABLE_POSITION = 64
+TABLE_SPEED = 96
+TABLE_MAX = 32
+
+
+def buildSpeedTable(rampProfile, distance, speed, NStep, Circ, segments=TABLE_MAX, points=2001):
+    # Evaluate the ramp over the distance of travel (cm) and split it into
+    # segments of equal speed change, so that steep parts of the ramp get
+    # more table entries than flat parts. Returns lists of positions (steps)
+    # and speeds (motor units).
+    segments = max(1, min(int(segments), TABLE_MAX))
+    z = np.linspace(0, distance, points)
+    v = speed * rampProfile(z)
+
+    # Place segment boundaries at equal steps of cumulative speed change. If
+    # the ramp is flat over the distance, fall back to equal distances.
+    change = np.concatenate(([0.0], np.cumsum(np.abs(np.diff(v)))))
+    if change[-1] > 0:
+        edges = np.interp(np.linspace(0, change[-1], segments + 1), change, z)
+    else:
+        edges = np.linspace(0, distance, segments + 1)
+
+    # Speed in each segment is the ramp value at the segment midpoint
+    positions = np.round(edges[:-1] * NStep / Circ).astype(int)
+    speeds = np.round(np.interp(0.5 * (edges[:-1] + edges[1:]), z, v)).astype(int)
+    speeds = np.maximum(speeds, 1)
+
+    # Remove segments which round to the same position
+    keep = np.concatenate(([True], np.diff(positions) > 0))
+    return [int(p) for p in positions[keep]], [int(s) for s in speeds[keep]]
+
+
+def uploadSpeedTable(module, positions, speeds, verify=True, batch=None):
+    # Write table to the motor user variables. The table length is cleared
+    # first and written last so that the firmware never uses a partly written
+    # table. If a tmclBatch is given the entries are written and read back in
+    # a few round trips instead of one per entry.
+    if len(positions) != len(speeds) or not 0 < len(positions) <= TABLE_MAX:
+        raise ValueError("Speed table must have between 1 and " + str(TABLE_MAX) + " entries.")
+    if batch is not None:
+        batch.setUserVariable(TABLE_LENGTH, 0)
+        for i in range(len(positions)):
+            batch.setUserVariable(TABLE_POSITION + i, positions[i])
+            batch.setUserVariable(TABLE_SPEED + i, speeds[i])
+        batch.execute()
+        if verify:
+            for i in range(len(positions)):
+                batch.userVariable(TABLE_POSITION + i)
+                batch.userVariable(TABLE_SPEED + i)
+            values = batch.execute()
+            for i in range(len(positions)):
+                if values[2*i] != positions[i] or values[2*i + 1] != speeds[i]:
+                    raise IOError("Speed table entry " + str(i) + " was not written correctly.")
+        batch.setUserVariable(TABLE_LENGTH, len(positions))
+        batch.execute()
+        return
+    module.setUserVariable(TABLE_LENGTH, 0)
+    for i in range(len(positions)):
+        module.setUserVariable(TABLE_POSITION + i, positions[i])
+        module.setUserVariable(TABLE_SPEED + i, speeds[i])
+    if verify:
+        for i in range(len(positions)):
+            if module.userVariable(TABLE_POSITION + i) != positions[i] or module.userVariable(TABLE_SPEED + i) != speeds[i]:
+                raise IOError("Speed table entry " + str(i) + " was not written correctly.")
+    module.setUserVariable(TABLE_LENGTH, len(positions))
+
+
+def clearSpeedTable(module):
+    # Disable speed table in firmware (constant velocity moves)
+    module.setUserVariable(TABLE_LENGTH, 0)
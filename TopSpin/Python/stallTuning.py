@@ -0,0 +1,317 @@
+#
+# stallTuning.py
+# Version 1.0, Oct 2026
+#
+# Finds the fastest speed and acceleration that each tube type can be
+# shuttled at, from the StallGuard2 load value of the motor.
+#
+# Starting from a stall guard setting of NMRShuttleSetup.py (CNST12), the
+# sample is moved up and down repeatedly at increasing acceleration and, for
+# each acceleration, increasing speed. During every move the position,
+# actual velocity (axis parameter 3), load value (axis parameter 206) and
+# extended error flags (axis parameter 207) are read in one round trip per
+# sample and logged to a JSON Lines file. The load value falls towards 0 as
+# the motor approaches its torque limit. It is only used above the stall
+# detection speed (stopOnStall), below which it is not reliable.
+#
+# A setting passes if none of its moves stalled and the lowest load value
+# stayed at or above the safety margin. The recommended setting is the one
+# that passed with the shortest transit time (see motionPlanner.py). It may
+# be added to NMRShuttleSetup.py as a new stall guard class
+# (stallGuard_<n>), with the current and stall detection settings of the
+# profile it was tuned from and the tuned speed and acceleration, which
+# runNMRShuttle.py then uses as the defaults for CNST12 = n.
+#
+# The sample must be loaded and the shuttle free to move. After a stall the
+# sample is returned to the magnet centre at the starting speed and
+# acceleration. Clearing the error flag runs the Reset routine of the
+# firmware, which sets the actual position to zero where the motor stopped,
+# so the position is read first, the sample is moved back by that much and
+# the actual position is then set to zero at the magnet centre again.
+#
+# Usage:
+#   python stallTuning.py setting [distance] [simulate]
+# 'simulate' uses the simulated motor (tmcmSimulator.py) with the example
+# load for the tube type.
+#
+
+import datetime, json, os, sys, time
+import numpy as np
+import NMRShuttleSetup
+import NMRShuttle
+import motionPlanner
+import tmclBatch
+
+
+# Axis parameters
+ACTUAL_POSITION = 1
+ACTUAL_VELOCITY = 3
+MAX_SPEED = 4
+MAX_ACCEL = 5
+LOAD_VALUE = 206
+
+# Firmware error flag (user variable) and stall error
+ERRFLAG = 9
+STALL = 2
+
+
+def profileText(number, base, stallGuard, speed, accel, note=''):
+    # NMRShuttleSetup.py class for a tuned stall guard setting
+    lines = ["class stallGuard_" + str(number) + "(object):",
+             "  # Tuned from stall guard setting " + str(base) + " by stallTuning.py, " + datetime.date.today().isoformat()]
+    if note:
+        lines.append("  # " + note)
+    values = [('motorRunCurrent', stallGuard.motorRunCurrent),
+              ('motorStandbyCurrent', stallGuard.motorStandbyCurrent),
+              ('stallguard2Filter', stallGuard.stallguard2Filter),
+              ('stallguard2Threshold', stallGuard.stallguard2Threshold),
+              ('stopOnStall', stallGuard.stopOnStall),
+              ('speed', round(speed, 2)),
+              ('accel', round(accel, 2))]
+    for name, value in values:
+        lines.append("  " + (name + " =").ljust(26) + str(value))
+    return "\n".join(lines) + "\n"
+
+
+def nextProfile():
+    # Lowest stall guard setting number not used in NMRShuttleSetup.py
+    number = 1
+    while hasattr(NMRShuttleSetup, 'stallGuard_' + str(number)):
+        number += 1
+    return number
+
+
+def addProfile(text, path=None):
+    # Append a stall guard class to NMRShuttleSetup.py
+    if path is None:
+        path = os.path.splitext(NMRShuttleSetup.__file__)[0] + '.py'
+    with open(path, 'a') as setupFile:
+        setupFile.write("\n" + text)
+    return path
+
+
+
+class stallTuner(object):
+
+    def __init__(self, module, batch, units, stallGuard, distance, margin=150, repeats=3,
+                 log='stallTuning.jsonl', timeout=60):
+        # margin: lowest load value (0...1023) allowed during a move
+        # repeats: number of up and down moves for each setting
+        self.module = module
+        self.batch = batch
+        self.units = units
+        self.stallGuard = stallGuard
+        self.distance = distance
+        self.margin = margin
+        self.repeats = repeats
+        self.log = log
+        self.timeout = timeout
+        self.results = []
+
+        # Statistics
+        self.transits = 0
+        self.samples = 0
+        self.stalls = 0
+
+
+    def setMotion(self, speed, accel):
+        self.batch.setAxisParameter(MAX_SPEED, self.units.speedToMotor(speed))
+        self.batch.setAxisParameter(MAX_ACCEL, self.units.accelToMotor(accel))
+        self.batch.execute()
+
+
+    def record(self, target):
+        # Move to target (steps), sampling until the motor arrives or stalls.
+        # Returns the samples (times from the start of the move, positions in
+        # cm, velocities in cm/s, load values) and whether the motor stalled.
+        self.module.moveToPosition(target)
+        start = time.time()
+        t, position, velocity, load = [], [], [], []
+        stalled = False
+        while True:
+            self.batch.axisParameter(ACTUAL_POSITION)
+            self.batch.axisParameter(ACTUAL_VELOCITY)
+            self.batch.axisParameter(LOAD_VALUE)
+            self.batch.statusFlags()
+            self.batch.userVariable(ERRFLAG)
+            values = self.batch.execute()
+            t.append(time.time() - start)
+            position.append(-values[0] * self.units.circ / self.units.NStep)
+            velocity.append(self.units.speedFromMotor(abs(values[1])))
+            load.append(values[2])
+            if values[3] != 0 or values[4] == STALL:
+                stalled = True
+                break
+            if values[0] == target and values[1] == 0:
+                break
+            if t[-1] > self.timeout:
+                raise IOError("Motor did not reach position " + str(target))
+        self.transits += 1
+        self.samples += len(t)
+        return {'t': t, 'position': position, 'velocity': velocity, 'load': load}, stalled
+
+
+    def lowestLoad(self, samples):
+        # Lowest load value at or above the stall detection speed, or None
+        minimum = self.units.speedFromMotor(self.stallGuard.stopOnStall)
+        loads = [value for value, v in zip(samples['load'], samples['velocity']) if v >= minimum]
+        if len(loads) == 0:
+            return None
+        return min(loads)
+
+
+    def recover(self, speed, accel):
+        # Clear the stall and return to the magnet centre slowly
+        self.stalls += 1
+        self.batch.axisParameter(ACTUAL_POSITION)
+        self.batch.userVariable(ERRFLAG)
+        stalledAt, errflag = self.batch.execute()
+        self.batch.setUserVariable(ERRFLAG, 0)
+        self.batch.statusFlags()
+        self.batch.execute()
+        target = 0
+        if errflag != 0 and stalledAt != 0:
+            # The firmware sets the actual position to zero where the motor stopped
+            self.waitForReset()
+            target = -stalledAt
+        self.setMotion(speed, accel)
+        self.record(target)
+        self.module.setAxisParameter(ACTUAL_POSITION, 0)
+
+
+    def waitForReset(self):
+        # Wait until the Reset routine of the firmware has run
+        start = time.time()
+        while self.module.actualPosition() != 0:
+            if time.time() - start > self.timeout:
+                raise IOError("Motor was not reset after the stall")
+            time.sleep(0.02)
+
+
+    def test(self, speed, accel, safeSpeed, safeAccel):
+        # Move up and down repeats times at speed (cm/s) and accel (cm/s^2)
+        self.setMotion(speed, accel)
+        result = {'speed': speed, 'accel': accel, 'stalled': False, 'lowestLoad': None,
+                  'motionTime': motionPlanner.planMotion(self.distance, speed, accel, self.units).motionTime}
+        for i in range(self.repeats):
+            for direction, target in (('up', -self.units.steps(self.distance)), ('down', 0)):
+                samples, stalled = self.record(target)
+                lowest = self.lowestLoad(samples)
+                self._log(speed, accel, direction, stalled, lowest, samples)
+                if lowest is not None and (result['lowestLoad'] is None or lowest < result['lowestLoad']):
+                    result['lowestLoad'] = lowest
+                if stalled:
+                    result['stalled'] = True
+                    self.recover(safeSpeed, safeAccel)
+                    return result
+        return result
+
+
+    def passed(self, result):
+        return not result['stalled'] and (result['lowestLoad'] is None or result['lowestLoad'] >= self.margin)
+
+
+    def run(self, speeds, accels):
+        # Test each acceleration in increasing order, and for each one the
+        # speeds in increasing order until one fails. Stops at the first
+        # acceleration at which no speed passes.
+        safeSpeed, safeAccel = speeds[0], accels[0]
+        for accel in accels:
+            anyPassed = False
+            for speed in speeds:
+                result = self.test(speed, accel, safeSpeed, safeAccel)
+                self.results.append(result)
+                ok = self.passed(result)
+                print("Speed " + str(round(speed,2)) + " cm/s, acceleration " + str(round(accel,2)) + " cm/s^2: " +
+                      ("passed" if ok else ("stalled" if result['stalled'] else "failed")) +
+                      " (lowest load value " + str(result['lowestLoad']) + ", transit " + str(round(result['motionTime'],3)) + " s)")
+                if not ok:
+                    break
+                anyPassed = True
+            if not anyPassed:
+                break
+        self.setMotion(safeSpeed, safeAccel)
+
+
+    def recommend(self):
+        # Setting that passed with the shortest transit time, or None
+        passed = [result for result in self.results if self.passed(result)]
+        if len(passed) == 0:
+            return None
+        return min(passed, key=lambda result: (result['motionTime'], result['accel'], result['speed']))
+
+
+    def summary(self):
+        return (str(len(self.results)) + " settings tested in " + str(self.transits) + " moves (" + str(self.samples) +
+                " samples, " + str(self.stalls) + " stalls)")
+
+
+    def _log(self, speed, accel, direction, stalled, lowest, samples):
+        if not self.log:
+            return
+        record = {'type': 'stallTuning', 'time': datetime.datetime.now().isoformat(),
+                  'speed': speed, 'accel': accel, 'direction': direction,
+                  'stalled': stalled, 'lowestLoad': lowest,
+                  'runCurrent': self.stallGuard.motorRunCurrent,
+                  'threshold': self.stallGuard.stallguard2Threshold}
+        record.update(samples)
+        with open(self.log, 'a') as log:
+            log.write(json.dumps(record) + "\n")
+
+
+
+if __name__ == '__main__':
+    setup = NMRShuttleSetup.NMRShuttle()
+    arguments = [argument for argument in sys.argv[1:] if argument != 'simulate']
+    setting = int(arguments[0])
+    distance = float(arguments[1]) if len(arguments) > 1 else setup.maxHeight
+    stallGuard = NMRShuttle.stallGuardSettings(setting)
+    if stallGuard is None:
+        print("Invalid value for tube type.")
+        sys.exit(1)
+
+    if 'simulate' in sys.argv or setup.simulate:
+        import tmcmSimulator
+        myInterface = tmcmSimulator.simulatedInterface(model=setup.model)
+        module = tmcmSimulator.simulatedTMCM(myInterface)
+        myInterface.motor.load = tmcmSimulator.TUBE_LOADS.get(setting, tmcmSimulator.TUBE_LOADS[1])
+        print("Using simulated motor driver")
+    else:
+        myInterface, module = NMRShuttle.connectMotor(setup)
+
+    try:
+        batch = tmclBatch.tmclBatch(myInterface)
+        NMRShuttle.setStallGuard(batch, stallGuard)
+        batch.setAxisParameter(154, setup.pulDiv)
+        batch.setAxisParameter(153, setup.rampDiv)
+        uStepRes = batch.axisParameter(140)
+        uStepRes = batch.execute()[uStepRes]
+        units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, uStepRes, setup.pulDiv, setup.rampDiv)
+
+        # Speeds up to the motor limit, accelerations up to the limit of the ramp generator
+        maxAccel = setup.circ * ((1.024 * 10**13) / (2**(setup.rampDiv + setup.pulDiv + 29)))
+        speed = getattr(stallGuard, 'speed', setup.speed)
+        accel = getattr(stallGuard, 'accel', setup.accel)
+        speeds = np.linspace(speed, setup.maxSpeed, 4)
+        accels = np.geomspace(accel, maxAccel, 8)
+
+        print("Tuning stall guard setting " + str(setting) + " over " + str(distance) + " cm\n")
+        tuner = stallTuner(module, batch, units, stallGuard, distance)
+        tuner.run([float(value) for value in speeds], [float(value) for value in accels])
+    finally:
+        myInterface.close()
+    print("\n" + tuner.summary())
+
+    best = tuner.recommend()
+    if best is None:
+        print("No setting passed. Check the sample and the stall guard settings.")
+        sys.exit(1)
+    number = nextProfile()
+    note = "Lowest load value " + str(best['lowestLoad']) + " (margin " + str(tuner.margin) + "), transit " + str(round(best['motionTime'],3)) + " s over " + str(distance) + " cm"
+    text = profileText(number, setting, stallGuard, best['speed'], best['accel'], note)
+    print("Recommended setting:\n\n" + text)
+    saveProfile = input("Add to NMRShuttleSetup.py as stall guard setting " + str(number) + " (Y/N)? ")
+    if saveProfile.lower() == 'y':
+        path = addProfile(text)
+        print("Added to " + path + ". Set CNST12 = " + str(number) + " to use it.")
+        print("The shuttle service and the TopSpin scripts reload NMRShuttleSetup.py when it changes; restart any other program using it.")
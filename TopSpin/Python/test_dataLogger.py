@@ -0,0 +1,138 @@
+#
+# test_dataLogger.py
+# Version 1.0, Oct 2026
+#
+# Tests of recording sensor data (dataLogger.py): appending to CSV and binary
+# files, removing an incomplete last row, the interval summary and dropping
+# rows when the writer cannot keep up.
+#
+# Usage:
+#   python -m pytest -q test_dataLogger.py
+#
+
+import os, sys, threading, time
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import dataLogger
+
+FIELDS = ['T1 (degC)', 'T2 (degC)']
+START = 1790000000.0    # multiple of 10 s
+
+
+def rows(n, start=START, step=1.0):
+    t = start + step * np.arange(n)
+    return np.column_stack((t, 20 + 0.1 * np.arange(n), 30 - 0.1 * np.arange(n)))
+
+
+def record(path, data, **options):
+    logger = dataLogger.dataLogger(path, FIELDS, **options)
+    logger.log(data)
+    logger.close()
+    return logger
+
+
+def test_binaryAppend(tmp_path):
+    path = str(tmp_path / 'data.bin')
+    first = rows(5)
+    second = rows(3, start=START + 5)
+    record(path, first)
+    logger = record(path, second)
+    data, columns = dataLogger.readLog(path)
+    assert columns == ['time'] + FIELDS
+    assert np.array_equal(data, np.vstack((first, second)))
+    assert logger.rows == 3 and logger.dropped == 0
+
+
+def test_binaryPartialRow(tmp_path):
+    # Incomplete last row (e.g. after a power cut) is removed before appending
+    path = str(tmp_path / 'data.bin')
+    record(path, rows(4))
+    with open(path, 'ab') as log:
+        log.write(b'\x00' * 13)
+    record(path, rows(2, start=START + 4))
+    data, columns = dataLogger.readLog(path)
+    assert np.array_equal(data, np.vstack((rows(4), rows(2, start=START + 4))))
+
+
+def test_binaryOtherColumns(tmp_path):
+    path = str(tmp_path / 'data.bin')
+    record(path, rows(2))
+    with pytest.raises(ValueError):
+        dataLogger.dataLogger(path, ['T1 (degC)'])
+
+
+def test_csvAppend(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    record(path, rows(3))
+    data = rows(2, start=START + 3)
+    data[1, 2] = np.nan
+    record(path, data)
+    with open(path) as log:
+        lines = log.read().splitlines()
+    assert lines[0] == 'Timestamp, T1 (degC), T2 (degC)'
+    assert len(lines) == 6
+    assert lines[1].endswith(', 20, 30') and lines[4].endswith(', 20, 30')
+    assert lines[5].endswith(', 20.1, ')
+
+
+def test_csvPartialRow(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    record(path, rows(2))
+    with open(path, 'a') as log:
+        log.write('2026-10-18 12:00:00, 21.')
+    record(path, rows(1))
+    with open(path) as log:
+        lines = log.read().splitlines()
+    assert len(lines) == 4
+    assert [line.split(', ')[1:] for line in lines[1:]] == [['20', '30'], ['20.1', '29.9'], ['20', '30']]
+
+
+def test_csvOtherColumns(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    with open(path, 'w') as log:
+        log.write('Timestamp, Other\n')
+    with pytest.raises(ValueError):
+        dataLogger.dataLogger(path, FIELDS)
+
+
+def test_summary(tmp_path):
+    # 25 s of samples every 0.5 s, one value missing: three 10 s intervals
+    path = str(tmp_path / 'data.bin')
+    data = rows(50, step=0.5)
+    data[3, 1] = np.nan
+    logger = dataLogger.dataLogger(path, FIELDS, interval=10)
+    logger.log(data[:7])
+    logger.log(data[7:])
+    logger.close()
+    summary, columns = dataLogger.readLog(dataLogger.summaryPath(path))
+    assert columns == ['time', 'T1 (degC) mean', 'T1 (degC) min', 'T1 (degC) max',
+                       'T2 (degC) mean', 'T2 (degC) min', 'T2 (degC) max', 'Samples']
+    assert list(summary[:, 0]) == [START, START + 10, START + 20]
+    assert list(summary[:, -1]) == [20, 20, 10]
+    first = np.delete(data[:20, 1], 3)
+    assert summary[0, 1:4] == pytest.approx([first.mean(), first.min(), first.max()])
+    assert summary[2, 4:7] == pytest.approx([data[40:, 2].mean(), data[40:, 2].min(), data[40:, 2].max()])
+
+
+def test_dropWhenFull(tmp_path):
+    # log() never waits for a slow disk; rows which do not fit are counted
+    path = str(tmp_path / 'data.bin')
+    logger = dataLogger.dataLogger(path, FIELDS, flushRows=1, queueSize=2)
+    release = threading.Event()
+    write = logger.data.write
+    def slowWrite(data):
+        release.wait(10.0)
+        write(data)
+    logger.data.write = slowWrite
+    start = time.time()
+    for i in range(10):
+        logger.log(rows(1, start=START + i))
+    assert time.time() - start < 0.5
+    assert logger.dropped >= 7
+    release.set()
+    logger.close()
+    assert logger.rows + logger.dropped == 10
+    assert len(dataLogger.readLog(path)[0]) == logger.rows
+    assert "rows dropped" in logger.summary()
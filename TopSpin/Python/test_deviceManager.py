@@ -0,0 +1,91 @@
+#
+# test_deviceManager.py
+# Version 1.0, Oct 2026
+#
+# Tests of finding the serial devices (deviceManager.py): using the cached
+# port and scanning again when a cached port cannot be opened.
+#
+# Usage:
+#   python -m pytest -q test_deviceManager.py
+#
+
+import collections, json, os, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import deviceManager
+
+portInfo = collections.namedtuple('portInfo', ('device', 'description', 'serial_number'))
+DEVICES = {'motor': {'match': ('description', 'Trinamic Stepper Device')}}
+
+
+@pytest.fixture
+def ports(tmp_path, monkeypatch):
+    # Ports listed by a scan. As on Windows, a cached port is trusted if it
+    # exists, so the ports are files here.
+    listed = []
+    monkeypatch.setattr(deviceManager.list_ports, 'comports', lambda: list(listed))
+    monkeypatch.setattr(deviceManager.sys, 'platform', 'win32')
+    for name in ('COM3', 'COM4'):
+        (tmp_path / name).write_text(u'')
+    return listed, str(tmp_path)
+
+
+def opener(working):
+    opened = []
+    def openPort(port):
+        opened.append(port)
+        if port not in working:
+            raise IOError("could not open port " + str(port))
+        return 'interface on ' + port
+    return openPort, opened
+
+
+def managerWithCache(tmp_path, cache):
+    path = os.path.join(tmp_path, 'deviceCache.json')
+    with open(path, 'w') as cacheFile:
+        json.dump(cache, cacheFile)
+    return deviceManager.deviceManager(cachePath=path, devices=DEVICES), path
+
+
+def test_cachedPortUsed(ports):
+    listed, tmp_path = ports
+    com3 = os.path.join(tmp_path, 'COM3')
+    manager, path = managerWithCache(tmp_path, {'motor': com3})
+    openPort, opened = opener([com3])
+    assert manager.openWith('motor', openPort) == 'interface on ' + com3
+    assert opened == [com3]
+    assert manager.scans == 0 and manager.cacheHits == 1
+
+
+def test_staleCachedPort(ports):
+    # Motor moved from COM3 to COM4: COM3 still exists but is another device
+    listed, tmp_path = ports
+    com3 = os.path.join(tmp_path, 'COM3')
+    com4 = os.path.join(tmp_path, 'COM4')
+    listed.append(portInfo(com4, 'Trinamic Stepper Device', None))
+    manager, path = managerWithCache(tmp_path, {'motor': com3})
+    openPort, opened = opener([com4])
+    assert manager.openWith('motor', openPort) == 'interface on ' + com4
+    assert opened == [com3, com4]
+    assert manager.scans == 1
+    with open(path) as cacheFile:
+        assert json.load(cacheFile) == {'motor': com4}
+    # Next time the new port is used without scanning
+    manager = deviceManager.deviceManager(cachePath=path, devices=DEVICES)
+    openPort, opened = opener([com4])
+    manager.openWith('motor', openPort)
+    assert opened == [com4] and manager.scans == 0
+
+
+def test_deviceMissing(ports):
+    listed, tmp_path = ports
+    com3 = os.path.join(tmp_path, 'COM3')
+    manager, path = managerWithCache(tmp_path, {'motor': com3})
+    openPort, opened = opener([])
+    with pytest.raises(IOError):
+        manager.openWith('motor', openPort)
+    # Scanned once only, and the stale port is no longer cached
+    assert opened == [com3] and manager.scans == 1
+    assert manager.findPort('motor') is None
+
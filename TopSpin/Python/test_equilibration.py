@@ -0,0 +1,57 @@
+#
+# test_equilibration.py
+# Version 1.0, Oct 2026
+#
+# Tests of the temperature equilibration detector (equilibration.py) on
+# synthetic readings.
+#
+# Usage:
+#   python -m pytest -q test_equilibration.py
+#
+
+import math, os, random, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import equilibration
+
+
+def test_normalQuantile():
+    assert equilibration.normalQuantile(0.975) == pytest.approx(1.959964, abs=1e-5)
+    assert equilibration.normalQuantile(0.5) == pytest.approx(0.0, abs=1e-9)
+    assert equilibration.normalQuantile(0.025) == pytest.approx(-1.959964, abs=1e-5)
+    assert equilibration.equilibrationDetector(confidence=0.95).z == pytest.approx(1.96, abs=1e-3)
+    with pytest.raises(ValueError):
+        equilibration.normalQuantile(1.0)
+
+
+def test_exponentialApproach():
+    # T = 25 + 5 exp(-t / 60) degC with 0.01 degC noise, one reading per
+    # second. Within 0.1 degC of the set point after 60 ln(50) = 235 s.
+    noise = random.Random(1)
+    settle = 60 * math.log(50)
+    detector = equilibration.equilibrationDetector(setpoint=25.0, tolerance=0.1, confidence=0.95)
+    predicted = {}
+    for t in range(1200):
+        detector.add(float(t), 25 + 5 * math.exp(-t / 60.0) + noise.gauss(0, 0.01))
+        if t in (100, 200):
+            predicted[t] = detector.predict()
+        if detector.ready():
+            break
+    assert detector.ready()
+    assert settle < detector.readyTime < settle + 120
+    # The prediction improves as the temperature settles
+    assert predicted[100] == pytest.approx(settle, rel=0.25)
+    assert predicted[200] == pytest.approx(settle, rel=0.1)
+    assert abs(predicted[200] - settle) < abs(predicted[100] - settle)
+    result = detector.result()
+    assert result['actual'] == detector.readyTime
+    assert result['predictedFirst'] == predicted[100]
+    assert result['predictedLast'] == predicted[200]
+
+
+def test_notReadyWhileChanging():
+    detector = equilibration.equilibrationDetector(tolerance=0.1)
+    for t in range(120):
+        detector.add(float(t), 20 + 0.05 * t)
+        assert not detector.ready()
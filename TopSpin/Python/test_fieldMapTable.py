@@ -0,0 +1,193 @@
+#
+# test_fieldMapTable.py
+# Version 1.0, Oct 2026
+#
+# Tests of the field map lookups (fieldMapTable.py): linear and monotone
+# cubic (PCHIP) interpolation, the inverse lookup and checks of the map.
+#
+# Usage:
+#   python -m pytest -q test_fieldMapTable.py
+#
+
+import math, os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fieldMapTable
+
+FIELD_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TC field map.csv')
+
+# Falling field with a sharp step, where an ordinary cubic spline overshoots
+DISTANCE = [0.0, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0]
+FIELD = [100.0, 100.0, 99.0, 60.0, 5.0, 4.0, 3.9, 3.9]
+
+
+@pytest.mark.parametrize('method', ['linear', 'pchip'])
+def test_fieldAtPoints(method):
+    table = fieldMapTable.fieldMapTable(DISTANCE, FIELD, method=method)
+    for z, B in zip(DISTANCE, FIELD):
+        assert table.fieldAt(z) == pytest.approx(B)
+    # Field at nearest end beyond the map
+    assert table.fieldAt(-1.0) == pytest.approx(100.0)
+    assert table.fieldAt(10.0) == pytest.approx(3.9)
+
+
+def test_pchipMonotone():
+    table = fieldMapTable.fieldMapTable(DISTANCE, FIELD, method='pchip')
+    z = np.linspace(0.0, 7.0, 701)
+    B = table.fieldAt(z)
+    assert np.all(np.diff(B) <= 1e-12)
+    assert B.max() <= 100.0 + 1e-12 and B.min() >= 3.9 - 1e-12
+    # Flat sections stay flat
+    assert np.allclose(table.fieldAt(np.linspace(0.0, 1.0, 11)), 100.0)
+    # Inverse lookup is monotone too
+    field = np.linspace(table.minField, table.maxField, 501)
+    assert np.all(np.diff(table.distanceAt(field)) <= 1e-12)
+
+
+@pytest.mark.parametrize('method', ['linear', 'pchip'])
+def test_scalarMatchesArray(method):
+    table = fieldMapTable.fieldMapTable(DISTANCE, FIELD, method=method)
+    z = np.linspace(-0.5, 7.5, 33)
+    assert np.allclose(table.fieldAt(z), [table.fieldAt(float(v)) for v in z])
+    B = np.linspace(4.5, 95.0, 21)
+    assert np.allclose(table.distanceAt(B), [table.distanceAt(float(v)) for v in B])
+
+
+@pytest.mark.parametrize('method', ['linear', 'pchip'])
+def test_inverseLookup(method):
+    table = fieldMapTable.load(FIELD_MAP, method=method, cache=False)
+    # Inverse lookup is not well defined on the flat top near the peak
+    z = np.linspace(10.0, table.maxDistance - 1.0, 200)
+    assert np.allclose(table.distanceAt(table.fieldAt(z)), z, atol=0.05)
+    for zi in z[::20]:
+        assert table.distanceAt(table.fieldAt(float(zi))) == pytest.approx(zi, abs=0.05)
+
+
+def test_outsideFieldMap():
+    table = fieldMapTable.fieldMapTable(DISTANCE, FIELD)
+    assert table.distanceAt(table.maxField + 1.0) is None
+    assert table.distanceAt(table.minField - 1.0) is None
+    z = table.distanceAt([table.minField - 1.0, 50.0, table.maxField + 1.0])
+    assert math.isnan(z[0]) and math.isnan(z[2]) and 3.0 < z[1] < 4.0
+
+
+def test_noiseRemoved():
+    # Rise of less than 0.5 % of the peak field is ignored for the inverse
+    table = fieldMapTable.fieldMapTable([0.0, 1.0, 2.0, 3.0, 4.0], [100.0, 50.0, 50.3, 20.0, 10.0])
+    assert list(table.tables['inverseField']) == [10.0, 20.0, 50.0, 100.0]
+    assert table.distanceAt(50.0) == pytest.approx(1.0)
+
+
+def test_invalidFieldMaps():
+    with pytest.raises(ValueError):
+        fieldMapTable.fieldMapTable([0.0], [1.0])
+    with pytest.raises(ValueError):
+        fieldMapTable.fieldMapTable([0.0, 2.0, 1.0], [3.0, 2.0, 1.0])
+    with pytest.raises(ValueError):
+        fieldMapTable.fieldMapTable([0.0, 1.0, 2.0], [100.0, 50.0, 60.0])
+    with pytest.raises(ValueError):
+        fieldMapTable.fieldMapTable([0.0, 1.0], [1.0, 2.0])
+    with pytest.raises(ValueError):
+        fieldMapTable.fieldMapTable(DISTANCE, FIELD, method='cubic')
+
+
+@pytest.fixture
+def cachedMap(tmp_path, monkeypatch):
+    # Copy of the field map, and a count of the times the tables are built
+    path = str(tmp_path / 'fieldMap.csv')
+    with open(FIELD_MAP, 'rb') as source, open(path, 'wb') as copy:
+        copy.write(source.read())
+    built = []
+    buildTables = fieldMapTable._buildTables
+    def countBuilds(*args):
+        built.append(1)
+        return buildTables(*args)
+    monkeypatch.setattr(fieldMapTable, '_buildTables', countBuilds)
+    return path, built
+
+
+def rewrite(path, old, new):
+    # Replace text in the field map, keeping its modification time
+    info = os.stat(path)
+    with open(path, 'rb') as fieldMap:
+        content = fieldMap.read()
+    with open(path, 'wb') as fieldMap:
+        fieldMap.write(content.replace(old, new, 1))
+    os.utime(path, (info.st_atime, info.st_mtime))
+
+
+def test_cacheUsed(cachedMap):
+    path, built = cachedMap
+    first = fieldMapTable.load(path)
+    assert os.path.exists(fieldMapTable.cachePath(path)) and len(built) == 1
+    second = fieldMapTable.load(path, method='pchip')
+    assert len(built) == 1
+    assert np.allclose(second.distanceValues, first.distanceValues)
+    assert second.fitParameters == pytest.approx(first.fitParameters, nan_ok=True)
+    assert second.distanceAt(1000.0) == pytest.approx(
+        fieldMapTable.load(path, method='pchip', cache=False).distanceAt(1000.0))
+
+
+def test_cacheTouched(cachedMap):
+    # Same contents with a new modification time: the tables are not rebuilt,
+    # but the cache is updated so the CRC is not needed next time
+    path, built = cachedMap
+    fieldMapTable.load(path)
+    info = os.stat(path)
+    os.utime(path, (info.st_atime, info.st_mtime + 10))
+    fieldMapTable.load(path)
+    assert len(built) == 1
+    values = fieldMapTable._readCache(fieldMapTable.cachePath(path))
+    assert float(values[1]) == os.stat(path).st_mtime
+
+
+def test_cacheChangedSameSize(cachedMap):
+    # Changed value of the same length: found from the new modification
+    # time and the CRC
+    path, built = cachedMap
+    table = fieldMapTable.load(path)
+    rewrite(path, b'7.174149999999999636e+03', b'7.174159999999999636e+03')
+    info = os.stat(path)
+    os.utime(path, (info.st_atime, info.st_mtime + 10))
+    changed = fieldMapTable.load(path)
+    assert len(built) == 2
+    assert changed.fieldValues[0] != table.fieldValues[0]
+
+
+def test_cacheChangedSize(cachedMap):
+    path, built = cachedMap
+    fieldMapTable.load(path)
+    rewrite(path, b'7.174149999999999636e+03', b'7.17415e+03')
+    changed = fieldMapTable.load(path)
+    assert len(built) == 2
+    assert float(changed.fieldValues[0]) == 7174.15
+
+
+def test_cacheInvalid(cachedMap):
+    path, built = cachedMap
+    fieldMapTable.load(path)
+    with open(fieldMapTable.cachePath(path), 'r+b') as cacheFile:
+        cacheFile.truncate(200)
+    assert fieldMapTable._readCache(fieldMapTable.cachePath(path)) is None
+    fieldMapTable.load(path)
+    assert len(built) == 2
+    assert fieldMapTable._readCache(fieldMapTable.cachePath(path)) is not None
+
+
+def test_cacheWithoutNumPy(cachedMap, monkeypatch):
+    # Cache written with NumPy is read back with the array module (Jython)
+    path, built = cachedMap
+    table = fieldMapTable.load(path, method='pchip')
+    monkeypatch.setattr(fieldMapTable, 'np', None)
+    plain = fieldMapTable.load(path, method='pchip')
+    assert len(built) == 1
+    assert plain.fieldAt(12.3) == pytest.approx(table.fieldAt(12.3))
+    assert plain.distanceAt(500.0) == pytest.approx(table.distanceAt(500.0))
+    # Cache written without NumPy is read by NumPy
+    os.remove(fieldMapTable.cachePath(path))
+    fieldMapTable.load(path)
+    monkeypatch.setattr(fieldMapTable, 'np', np)
+    assert fieldMapTable.load(path, method='pchip').fieldAt(12.3) == pytest.approx(table.fieldAt(12.3))
+    assert len(built) == 2
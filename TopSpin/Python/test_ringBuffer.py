@@ -0,0 +1,130 @@
+#
+# test_ringBuffer.py
+# Version 1.0, Oct 2026
+#
+# Tests of the buffer of recent samples (ringBuffer.py): wrapping round,
+# reading new samples after an overrun and changing the capacity.
+#
+# Usage:
+#   python -m pytest -q test_ringBuffer.py
+#
+
+import os, sys, threading, time
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import ringBuffer
+
+DTYPE = [('time', 'f8'), ('value', 'i8')]
+
+
+def filled(capacity, n):
+    buffer = ringBuffer.ringBuffer(capacity, DTYPE)
+    for i in range(n):
+        buffer.append((0.1 * i, i))
+    return buffer
+
+
+def test_empty():
+    buffer = ringBuffer.ringBuffer(4, DTYPE)
+    assert len(buffer) == 0 and buffer.latest() is None
+    assert len(buffer.view()) == 0
+    rows, index = buffer.since(0)
+    assert len(rows) == 0 and index == 0
+
+
+def test_wrapRound():
+    buffer = filled(5, 13)
+    assert len(buffer) == 5 and buffer.count == 13
+    assert list(buffer.view()['value']) == [8, 9, 10, 11, 12]
+    assert list(buffer.snapshot(2)['value']) == [11, 12]
+    assert buffer.latest()['value'] == 12
+    # View is contiguous, in the buffer's own memory
+    assert np.shares_memory(buffer.view(), buffer.data)
+
+
+def test_extend():
+    buffer = filled(5, 3)
+    buffer.extend([(0.0, 100 + i) for i in range(4)])
+    assert list(buffer.view()['value']) == [2, 100, 101, 102, 103]
+    # More rows than the capacity: only the last ones are kept
+    buffer.extend([(0.0, 200 + i) for i in range(12)])
+    assert buffer.count == 3 + 4 + 12
+    assert list(buffer.view()['value']) == [207, 208, 209, 210, 211]
+    buffer.extend([])
+    assert buffer.count == 19
+
+
+def test_since():
+    buffer = filled(5, 3)
+    rows, index = buffer.since(0)
+    assert list(rows['value']) == [0, 1, 2] and index == 3
+    buffer.append((0.0, 3))
+    rows, index = buffer.since(index)
+    assert list(rows['value']) == [3] and index == 4
+    rows, index = buffer.since(index)
+    assert len(rows) == 0 and index == 4
+    assert buffer.lost == 0
+
+
+def test_sinceAfterOverrun():
+    buffer = filled(5, 3)
+    rows, index = buffer.since(0)
+    for i in range(3, 12):
+        buffer.append((0.0, i))
+    # Samples 3 to 6 were overwritten before they were read
+    rows, index = buffer.since(index)
+    assert list(rows['value']) == [7, 8, 9, 10, 11] and index == 12
+    assert buffer.lost == 4
+    # Rows returned are a copy
+    rows['value'][0] = -1
+    assert buffer.view()['value'][0] == 7
+
+
+def test_resize():
+    buffer = filled(5, 12)
+    buffer.resize(3)
+    assert buffer.capacity == 3 and len(buffer) == 3 and buffer.count == 12
+    assert list(buffer.view()['value']) == [9, 10, 11]
+    buffer.append((0.0, 12))
+    assert list(buffer.view()['value']) == [10, 11, 12]
+    # Larger capacity keeps the samples and the numbering
+    buffer.resize(8)
+    assert list(buffer.view()['value']) == [10, 11, 12]
+    for i in range(13, 20):
+        buffer.append((0.0, i))
+    assert list(buffer.view()['value']) == list(range(12, 20))
+    rows, index = buffer.since(15)
+    assert list(rows['value']) == [15, 16, 17, 18, 19] and index == 20
+
+
+def test_wait():
+    buffer = filled(5, 2)
+    assert buffer.wait(1, timeout=0)
+    start = time.time()
+    assert not buffer.wait(2, timeout=0.1)
+    assert time.time() - start >= 0.09
+    timer = threading.Timer(0.05, buffer.append, args=((0.0, 2),))
+    timer.start()
+    assert buffer.wait(2, timeout=5.0)
+    timer.join()
+
+
+def test_threadedReader():
+    # Everything appended by one thread is read once by another
+    buffer = ringBuffer.ringBuffer(1000, DTYPE)
+    values = []
+    def reader():
+        index = 0
+        while index < 5000:
+            buffer.wait(index, timeout=1.0)
+            rows, index = buffer.since(index)
+            values.extend(rows['value'])
+    thread = threading.Thread(target=reader)
+    thread.start()
+    for i in range(50):
+        buffer.extend([(0.0, 100 * i + j) for j in range(100)])
+        time.sleep(0.001)
+    thread.join(10.0)
+    assert values == list(range(5000)) and buffer.lost == 0
@@ -0,0 +1,111 @@
+#
+# test_sensorStream.py
+# Version 1.0, Oct 2026
+#
+# Tests of the parser for the sensor Arduino data stream
+# (Python/sensorStream.py): records split between reads, garbled lines and
+# reading the simulated Arduino (deviceSimulator.py) in the background.
+#
+# Usage:
+#   python -m pytest -q test_sensorStream.py
+#
+
+import os, sys, time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Python'))
+import deviceSimulator
+import ringBuffer
+import sensorStream
+
+LINE = b"{21.50, 21.62, 21.48, 2.6250, 25.0, 24.9}\r\n"
+VALUES = (21.50, 21.62, 21.48, 2.6250, 25.0, 24.9)
+
+
+def test_completeRecords():
+    parser = sensorStream.frameParser()
+    records = parser.feed(LINE + LINE.replace(b'21.50', b'-3.25'), timestamp=5.0)
+    assert len(records) == 2 and parser.records == 2
+    assert records[0] == sensorStream.sensorRecord(5.0, *VALUES)
+    assert records[1].PT100_1 == -3.25 and records[1].hallVoltage == 2.625
+
+
+def test_splitRecords():
+    # Record arriving one byte at a time is returned once, when complete
+    parser = sensorStream.frameParser()
+    stream = LINE * 3
+    records = []
+    for i in range(len(stream)):
+        records += parser.feed(stream[i:i + 1], timestamp=float(i))
+    assert [record[1:] for record in records] == [VALUES] * 3
+    # Timestamp is when the end of the line was read
+    assert records[0].time == float(len(LINE) - 1)
+    # Split between two reads at every position
+    for split in range(1, len(LINE)):
+        parser = sensorStream.frameParser()
+        assert parser.feed(LINE[:split]) == []
+        assert [record[1:] for record in parser.feed(LINE[split:])] == [VALUES]
+        assert parser.errors == 0 and parser.length == 0
+
+
+def test_garbledRecords():
+    parser = sensorStream.frameParser()
+    records = parser.feed(b"{21.50, 21.62, 21.48, 2.6250, 25.0\r\n"         # missing value
+                          b"{21.50, 21.62, 21.48, 2.62#0, 25.0, 24.9}\r\n"  # corrupt value
+                          b"{21.50, 21.62, 21.48, 2.6250, 25.0, 24.9\r\n"   # no closing brace
+                          b"\xff\xfe\x00\r\n"
+                          + LINE)
+    assert [record[1:] for record in records] == [VALUES]
+    assert parser.errors == 3 and parser.records == 1
+
+
+def test_messages():
+    # Start-up messages and fault reports, including one which runs into a record
+    parser = sensorStream.frameParser()
+    records = parser.feed(b"Adafruit MAX31865 PT100 & Adafruit ADS1115 ADC Sensor Test\r\n"
+                          b"\r\n"
+                          b"Sensor 2 Fault 0x40" + LINE)
+    assert [record[1:] for record in records] == [VALUES]
+    assert list(parser.messages) == ["Adafruit MAX31865 PT100 & Adafruit ADS1115 ADC Sensor Test",
+                                     "Sensor 2 Fault 0x40"]
+
+
+def test_overflow():
+    # Line longer than the buffer is discarded, and parsing carries on
+    parser = sensorStream.frameParser(size=64)
+    records = parser.feed(b"x" * 150)
+    records += parser.feed(b"\n" + LINE)
+    assert [record[1:] for record in records] == [VALUES]
+    assert parser.overflows == 2
+    parser.feed(LINE[:10])
+    parser.reset()
+    assert [record[1:] for record in parser.feed(LINE)] == [VALUES]
+
+
+def test_readFromSimulator():
+    port = deviceSimulator.simulatedSensorArduino(interval=0.0, conversionTime=0.02, faultRate=0.2, seed=1)
+    parser = sensorStream.frameParser()
+    records = []
+    # About 20 lines a second at 9600 baud
+    end = time.time() + 0.5
+    while time.time() < end:
+        records += parser.readFrom(port)
+    port.close()
+    assert len(records) >= 3
+    assert parser.errors == 0
+    assert any(message.startswith("Sensor") for message in parser.messages)
+    assert all(15 < record.PT100_1 < 30 for record in records)
+
+
+def test_sensorReader():
+    port = deviceSimulator.simulatedSensorArduino(interval=0.0, conversionTime=0.02, seed=2)
+    buffer = ringBuffer.ringBuffer(100, sensorStream.RECORD_DTYPE)
+    reader = sensorStream.sensorReader(port, buffer)
+    reader.start()
+    assert buffer.wait(4, timeout=5.0)
+    reader.stop()
+    port.close()
+    rows = buffer.snapshot()
+    assert reader.error is None
+    assert len(rows) >= 5 and (rows['time'][1:] >= rows['time'][:-1]).all()
@@ -0,0 +1,121 @@
+#
+# test_shuttleService.py
+# Version 1.0, Oct 2026
+#
+# Tests that the shuttle service (shuttleService.py) keeps running and
+# leaves the motor safe after bad requests and unexpected errors, using the
+# simulated motor (tmcmSimulator.py), and that it reloads NMRShuttleSetup.py.
+#
+# Usage:
+#   python -m pytest -q test_shuttleService.py
+#
+
+import importlib, json, os, socket, sys, threading
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import NMRShuttle
+import NMRShuttleSetup
+import fieldMapTable
+import shuttleService
+import stallTuning
+import tmcmSimulator
+
+FIELD_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TC field map.csv')
+
+
+@pytest.fixture
+def service():
+    setup = NMRShuttleSetup.NMRShuttle()
+    service = shuttleService.shuttleService(setup, fieldMapPath=FIELD_MAP)
+    service.fieldMap = fieldMapTable.load(FIELD_MAP, cache=False)
+    service.fieldMapTime = os.stat(FIELD_MAP).st_mtime
+    service.myInterface = tmcmSimulator.simulatedInterface(model=setup.model)
+    service.module = tmcmSimulator.simulatedTMCM(service.myInterface)
+    yield service
+    service.disconnect()
+
+
+def test_invalidRequestFromClosedClient(service):
+    # The reply to an invalid request cannot be sent once the client has gone
+    client, connection = socket.socketpair()
+    client.sendall(b"not json\n")
+    client.close()
+    service.handle(connection)
+    connection.close()
+
+
+def test_unexpectedErrorCleansUp(service, monkeypatch):
+    def fail(*arguments, **keywords):
+        raise ZeroDivisionError("division by zero")
+    monkeypatch.setattr(NMRShuttle, 'runSequence', fail)
+    service.module.setUserVariable(1, 1000)
+    assert service.run(['1'], None) == 1
+    assert service.module.userVariable(1) == 0
+    assert service.module.userVariable(15) == -2
+
+
+def test_serviceContinuesAfterError(service, monkeypatch, tmp_path):
+    # The planned trajectory is saved in the working directory
+    monkeypatch.chdir(tmp_path)
+    server = socket.socket()
+    server.bind(('localhost', 0))
+    port = server.getsockname()[1]
+    server.close()
+    plan = service.plan
+    calls = []
+    def planOnce(arguments):
+        calls.append(arguments)
+        if len(calls) == 1:
+            raise RuntimeError("unexpected")
+        return plan(arguments)
+    monkeypatch.setattr(service, 'plan', planOnce)
+    monkeypatch.setattr(service, 'disconnect', lambda: None)
+    thread = threading.Thread(target=service.serve, kwargs={'port': port})
+    thread.daemon = True
+    thread.start()
+
+    def request(line):
+        for attempt in range(100):
+            try:
+                client = socket.create_connection(('localhost', port), timeout=5.0)
+                break
+            except (IOError, OSError):
+                threading.Event().wait(0.05)
+        client.sendall(line)
+        reply = client.makefile('r').readline()
+        client.close()
+        return reply
+
+    arguments = {'plan': ['1', '20', '10', '22.74', '0', '0']}
+    assert request((json.dumps(arguments) + "\n").encode('utf-8')) == ''
+    result = json.loads(request((json.dumps(arguments) + "\n").encode('utf-8')))
+    assert result['motionTime'] > 0
+    assert thread.is_alive()
+
+
+def test_setupReloaded(service, monkeypatch, tmp_path):
+    # A stall guard setting added by stallTuning.py is used without restarting
+    copy = tmp_path / 'NMRShuttleSetup.py'
+    with open(service.setupPath) as setupFile:
+        copy.write_text(setupFile.read())
+    monkeypatch.syspath_prepend(str(tmp_path))
+    service.setupPath = str(copy)
+    service.setupTime = os.stat(str(copy)).st_mtime
+    original = service.setup
+    try:
+        assert service.getSetup() is original
+        profile = stallTuning.profileText(42, 1, NMRShuttleSetup.stallGuard_1(), 12.5, 20.0)
+        stallTuning.addProfile(profile, path=str(copy))
+        os.utime(str(copy), (service.setupTime + 5, service.setupTime + 5))
+        setup = service.getSetup()
+        assert setup is not original and service.setup is setup
+        assert NMRShuttle.stallGuardSettings(42).speed == 12.5
+        assert service.getSetup() is setup
+    finally:
+        # Back to the real setup file for the other tests
+        monkeypatch.undo()
+        importlib.reload(NMRShuttleSetup)
+        if hasattr(NMRShuttleSetup, 'stallGuard_42'):
+            del NMRShuttleSetup.stallGuard_42
+    assert os.path.dirname(os.path.abspath(NMRShuttleSetup.__file__)) != str(tmp_path)
@@ -0,0 +1,228 @@
+#
+# test_shuttleSimulator.py
+# Version 1.0, Oct 2026
+#
+# Tests of the shuttle sequence (NMRShuttle.runSequence), the motion
+# planner and stall recovery (stallTuning.py) against the simulated motor
+# (tmcmSimulator.py), so that no hardware is needed. Transit times are measured with the motor tick timer,
+# as recorded by shuttleTelemetry.py.
+#
+# Usage:
+#   python -m pytest -q test_shuttleSimulator.py
+#
+
+import json, os, subprocess, sys, threading, time
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import NMRShuttle
+import NMRShuttleSetup
+import fieldMapTable
+import motionPlanner
+import motorSupervisor
+import stallTuning
+import tmclBatch
+import tmcmSimulator
+
+FIELD_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TC field map.csv')
+
+
+@pytest.fixture(scope='module')
+def fieldMap():
+    return fieldMapTable.load(FIELD_MAP, cache=False)
+
+
+@pytest.fixture
+def setup(tmp_path):
+    setup = NMRShuttleSetup.NMRShuttle()
+    setup.telemetryLog = str(tmp_path / 'shuttleTelemetry.jsonl')
+    return setup
+
+
+def runSimulated(arguments, setup, fieldMap, upDelay, downDelay, timeout=30.0, startDelay=0.0,
+                 myInterface=None, stopWhen=None):
+    # Run a sequence on the simulated motor, with triggers after upDelay and
+    # downDelay (s), the first no sooner than startDelay (s). STOP is sent
+    # after timeout (s), or as soon as stopWhen(motor) is True. If
+    # myInterface is given it is used and left open. Returns whether the
+    # sequence finished, the transit records of the telemetry log, the
+    # simulated motor and the time at which the sequence finished.
+    close = myInterface is None
+    if myInterface is None:
+        myInterface = tmcmSimulator.simulatedInterface(model=setup.model)
+    myInterface.motor.upDelay = upDelay
+    myInterface.motor.downDelay = downDelay
+    module = tmcmSimulator.simulatedTMCM(myInterface)
+    myInterface.motor.parkedSince = time.time() + startDelay
+    read, write = os.pipe()
+    stdin = os.fdopen(read)
+    result = {}
+
+    def run():
+        try:
+            result['status'] = NMRShuttle.runSequence(arguments, setup, fieldMap, myInterface, module, stdin=stdin)
+        except SystemExit as err:
+            result['status'] = err.code
+        result['end'] = time.time()
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    end = time.time() + timeout
+    while thread.is_alive() and time.time() < end:
+        if stopWhen is not None and stopWhen(myInterface.motor):
+            break
+        thread.join(0.01)
+    finished = not thread.is_alive()
+    if not finished:
+        os.write(write, b"STOP\n")
+        thread.join(5.0)
+    if close:
+        myInterface.close()
+    os.close(write)
+    stdin.close()
+    with open(setup.telemetryLog) as log:
+        records = [json.loads(line) for line in log]
+    transits = [record for record in records if record['type'] == 'transit']
+    return finished and result.get('status') == 0, transits, myInterface.motor, result.get('end')
+
+
+def test_constantVelocityTransitMatchesPlan(setup, fieldMap):
+    # The motor must move at the planned speed, not the maximum speed
+    finished, transits, motor, end = runSimulated(['1', '1', '1000', '2', '1', '10', '22.74', '20', '0'],
+                                             setup, fieldMap, upDelay=0.2, downDelay=0.2)
+    assert finished
+    assert len(transits) == 4
+    for record in transits:
+        assert record['triggerToArrival'] == pytest.approx(record['predicted'], rel=0.03)
+
+
+def test_speedForTimeBelowMinimumTime(setup):
+    units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)
+    accel = units.accelFromMotor(units.accelToMotor(setup.accel))
+    minimumTime = 2 * (40.0 / accel)**0.5
+    with pytest.raises(ValueError):
+        motionPlanner.speedForTime(40.0, 0.999 * minimumTime, setup.accel, units)
+    with pytest.raises(ValueError):
+        motionPlanner.speedForTime(40.0, 1.01 * minimumTime, setup.accel, units, maxSpeed=10.0)
+    speed = motionPlanner.speedForTime(40.0, 1.01 * minimumTime, setup.accel, units)
+    assert motionPlanner.planMotion(40.0, speed, setup.accel, units).motionTime <= 1.01 * minimumTime
+
+
+def test_motionTimeWithoutNumPy(setup):
+    # runNMRShuttle.py plans constant velocity mode in TopSpin, which has no NumPy
+    units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)
+    expected = [motionPlanner.planMotion(distance, 20.0, setup.accel, units, maxSpeed=setup.maxSpeed).motionTime
+                for distance in (0.5, 40.0, 75.0)]
+    script = ("import json, sys; sys.modules['numpy'] = None\n"
+              "import motionPlanner, NMRShuttleSetup\n"
+              "setup = NMRShuttleSetup.NMRShuttle()\n"
+              "units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)\n"
+              "print(json.dumps([motionPlanner.motionTime(distance, 20.0, setup.accel, units, maxSpeed=setup.maxSpeed) for distance in (0.5, 40.0, 75.0)]))\n")
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)))
+    assert json.loads(output.decode().strip().splitlines()[-1]) == pytest.approx(expected)
+
+
+def test_movesShorterThanSlowInterval(setup, fieldMap):
+    # Whole up/down cycles finish between two slow polls of the supervisor,
+    # and every one of them must be counted
+    NS = 15
+    finished, transits, motor, end = runSimulated(['1', '1', '1000', str(NS), '1', '10', '400', '0.5', '0'],
+                                                  setup, fieldMap, upDelay=0.1, downDelay=0.1)
+    assert finished
+    assert [record['direction'] for record in transits] == ['up', 'down'] * NS
+    downs = [t for (t, direction, state) in motor.history if direction == 'down' and state == 'end']
+    assert len(downs) >= NS
+    # The sequence ends at the last down move, not at a later one
+    assert end - downs[NS - 1] < 0.5
+
+
+def test_supervisorLatencyWhileParked(setup):
+    # Parked polls are at most 50 ms apart, and fast again after each event
+    myInterface = tmcmSimulator.simulatedInterface(model=setup.model, upDelay=0.7, downDelay=0.7)
+    module = tmcmSimulator.simulatedTMCM(myInterface)
+    module.setMaxAcceleration(2000)
+    module.setMaxVelocity(1500)
+    module.setUserVariable(1, 20000)
+    supervisor = motorSupervisor.motorSupervisor(module, fastPeriod=0.2)
+    intervals = []
+    end = time.time() + 3.0
+    while time.time() < end:
+        supervisor.wait()
+        supervisor.update()
+        intervals.append(supervisor.interval())
+    myInterface.close()
+    assert len(supervisor.latencies) >= 4
+    assert max(supervisor.latencies) < 0.09
+    assert supervisor.slowInterval in intervals and supervisor.fastInterval in intervals
+    assert "ms max" in supervisor.summary()
+
+
+def test_variableFieldTriggerStraightAfterDown(setup, fieldMap):
+    # The spectrometer triggers the next upward move as soon as the sample is
+    # down, so the first move of each slice must wait for the new distance
+    finished, transits, motor, end = runSimulated(['1', '1', '1000,500', '2', '4', '40', '400', '10,30', '0'],
+                                                  setup, fieldMap, upDelay=0.2, downDelay=0.0, startDelay=1.0)
+    assert finished
+    ups = [record for record in transits if record['direction'] == 'up']
+    assert len(ups) == 8
+    starts = [t for (t, direction, state) in motor.history if direction == 'up' and state == 'start']
+    ends = [t for (t, direction, state) in motor.history if direction == 'up' and state == 'end']
+    for record, start, stop in zip(ups, starts, ends):
+        assert stop - start == pytest.approx(record['predicted'], rel=0.05)
+
+
+def test_stallRecoveryReturnsToStart(setup):
+    # Clearing the stall runs the Reset routine of the firmware, which sets
+    # the actual position to zero where the motor stopped
+    myInterface = tmcmSimulator.simulatedInterface(model=setup.model)
+    module = tmcmSimulator.simulatedTMCM(myInterface)
+    try:
+        batch = tmclBatch.tmclBatch(myInterface)
+        stallGuard = NMRShuttle.stallGuardSettings(1)
+        NMRShuttle.setStallGuard(batch, stallGuard)
+        batch.setAxisParameter(154, setup.pulDiv)
+        batch.setAxisParameter(153, setup.rampDiv)
+        uStepRes = batch.axisParameter(140)
+        uStepRes = batch.execute()[uStepRes]
+        units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, uStepRes, setup.pulDiv, setup.rampDiv)
+
+        # Load that stalls the motor part way up, at half the test speed
+        stallSpeed = units.NStep / units.circ * setup.speed / 2
+        myInterface.motor.load = tmcmSimulator.simulatedLoad(0.0, stallGuard.motorRunCurrent / 255.0 / stallSpeed, 0.0, noise=0.0)
+        tuner = stallTuning.stallTuner(module, batch, units, stallGuard, 20.0, repeats=1, log=None)
+        result = tuner.test(setup.speed, setup.accel, setup.speed / 4, setup.accel)
+        assert result['stalled']
+        stops = [entry for entry in myInterface.motor.history if entry[1] == 'error']
+        assert len(stops) == 1
+        assert abs(myInterface.motor.physicalPosition()) <= 1
+        assert module.actualPosition() == 0
+    finally:
+        myInterface.close()
+
+
+def test_stopWhileHeldDoesNotMoveLater(setup, fieldMap):
+    # The sequence is stopped while the sample is up at the end of the first
+    # slice, and the next upward move is triggered straight after it is down.
+    # That move is held for the settings of the second slice, and must not be
+    # started by the next sequence, which is never triggered.
+    myInterface = tmcmSimulator.simulatedInterface(model=setup.model)
+    motor = myInterface.motor
+    arguments = ['1', '1', '1000,500', '1', '2', '40', '400', '10,30', '0']
+    try:
+        upEnded = lambda motor: any(entry[1:] == ('up', 'end') for entry in motor.history)
+        finished, transits, motor, end = runSimulated(arguments, setup, fieldMap, upDelay=0.3, downDelay=0.0,
+                                                      startDelay=0.5, myInterface=myInterface, stopWhen=upEnded)
+        assert not finished
+        end = time.time() + 2.0
+        while ('up', 'cancel') not in [entry[1:] for entry in motor.history] and time.time() < end:
+            time.sleep(0.01)
+        assert ('up', 'cancel') in [entry[1:] for entry in motor.history]
+
+        finished, transits, motor, end = runSimulated(arguments, setup, fieldMap, upDelay=None, downDelay=None,
+                                                      timeout=1.0, myInterface=myInterface)
+        assert not finished
+        assert [entry[1:] for entry in motor.history].count(('up', 'start')) == 1
+        assert motor.physicalPosition() == 0
+    finally:
+        myInterface.close()
@@ -0,0 +1,136 @@
+#
+# test_speedTable.py
+# Version 1.0, Oct 2026
+#
+# Tests of the velocity sweep speed table (speedTable.py): building the
+# table from a ramp and uploading it to the simulated motor (tmcmSimulator.py).
+#
+# Usage:
+#   python -m pytest -q test_speedTable.py
+#
+
+import os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import speedTable
+import tmclBatch
+import tmcmSimulator
+
+NSTEP = 51200
+CIRC = 25.0
+
+
+class recordingModule(object):
+    # Records the user variables written, optionally corrupting one of them
+
+    def __init__(self, corrupt=None):
+        self.userVariables = {}
+        self.writes = []
+        self.corrupt = corrupt
+
+    def setUserVariable(self, index, value):
+        self.writes.append((index, value))
+        self.userVariables[index] = value + 1 if index == self.corrupt else value
+
+    def userVariable(self, index):
+        return self.userVariables.get(index, 0)
+
+
+@pytest.fixture
+def motor():
+    myInterface = tmcmSimulator.simulatedInterface(replyDelay=0)
+    yield myInterface, tmcmSimulator.simulatedTMCM(myInterface)
+    myInterface.close()
+
+
+def test_tableFollowsRamp():
+    ramp = lambda z: 0.1 + 0.9 * np.asarray(z) / 40.0
+    positions, speeds = speedTable.buildSpeedTable(ramp, 40.0, 1000, NSTEP, CIRC)
+    assert positions[0] == 0
+    assert 1 < len(positions) <= speedTable.TABLE_MAX
+    assert all(np.diff(positions) > 0)
+    assert positions[-1] < 40.0 * NSTEP / CIRC
+    assert all(np.diff(speeds) >= 0)
+    assert 100 <= speeds[0] and speeds[-1] <= 1000
+
+
+def test_steepRampGetsMoreEntries():
+    # Flat for the first half, then rising: the entries are placed where the speed changes
+    ramp = lambda z: np.where(np.asarray(z) < 20.0, 0.2, 0.2 + 0.8 * (np.asarray(z) - 20.0) / 20.0)
+    positions, speeds = speedTable.buildSpeedTable(ramp, 40.0, 1000, NSTEP, CIRC, segments=16)
+    half = 20.0 * NSTEP / CIRC
+    assert sum(1 for p in positions if p >= half) > 3 * sum(1 for p in positions if p < half)
+
+
+def test_flatRampUsesEqualDistances():
+    positions, speeds = speedTable.buildSpeedTable(lambda z: np.ones_like(z), 40.0, 500, NSTEP, CIRC, segments=8)
+    assert len(positions) == 8
+    assert len(set(np.diff(positions))) <= 2
+    assert speeds == [500] * 8
+
+
+def test_segmentsLimitedToTable():
+    positions, speeds = speedTable.buildSpeedTable(lambda z: 0.1 + np.asarray(z), 40.0, 10, NSTEP, CIRC, segments=100)
+    assert len(positions) <= speedTable.TABLE_MAX
+    assert min(speeds) >= 1
+
+
+@pytest.mark.parametrize('batched', [False, True])
+def test_upload(motor, batched):
+    myInterface, module = motor
+    positions, speeds = [0, 2000, 4000], [200, 600, 1200]
+    batch = tmclBatch.tmclBatch(myInterface) if batched else None
+    speedTable.uploadSpeedTable(module, positions, speeds, batch=batch)
+    assert module.userVariable(speedTable.TABLE_LENGTH) == 3
+    for i in range(3):
+        assert module.userVariable(speedTable.TABLE_POSITION + i) == positions[i]
+        assert module.userVariable(speedTable.TABLE_SPEED + i) == speeds[i]
+    speedTable.clearSpeedTable(module)
+    assert module.userVariable(speedTable.TABLE_LENGTH) == 0
+
+
+def test_lengthWrittenLast():
+    # The firmware must never see a partly written table
+    module = recordingModule()
+    speedTable.uploadSpeedTable(module, [0, 100], [10, 20])
+    assert module.writes[0] == (speedTable.TABLE_LENGTH, 0)
+    assert module.writes[-1] == (speedTable.TABLE_LENGTH, 2)
+
+
+def test_uploadVerifies():
+    module = recordingModule(corrupt=speedTable.TABLE_SPEED + 1)
+    with pytest.raises(IOError):
+        speedTable.uploadSpeedTable(module, [0, 100], [10, 20])
+    assert module.userVariable(speedTable.TABLE_LENGTH) == 0
+
+
+def test_invalidTable():
+    module = recordingModule()
+    with pytest.raises(ValueError):
+        speedTable.uploadSpeedTable(module, [0, 100], [10])
+    with pytest.raises(ValueError):
+        speedTable.uploadSpeedTable(module, [], [])
+    with pytest.raises(ValueError):
+        speedTable.uploadSpeedTable(module, list(range(33)), [1] * 33)
+    assert module.writes == []
+
+
+def test_firmwareStepsThroughTable(motor):
+    # The firmware changes speed as the sample passes each entry
+    myInterface, module = motor
+    module.setMaxAcceleration(2000)
+    speedTable.uploadSpeedTable(module, [0, 5000, 10000], [400, 800, 1600])
+    module.setUserVariable(tmcmSimulator.DIST, 15000)
+    myInterface.motor.triggerUp()
+    speeds = set()
+    for i in range(500):
+        speeds.add(module.axisParameter(4))
+        if module.userVariable(tmcmSimulator.POSITION) == 1:
+            break
+        myInterface.motor.thread.join(0.01)
+    assert module.userVariable(tmcmSimulator.POSITION) == 1
+    assert module.actualPosition() == -15000
+    assert speeds <= {400, 800, 1600} and 1600 in speeds
+    assert module.userVariable(speedTable.TABLE_INDEX) == 3
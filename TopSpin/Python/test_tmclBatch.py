@@ -0,0 +1,130 @@
+#
+# test_tmclBatch.py
+# Version 1.0, Oct 2026
+#
+# Tests of batched TMCL commands (tmclBatch.py): frame encoding, reply
+# ordering and splitting of long batches, using the loopback serial port of
+# the simulated motor (tmcmSimulator.py).
+#
+# Usage:
+#   python -m pytest -q test_tmclBatch.py
+#
+
+import os, struct, sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import tmclBatch
+import tmcmSimulator
+
+
+class scriptedPort(object):
+    # Serial port which returns the given reply frames, whatever is written
+
+    def __init__(self, replies):
+        self.buffer = b''.join(replies)
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+        return len(data)
+
+    def read(self, size=1):
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+
+class scriptedInterface(object):
+    def __init__(self, replies):
+        self.serial = scriptedPort(replies)
+
+
+def reply(status, command, value):
+    frame = struct.pack('>BBBBi', 2, 1, status, command, value)
+    return frame + struct.pack('B', tmclBatch.checksum(frame))
+
+
+@pytest.fixture
+def myInterface():
+    myInterface = tmcmSimulator.simulatedInterface(replyDelay=0)
+    yield myInterface
+    myInterface.close()
+
+
+def test_encodeRequest():
+    frame = tmclBatch.encodeRequest(1, tmclBatch.SAP, 4, 0, -1000)
+    assert len(frame) == tmclBatch.FRAME_LENGTH
+    assert struct.unpack('>BBBBi', frame[:8]) == (1, tmclBatch.SAP, 4, 0, -1000)
+    assert bytearray(frame)[8] == tmclBatch.checksum(frame[:8])
+
+
+def test_decodeReply():
+    assert tmclBatch.decodeReply(reply(100, tmclBatch.GGP, -5)) == (100, tmclBatch.GGP, -5)
+    corrupt = bytearray(reply(100, tmclBatch.GGP, 5))
+    corrupt[7] ^= 1
+    with pytest.raises(IOError):
+        tmclBatch.decodeReply(bytes(corrupt))
+    with pytest.raises(IOError):
+        tmclBatch.decodeReply(reply(100, tmclBatch.GGP, 5)[:5])
+
+
+def test_repliesInOrder(myInterface):
+    batch = tmclBatch.tmclBatch(myInterface)
+    batch.setUserVariable(1, 40960)
+    batch.setUserVariable(2, -7)
+    batch.setAxisParameter(4, 1500)
+    first = batch.userVariable(1)
+    second = batch.userVariable(2)
+    speed = batch.axisParameter(4)
+    values = batch.execute()
+    assert (values[first], values[second], values[speed]) == (40960, -7, 1500)
+    assert len(values) == 6
+    # Everything in one transfer
+    assert myInterface.serial.writes == 1
+    assert batch.transfers == 1 and batch.commands == 6
+    assert batch.execute() == []
+
+
+def test_longBatchSplit(myInterface):
+    batch = tmclBatch.tmclBatch(myInterface, maxCommands=8)
+    for i in range(20):
+        batch.setUserVariable(64 + i, i * i)
+    for i in range(20):
+        batch.userVariable(64 + i)
+    values = batch.execute()
+    assert values[20:] == [i * i for i in range(20)]
+    assert myInterface.serial.writes == 5
+    assert batch.transfers == 5
+
+
+def test_withoutSerialPort(myInterface):
+    # Commands are sent one at a time through interface.send()
+    myInterface.serial = None
+    batch = tmclBatch.tmclBatch(myInterface)
+    batch.setUserVariable(1, 123)
+    batch.userVariable(1)
+    assert batch.execute() == [0, 123]
+    assert batch.transfers == 2
+
+
+def test_replyOutOfOrder():
+    batch = tmclBatch.tmclBatch(scriptedInterface([reply(100, tmclBatch.GGP, 1), reply(100, tmclBatch.GAP, 2)]))
+    batch.axisParameter(1)
+    batch.userVariable(8)
+    with pytest.raises(IOError):
+        batch.execute()
+
+
+def test_commandFailed(myInterface):
+    batch = tmclBatch.tmclBatch(myInterface)
+    batch.add(99, 0, 0)     # not a TMCL instruction the module supports
+    with pytest.raises(IOError):
+        batch.execute()
+
+
+def test_missingReply():
+    batch = tmclBatch.tmclBatch(scriptedInterface([reply(100, tmclBatch.GGP, 1)]))
+    batch.userVariable(8)
+    batch.userVariable(9)
+    with pytest.raises(IOError):
+        batch.execute()
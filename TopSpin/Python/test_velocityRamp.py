@@ -0,0 +1,82 @@
+#
+# test_velocityRamp.py
+# Version 1.0, Oct 2026
+#
+# Tests of the compiled velocity sweep ramp (velocityRamp.py): checking of
+# the equation and evaluation against the field map.
+#
+# Usage:
+#   python -m pytest -q test_velocityRamp.py
+#
+
+import math, os, sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fieldMapTable
+import velocityRamp
+
+FIELD_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'TC field map.csv')
+
+
+@pytest.fixture(scope='module')
+def fieldMap():
+    return fieldMapTable.load(FIELD_MAP, cache=False)
+
+
+@pytest.mark.parametrize('expression', [
+    "__import__('os').system('true')",
+    "z.__class__",
+    "(1).__class__.__bases__",
+    "math.__dict__",
+    "math.os",
+    "np.exp(z)",
+    "open('ramp.txt')",
+    "eval('z')",
+    "[z for z in (1, 2)][0]",
+    "(lambda x: x)(z)",
+    "{'a': z}['a']",
+    "z + y",
+    "1 +",
+])
+def test_rejected(expression, fieldMap):
+    with pytest.raises(ValueError):
+        velocityRamp.velocityRamp(expression, fieldMap)
+
+
+def test_needsVariable(fieldMap):
+    with pytest.raises(ValueError):
+        velocityRamp.velocityRamp("2 * math.pi", fieldMap)
+
+
+def test_positionRamp(fieldMap):
+    ramp = velocityRamp.velocityRamp("1 + 0.5 * math.sin(z / 10) + abs(min(z, 5))", fieldMap)
+    assert not ramp.usesField and ramp.usesPosition
+    z = np.linspace(0, 50, 11)
+    expected = [1 + 0.5 * math.sin(v / 10) + abs(min(v, 5)) for v in z]
+    assert np.allclose(ramp(z), expected)
+    assert ramp(20.0) == pytest.approx(expected[4])
+    assert isinstance(ramp(20.0), float)
+
+
+def test_fieldRamp(fieldMap):
+    # Older equations use currField and currPosition
+    ramp = velocityRamp.velocityRamp("math.log10(currField) + 0 * currPosition", fieldMap)
+    assert ramp.usesField
+    z = np.linspace(0, 70, 8)
+    assert np.allclose(ramp(z), np.log10(fieldMap.fieldAt(z)))
+    assert ramp(35.0) == pytest.approx(math.log10(fieldMap.fieldAt(35.0)))
+
+
+def test_constantOverArray(fieldMap):
+    # A ramp which does not depend on z still gives one value per position
+    ramp = velocityRamp.velocityRamp("Bz * 0 + 1", fieldMap)
+    assert list(ramp([0.0, 1.0, 2.0])) == [1.0, 1.0, 1.0]
+
+
+def test_validate(fieldMap):
+    velocityRamp.velocityRamp("1 / (1 + z)", fieldMap).validate(80.0)
+    for expression in ["1 - z / 40", "1 / (z - 40)", "math.log(z)", "math.sqrt(20 - z)"]:
+        with pytest.raises(ValueError):
+            velocityRamp.velocityRamp(expression, fieldMap).validate(80.0)
@@ -0,0 +1,183 @@
+#
+# tmclBatch.py
+# Version 1.0, Oct 2026
+#
+# Batched TMCL commands for the Trinamic TMCM-1160 / TMCM-1060 modules.
+#
+# Each PyTrinamic module call (module.setAxisParameter, module.userVariable...)
+# waits for the reply before the next command is sent, so every command costs
+# a full USB-serial round trip. A tmclBatch queues several commands, writes
+# the 9 byte TMCL frames back to back in one transfer and then reads the
+# replies, which the module sends in the same order. Motor configuration and
+# status queries then cost one round trip each.
+#
+# Usage:
+#   batch = tmclBatch.tmclBatch(myInterface)
+#   batch.setAxisParameter(154, 3)
+#   batch.userVariable(8)
+#   batch.statusFlags()
+#   values = batch.execute()        # [0, position, flags]
+#
+# If the interface has no serial port (e.g. a simulated interface without
+# one), the commands are sent one at a time through interface.send().
+#
+# Run this file to benchmark sequential and batched commands with the
+# simulated motor, or give a serial port to benchmark the real module:
+#   python tmclBatch.py [port]
+#
+
+import struct, sys, time
+
+
+# TMCL instruction numbers
+SAP = 5
+GAP = 6
+SGP = 9
+GGP = 10
+GIO = 15
+
+# Reply status codes for successful commands
+STATUS_OK = (100, 101)
+
+FRAME_LENGTH = 9
+
+
+def checksum(data):
+    return sum(bytearray(data)) & 0xFF
+
+
+def encodeRequest(moduleID, opcode, opType, motorBank, value):
+    # TMCL request frame: address, command, type, motor/bank, value (4 bytes, MSB first), checksum
+    frame = struct.pack('>BBBBi', moduleID, opcode, opType, motorBank, int(value))
+    return frame + struct.pack('B', checksum(frame))
+
+
+def decodeReply(frame):
+    # TMCL reply frame: reply address, module address, status, command, value, checksum.
+    # Returns (status, command, value).
+    if len(frame) != FRAME_LENGTH:
+        raise IOError("Incomplete TMCL reply (" + str(len(frame)) + " bytes).")
+    if checksum(frame[:8]) != bytearray(frame)[8]:
+        raise IOError("Checksum error in TMCL reply.")
+    replyAddress, moduleAddress, status, command, value = struct.unpack('>BBBBi', frame[:8])
+    return status, command, value
+
+
+
+class tmclBatch(object):
+
+    def __init__(self, interface, moduleID=1, maxCommands=32):
+        self.interface = interface
+        self.moduleID = moduleID
+        self.maxCommands = maxCommands
+        self.port = getattr(interface, 'serial', None)
+        self.requests = []
+
+        # Statistics
+        self.commands = 0
+        self.transfers = 0
+
+
+    def add(self, opcode, opType, motorBank, value=0):
+        # Queue a command. Returns its index in the list of values returned by execute().
+        self.requests.append((opcode, opType, motorBank, value))
+        return len(self.requests) - 1
+
+
+    # Same names as the PyTrinamic module methods
+    def setAxisParameter(self, commandType, value):
+        return self.add(SAP, commandType, 0, value)
+
+    def axisParameter(self, commandType):
+        return self.add(GAP, commandType, 0)
+
+    def setUserVariable(self, index, value):
+        return self.add(SGP, index, 2, value)
+
+    def userVariable(self, index):
+        return self.add(GGP, index, 2)
+
+    def getGlobalParameter(self, commandType, bank):
+        return self.add(GGP, commandType, bank)
+
+    def digitalInput(self, index):
+        return self.add(GIO, index, 0)
+
+    def statusFlags(self):
+        return self.axisParameter(207)
+
+
+    def execute(self):
+        # Send all queued commands and return the reply values in order
+        requests = self.requests
+        self.requests = []
+        values = []
+        for start in range(0, len(requests), self.maxCommands):
+            values += self._transfer(requests[start:start + self.maxCommands])
+        return values
+
+
+    def _transfer(self, requests):
+        self.commands += len(requests)
+        if self.port is None:
+            values = []
+            for (opcode, opType, motorBank, value) in requests:
+                reply = self.interface.send(opcode, opType, motorBank, value)
+                values.append(getattr(reply, 'value', reply))
+                self.transfers += 1
+            return values
+
+        self.transfers += 1
+        data = b''.join([encodeRequest(self.moduleID, *request) for request in requests])
+        self.port.write(data)
+        values = []
+        for (opcode, opType, motorBank, value) in requests:
+            status, command, replyValue = decodeReply(self.port.read(FRAME_LENGTH))
+            if command != opcode:
+                raise IOError("TMCL reply out of order (expected command " + str(opcode) + ", got " + str(command) + ").")
+            if status not in STATUS_OK:
+                raise IOError("TMCL command " + str(opcode) + " failed with status " + str(status) + ".")
+            values.append(replyValue)
+        return values
+
+
+
+def benchmark(module, batch, repeats=100):
+    # Time the four status queries used by the old supervision loop, sent one
+    # at a time and as a batch. Returns round trips per second for each.
+    start = time.time()
+    for i in range(repeats):
+        module.digitalInput(10)
+        module.statusFlags()
+        module.userVariable(8)
+        module.actualPosition()
+    sequential = 4 * repeats / (time.time() - start)
+
+    start = time.time()
+    for i in range(repeats):
+        batch.digitalInput(10)
+        batch.statusFlags()
+        batch.userVariable(8)
+        batch.axisParameter(1)
+        batch.execute()
+    batched = repeats / (time.time() - start)
+    return sequential, batched
+
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        from PyTrinamic.connections.serial_tmcl_interface import serial_tmcl_interface
+        from PyTrinamic.modules.TMCM_1160 import TMCM_1160
+        myInterface = serial_tmcl_interface(sys.argv[1])
+        module = TMCM_1160(myInterface)
+    else:
+        import tmcmSimulator
+        myInterface = tmcmSimulator.simulatedInterface()
+        module = tmcmSimulator.simulatedTMCM(myInterface)
+
+    batch = tmclBatch(myInterface)
+    sequential, batched = benchmark(module, batch)
+    print("Sequential: " + str(round(sequential,1)) + " round trips per second (" + str(round(sequential/4,1)) + " status updates per second)")
+    print("Batched:    " + str(round(batched,1)) + " round trips per second (" + str(round(batched,1)) + " status updates per second, " + str(round(4*batched,1)) + " commands per second)")
+    myInterface.close()
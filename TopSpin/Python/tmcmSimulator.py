@@ -0,0 +1,581 @@
+#
+# tmcmSimulator.py
+# Version 1.0, Oct 2026
+#
+# Simulated Trinamic TMCM-1160 / TMCM-1060 module running the NMR shuttle
+# firmware (NMRshuttle_1160_v4.tmc / NMRShuttle_1060_v4.tmc).
+#
+# The simulated module has the same methods as the PyTrinamic TMCM_1160 class
+# used by NMRShuttle.py and fieldMap.py, so that motor settings, speed tables
+# and the motion sequence can be tested without hardware. Each method call is
+# executed as a TMCL instruction with a configurable reply delay to stand in
+# for the USB-serial round trip. A background thread emulates the firmware:
+# trigger interrupts, upward/downward moves with trapezoidal kinematics,
+# the speed table used in velocity sweep mode, the event counter, the tick
+# timer, the limit on upward moves with the current settings (an upward
+# move triggered after the last one is held until the host sets the limit
+# again, or cancelled while the host sets it to CANCEL_HOLD) and the error
+# flags. When the host clears the error flag after an
+# error, the Reset routine of the firmware is run: the distance, speed table
+# and position state are cleared, the actual position is set to zero where
+# the motor stopped, and the up trigger is enabled again. The position of
+# the sample relative to where it started (not changed by setting the actual
+# position) is given by physicalPosition().
+#
+# The StallGuard2 load value (axis parameter 206) may be simulated by giving
+# the motor a load model (simulatedLoad), e.g. one of TUBE_LOADS for the three
+# tube types of NMRShuttleSetup.py. The motor then stops with a stall error
+# when the load value falls to 0 above the stall detection speed (axis
+# parameter 181), or when the load exceeds the torque available at the run
+# current. As on the real module, the extended error flags (axis parameter
+# 207) are cleared when read.
+#
+# Usage:
+#   myInterface = tmcmSimulator.simulatedInterface(model='TMCM-1160')
+#   module = tmcmSimulator.simulatedTMCM(myInterface)
+#   myInterface.motor.load = tmcmSimulator.TUBE_LOADS[1]
+#
+
+import random, struct, threading, time
+
+
+# TMCL instruction numbers
+MVP = 4
+SAP = 5
+GAP = 6
+SGP = 9
+GGP = 10
+SIO = 14
+GIO = 15
+
+# User variables used by the firmware
+DIST = 1
+POSITION = 8
+ERRFLAG = 9
+TABLE_LENGTH = 10
+TABLE_INDEX = 11
+EVENTS = 12
+TRIGGER_TICK = 13
+ARRIVAL_TICK = 14
+UP_MOVES = 15
+UP_PENDING = 16
+CANCEL_HOLD = -2
+TABLE_POSITION = 64
+TABLE_SPEED = 96
+
+
+class simulatedLoad(object):
+    # Load on the motor while moving the sample. Torques are fractions of the
+    # torque at full run current (255) and standstill. The load needs
+    #   friction + damping * |v| + inertia * |a|     (v in pps, a in pps^2)
+    # and the motor gives (run current / 255) * (1 - |v| / noLoadSpeed). The
+    # load value falls from 1023 with no load to 0 when the load needs all of
+    # the available torque, and each step of the StallGuard2 threshold raises
+    # it by thresholdStep (less sensitive detection).
+
+    def __init__(self, friction, damping, inertia, noLoadSpeed=150000.0, noise=8.0,
+                 thresholdStep=16, seed=None):
+        self.friction = friction
+        self.damping = damping
+        self.inertia = inertia
+        self.noLoadSpeed = noLoadSpeed
+        self.noise = noise
+        self.thresholdStep = thresholdStep
+        self.random = random.Random(seed)
+
+
+    def value(self, velocity, acceleration, current, threshold, filtered=False):
+        # Load value (0...1023) and whether the load exceeds the available torque
+        available = (current / 255.0) * max(0.0, 1.0 - abs(velocity) / self.noLoadSpeed)
+        needed = self.friction + self.damping * abs(velocity) + self.inertia * abs(acceleration)
+        if available <= 0:
+            return 0, True
+        noise = self.random.gauss(0, self.noise / 2.0 if filtered else self.noise)
+        value = 1023 * (1.0 - needed / available) + self.thresholdStep * threshold + noise
+        return int(max(0, min(1023, round(value)))), needed >= available
+
+
+# Example loads for the tube types of NMRShuttleSetup.py (stall guard settings
+# 1 = standard glass tube, 2 = 5 mm high pressure tube, 3 = 10 mm high pressure tube)
+TUBE_LOADS = {1: simulatedLoad(0.03, 0.3e-6, 2.4e-7),
+              2: simulatedLoad(0.05, 0.4e-6, 4e-7),
+              3: simulatedLoad(0.08, 0.6e-6, 8e-7)}
+
+
+
+class simulatedMotor(object):
+    # Emulates the module hardware and the NMR shuttle TMCL program
+
+    def __init__(self, model='TMCM-1160', upDelay=None, downDelay=None, tick=0.001):
+        self.model = model
+        self.tick = tick
+        self.lock = threading.RLock()
+
+        # Axis parameters and user variables (default values as shipped)
+        self.axis = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0, 5: 0, 6: 128, 7: 8,
+                     8: 1, 140: 8, 153: 7, 154: 3, 173: 0, 174: 0, 181: 0,
+                     206: 0, 207: 0}
+        self.userVariables = {}
+        self.inputs = {10: 1}     # SHUTDOWN input is high unless light gate is broken
+        self.output0 = 1
+
+        # Firmware state
+        self.position = 0.0       # actual position (microsteps)
+        self.origin = 0.0         # where actual position 0 is, from the starting position (microsteps)
+        self.velocity = 0.0       # actual velocity (microsteps/s)
+        self.moving = None        # 'up', 'down', 'position' or None
+        self.held = False         # upward move waiting for new settings
+        self.inError = False      # firmware waiting for the error flag to be cleared
+        self.interrupts = {39: False, 40: True}
+        self.stallLoad = None     # load value above which a stall is reported
+        self.load = None          # simulatedLoad, or None for a constant load value
+        self.acceleration = 0.0
+
+        # Automatic triggering, as if by the pulse program. Delays are the
+        # times (s) that the sample stays down/up before the next trigger.
+        self.upDelay = upDelay
+        self.downDelay = downDelay
+        self.parkedSince = time.time()
+        self.tickStart = time.time()
+        self.history = []
+
+        self.running = True
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    # Unit conversion between motor units and microsteps per second
+    def speedToPPS(self, speed):
+        if self.model == 'TMCM-1160':
+            return speed * 16e6 / (2**self.axis[154] * 2048 * 32)
+        return float(speed)
+
+    def accelToPPS2(self, accel):
+        if self.model == 'TMCM-1160':
+            return accel * (16e6)**2 / 2**(self.axis[153] + self.axis[154] + 29)
+        return float(accel)
+
+    def speedFromPPS(self, pps):
+        if self.model == 'TMCM-1160':
+            return pps * (2**self.axis[154] * 2048 * 32) / 16e6
+        return pps
+
+
+    def execute(self, opcode, opType, motorBank, value):
+        # Execute a single TMCL instruction and return the reply value
+        with self.lock:
+            if opcode == SAP:
+                self.axis[opType] = int(value)
+                if opType == 1:
+                    self._setActualPosition(value)
+            elif opcode == GAP:
+                if opType == 1:
+                    return int(round(self.position))
+                if opType == 3:
+                    return int(round(self.speedFromPPS(self.velocity)))
+                if opType == 8:
+                    return 1 if self.moving is None else 0
+                if opType == 207:
+                    flags = self.axis.get(207, 0)
+                    self.axis[207] = 0
+                    return flags
+                return self.axis.get(opType, 0)
+            elif opcode == SGP and motorBank == 2:
+                self.userVariables[opType] = int(value)
+            elif opcode == GGP and motorBank == 2:
+                return self.userVariables.get(opType, 0)
+            elif opcode == GGP and motorBank == 0 and opType == 132:
+                return self._tick()
+            elif opcode == GIO:
+                return self.inputs.get(opType, 0)
+            elif opcode == SIO:
+                self.output0 = int(value)
+            elif opcode == MVP:
+                self.axis[0] = int(value)
+                self.moving = 'position'
+            else:
+                raise ValueError("Unsupported TMCL instruction " + str(opcode))
+            return 0
+
+
+    # Inputs from the spectrometer and light gate
+    def triggerUp(self):
+        with self.lock:
+            if self.interrupts[40]:
+                self.interrupts[40] = False
+                self._startMove('up')
+
+    def triggerDown(self):
+        with self.lock:
+            if self.interrupts[39]:
+                self.interrupts[39] = False
+                self._startMove('down')
+
+    def breakLightGate(self):
+        with self.lock:
+            self.inputs[10] = 0
+
+
+    def physicalPosition(self):
+        # Position (microsteps) relative to the position at the start
+        with self.lock:
+            return self.position + self.origin
+
+
+    def _setActualPosition(self, value):
+        # SAP 1: only the position counter changes, not the sample position
+        self.origin += self.position - float(value)
+        self.position = float(value)
+
+
+    def _tick(self):
+        # Tick timer (global parameter 132), ms since start
+        return int((time.time() - self.tickStart) * 1000)
+
+
+    def _startMove(self, direction):
+        self.userVariables[TRIGGER_TICK] = self._tick()
+        self.output0 = 0
+        self.userVariables[POSITION] = 2
+        self.moving = direction
+        self._event()
+        self.held = direction == 'up' and not self._countUpMove()
+        if self.held:
+            self.userVariables[UP_PENDING] = 1
+        else:
+            self._beginMove(direction)
+
+
+    def _countUpMove(self):
+        # Returns False if the upward move must wait for new settings
+        moves = self.userVariables.get(UP_MOVES, 0)
+        if moves < 0:
+            return False
+        if moves > 0:
+            self.userVariables[UP_MOVES] = moves - 1 if moves > 1 else -1
+        return True
+
+
+    def _beginMove(self, direction):
+        length = self.userVariables.get(TABLE_LENGTH, 0)
+        if direction == 'up':
+            self.axis[0] = -self.userVariables.get(DIST, 0)
+            if length > 0:
+                self.axis[4] = self.userVariables.get(TABLE_SPEED, 0)
+                self.userVariables[TABLE_INDEX] = 1
+        else:
+            self.axis[0] = 0
+            if length > 0:
+                self.userVariables[TABLE_INDEX] = length - 1
+                self.axis[4] = self.userVariables.get(TABLE_SPEED + length - 1, 0)
+        self.history.append((time.time(), direction, 'start'))
+
+
+    def _walkTable(self):
+        # Change speed as the sample passes the positions in the speed table
+        length = self.userVariables.get(TABLE_LENGTH, 0)
+        if length == 0:
+            return
+        index = self.userVariables.get(TABLE_INDEX, 0)
+        if self.moving == 'up':
+            while index < length and self.position + self.userVariables.get(TABLE_POSITION + index, 0) <= 0:
+                self.axis[4] = self.userVariables.get(TABLE_SPEED + index, 0)
+                index += 1
+        elif self.moving == 'down':
+            while index > 0 and self.position + self.userVariables.get(TABLE_POSITION + index, 0) > 0:
+                index -= 1
+                self.axis[4] = self.userVariables.get(TABLE_SPEED + index, 0)
+        self.userVariables[TABLE_INDEX] = index
+
+
+    def _step(self, dt):
+        # Trapezoidal motion towards the target position
+        target = float(self.axis[0])
+        vmax = abs(self.speedToPPS(self.axis[4]))
+        amax = abs(self.accelToPPS2(self.axis[5])) or 1e9
+        remaining = target - self.position
+        direction = 1.0 if remaining > 0 else -1.0
+        desired = direction * min(vmax, (2 * amax * abs(remaining))**0.5)
+        change = max(-amax * dt, min(amax * dt, desired - self.velocity))
+        self.velocity += change
+        self.acceleration = change / dt if dt > 0 else 0.0
+        self.position += self.velocity * dt
+        if (target - self.position) * direction <= 0.5:
+            self.position = target
+            self.velocity = 0.0
+            return True
+        return False
+
+
+    def _finishMove(self):
+        self.userVariables[ARRIVAL_TICK] = self._tick()
+        if self.moving == 'up':
+            self.userVariables[POSITION] = 1
+            self.interrupts[39] = True
+        elif self.moving == 'down':
+            self.userVariables[POSITION] = 0
+            self.interrupts[40] = True
+        self._event()
+        self.history.append((time.time(), self.moving, 'end'))
+        self.moving = None
+        self.output0 = 1
+        self.parkedSince = time.time()
+
+
+    def _run(self):
+        last = time.time()
+        while self.running:
+            time.sleep(self.tick)
+            now = time.time()
+            dt = now - last
+            last = now
+            with self.lock:
+                # Error state: wait until error flag is cleared by host
+                if self.userVariables.get(ERRFLAG, 0) != 0:
+                    continue
+                if self.inError:
+                    self._reset()
+                if self.inputs.get(10, 1) == 0:
+                    self._error(1)
+                    continue
+                if self.stallLoad is not None and self.axis.get(206, 0) > self.stallLoad:
+                    self.axis[207] = 1
+                if self.axis.get(207, 0) != 0:
+                    self._error(2)
+                    continue
+
+                if self.held:
+                    if self.userVariables.get(UP_MOVES, 0) == CANCEL_HOLD:
+                        self._cancelHeld()
+                    elif self._countUpMove():
+                        self.held = False
+                        self.userVariables[UP_PENDING] = 0
+                        self._beginMove('up')
+                elif self.moving is not None:
+                    self._walkTable()
+                    finished = self._step(dt)
+                    if self.load is not None and self._checkLoad():
+                        continue
+                    if finished:
+                        self._finishMove()
+                else:
+                    self._autoTrigger(now)
+
+
+    def _checkLoad(self):
+        # Update the load value. Returns True if the motor stalled.
+        value, overload = self.load.value(self.velocity, self.acceleration, self.axis.get(6, 0),
+                                          self.axis.get(174, 0), self.axis.get(173, 0) != 0)
+        self.axis[206] = value
+        detect = self.axis.get(181, 0) > 0 and abs(self.speedFromPPS(self.velocity)) >= self.axis.get(181, 0)
+        if overload or (detect and value == 0):
+            self.axis[207] = 1
+            self._error(2)
+            return True
+        return False
+
+
+    def _autoTrigger(self, now):
+        # Send whichever trigger the firmware is waiting for
+        if self.interrupts[40] and self.downDelay is not None and now - self.parkedSince >= self.downDelay:
+            self.triggerUp()
+        elif self.interrupts[39] and self.upDelay is not None and now - self.parkedSince >= self.upDelay:
+            self.triggerDown()
+
+
+    def _event(self):
+        # Count state changes so that the host can detect them with one query
+        self.userVariables[EVENTS] = self.userVariables.get(EVENTS, 0) + 1
+
+
+    def _error(self, flag):
+        self.interrupts[39] = False
+        self.interrupts[40] = False
+        self.moving = None
+        self.held = False
+        self.velocity = 0.0
+        self.userVariables[ERRFLAG] = flag
+        self.inError = True
+        self._event()
+        self.history.append((time.time(), 'error', flag))
+
+
+    def _cancelHeld(self):
+        # Drop the held upward move, leaving the sample down
+        self.held = False
+        self.moving = None
+        self.userVariables[UP_PENDING] = 0
+        self.userVariables[POSITION] = 0
+        self._event()
+        self.output0 = 1
+        self.interrupts[40] = True
+        self.parkedSince = time.time()
+        self.history.append((time.time(), 'up', 'cancel'))
+
+
+    def _reset(self):
+        # Reset routine of the firmware, run once the host clears the error flag
+        self.inError = False
+        self.axis[207] = 0
+        for index in (DIST, POSITION, TABLE_LENGTH, UP_MOVES, UP_PENDING):
+            self.userVariables[index] = 0
+        self._setActualPosition(0)
+        self.interrupts[40] = True
+        self.parkedSince = time.time()
+        self.history.append((time.time(), 'reset', 0))
+
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+
+class simulatedSerial(object):
+    # Loopback serial port which decodes 9 byte TMCL request frames, executes
+    # them on the simulated motor and returns TMCL reply frames. Each write
+    # waits for replyDelay seconds (one round trip) however many frames it
+    # contains, as a USB transfer would.
+
+    def __init__(self, motor, replyDelay=0.002, hostID=2, moduleID=1):
+        self.motor = motor
+        self.replyDelay = replyDelay
+        self.hostID = hostID
+        self.moduleID = moduleID
+        self.buffer = bytearray()
+        self.writes = 0
+        self.commands = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.replyDelay:
+            time.sleep(self.replyDelay)
+        data = bytearray(data)
+        for start in range(0, len(data) - 8, 9):
+            frame = data[start:start + 9]
+            address, opcode, opType, motorBank, value = struct.unpack('>BBBBi', bytes(frame[:8]))
+            if sum(frame[:8]) & 0xFF != frame[8]:
+                status, value = 1, 0      # wrong checksum
+            else:
+                try:
+                    status, value = 100, self.motor.execute(opcode, opType, motorBank, value)
+                except ValueError:
+                    status, value = 2, 0  # invalid command
+            self.commands += 1
+            reply = bytearray(struct.pack('>BBBBi', self.hostID, self.moduleID, status, opcode, int(value)))
+            reply.append(sum(reply) & 0xFF)
+            self.buffer += reply
+        return len(data)
+
+    def read(self, size=1):
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    def close(self):
+        pass
+
+
+
+class simulatedInterface(object):
+    # Stands in for serial_tmcl_interface. Each instruction waits for
+    # replyDelay seconds to model the serial round trip. Raw TMCL frames can
+    # also be written to the loopback port in self.serial (see tmclBatch.py).
+
+    def __init__(self, model='TMCM-1160', replyDelay=0.002, upDelay=None, downDelay=None):
+        self.motor = simulatedMotor(model, upDelay=upDelay, downDelay=downDelay)
+        self.serial = simulatedSerial(self.motor, replyDelay)
+        self.replyDelay = replyDelay
+        self.commands = 0
+
+    def send(self, opcode, opType, motorBank, value):
+        self.commands += 1
+        if self.replyDelay:
+            time.sleep(self.replyDelay)
+        return self.motor.execute(opcode, opType, motorBank, value)
+
+    def close(self):
+        self.motor.stop()
+
+
+
+class simulatedTMCM(object):
+    # Same methods as PyTrinamic.modules.TMCM_1160
+
+    def __init__(self, interface, moduleID=1):
+        self.interface = interface
+        self.moduleID = moduleID
+
+    def setAxisParameter(self, commandType, value):
+        self.interface.send(SAP, commandType, 0, value)
+
+    def axisParameter(self, commandType):
+        return self.interface.send(GAP, commandType, 0, 0)
+
+    def setUserVariable(self, index, value):
+        self.interface.send(SGP, index, 2, value)
+
+    def userVariable(self, index):
+        return self.interface.send(GGP, index, 2, 0)
+
+    def getGlobalParameter(self, commandType, bank):
+        return self.interface.send(GGP, commandType, bank, 0)
+
+    def digitalInput(self, index):
+        return self.interface.send(GIO, index, 0, 0)
+
+    def moveToPosition(self, position):
+        self.interface.send(MVP, 0, 0, position)
+
+    def actualPosition(self):
+        return self.axisParameter(1)
+
+    def actualVelocity(self):
+        return self.axisParameter(3)
+
+    def setTargetSpeed(self, speed):
+        self.setAxisParameter(2, speed)
+
+    def setMaxVelocity(self, speed):
+        self.setAxisParameter(4, speed)
+
+    def setMaxAcceleration(self, accel):
+        self.setAxisParameter(5, accel)
+
+    def motorRunCurrent(self, current):
+        self.setAxisParameter(6, current)
+
+    def motorStandbyCurrent(self, current):
+        self.setAxisParameter(7, current)
+
+    def stallguard2Filter(self, value):
+        self.setAxisParameter(173, value)
+
+    def stallguard2Threshold(self, value):
+        self.setAxisParameter(174, value)
+
+    def stopOnStall(self, value):
+        self.setAxisParameter(181, value)
+
+    def statusFlags(self):
+        return self.axisParameter(207)
+
+
+
+if __name__ == '__main__':
+    # Run a single transit using a speed table and print the speed profile
+    import speedTable
+    myInterface = simulatedInterface()
+    module = simulatedTMCM(myInterface)
+    module.setMaxAcceleration(2000)
+    positions = [0, 20000, 40000, 80000]
+    speeds = [200, 600, 1200, 1800]
+    speedTable.uploadSpeedTable(module, positions, speeds)
+    module.setUserVariable(DIST, 100000)
+    myInterface.motor.triggerUp()
+    while module.userVariable(POSITION) != 1:
+        print('Position = ' + str(module.actualPosition()) + ', speed = ' + str(module.actualVelocity()))
+        time.sleep(0.1)
+    print('Sample UP. Commands sent: ' + str(myInterface.commands))
+    myInterface.close()
@@ -0,0 +1,195 @@
+#
+# trajectoryOptimizer.py
+# Version 1.0, Oct 2026
+#
+# Time-optimal sample motion for the velocity sweep mode of the NMR shuttle
+# (ramp equation "optimal").
+#
+# The sample speed is limited by the target speed, the acceleration and the
+# rate of change of the field seen by the sample, |dB/dt| = v * |dB/dz|,
+# which may be set lower near level anti-crossings (sweepRateLimit in
+# NMRShuttleSetup.py, in mT/s, a number or an equation in Bz or z). This
+# gives a speed limit at each position:
+#   vLimit(z) = min(speed, sweepRateLimit / |dB/dz|)
+# The fastest profile is found on a fine grid by a forward pass (accelerate
+# from rest at the magnet centre) and a backward pass (decelerate to rest at
+# the end of the move):
+#   v[i+1] = min(vLimit[i+1], sqrt(v[i]^2 + 2 * accel * dz))
+#   v[i]   = min(v[i], sqrt(v[i+1]^2 + 2 * accel * dz))
+#
+# The motor follows a speed table of at most 32 segments (see speedTable.py)
+# and only starts to slow down once the sample reaches the next segment. So
+# that the limit holds everywhere, the speed of each segment is the lowest
+# speed of the backward pass (without the stop at the end, which the motor
+# does itself) over the segment. The segment boundaries are chosen by dynamic
+# programming to give the shortest time.
+#
+# Usage:
+#   rateLimit = trajectoryOptimizer.sweepRateLimit(setup.sweepRateLimit, fieldMap)
+#   table = trajectoryOptimizer.optimalTable(distance, speed, accel, units, fieldMap, rateLimit)
+#   plan = motionPlanner.planMotion(distance, speed, accel, units, table=table, fieldMap=fieldMap)
+# or from the command line, to compare with the ramp in NMRShuttleSetup.py:
+#   python trajectoryOptimizer.py distance [speed accel]
+#
+
+import math, sys
+import numpy as np
+import speedTable
+import velocityRamp
+
+
+# Ramp equation which selects the time-optimal profile
+OPTIMAL = 'optimal'
+
+
+def isOptimal(ramp):
+    return str(ramp).strip().lower() == OPTIMAL
+
+
+def sweepRateLimit(expression, fieldMap):
+    # Maximum |dB/dt| (mT/s) at each position, as a function of z (cm).
+    # expression is a number or an equation in Bz or z (as for the velocity
+    # ramp). Returns None if expression is empty (no limit).
+    expression = str(expression).strip()
+    if expression == '':
+        return None
+    try:
+        value = float(expression)
+        return lambda z: np.full(np.shape(z), value)
+    except ValueError:
+        pass
+    try:
+        return velocityRamp.velocityRamp(expression, fieldMap)
+    except ValueError as err:
+        raise ValueError("Invalid sweep rate limit (sweepRateLimit): " + expression + "\n" + str(err))
+
+
+def speedLimit(z, speed, fieldMap, rateLimit=None):
+    # Highest allowed speed (cm/s) at each position of the grid z (cm). The
+    # field gradient at each point is the larger of those on either side.
+    z = np.asarray(z, dtype=float)
+    limit = np.full(len(z), float(speed))
+    if rateLimit is None:
+        return limit
+    slope = np.abs(np.diff(fieldMap.fieldAt(z)) / np.diff(z))
+    gradient = np.maximum(np.concatenate(([0.0], slope)), np.concatenate((slope, [0.0])))
+    with np.errstate(all='ignore'):
+        rate = np.asarray(rateLimit(z), dtype=float)
+    if not np.all(np.isfinite(rate)) or np.any(rate <= 0):
+        raise ValueError("Sweep rate limit must be positive and finite between 0 and " + str(round(z[-1],2)) + " cm.")
+    moving = gradient > 0
+    limit[moving] = np.minimum(limit[moving], rate[moving] / gradient[moving])
+    return limit
+
+
+def forwardBackward(z, limit, accel, start=True, stop=True):
+    # Fastest speed at each point of the grid z that keeps below limit with
+    # acceleration accel, from rest at the start and to rest at the end
+    v = np.array(limit, dtype=float)
+    dz = np.diff(z)
+    if start:
+        v[0] = 0.0
+        for i in range(len(dz)):
+            v[i+1] = min(v[i+1], math.sqrt(v[i]**2 + 2 * accel * dz[i]))
+    if stop:
+        v[-1] = 0.0
+    for i in range(len(dz) - 1, -1, -1):
+        v[i] = min(v[i], math.sqrt(v[i+1]**2 + 2 * accel * dz[i]))
+    return v
+
+
+def profileTime(z, v):
+    # Time (s) to follow the speed profile v over the grid z, with constant
+    # acceleration between grid points
+    speeds = v[:-1] + v[1:]
+    if np.any(speeds <= 0):
+        return float('inf')
+    return float(np.sum(2 * np.diff(z) / speeds))
+
+
+def _segments(zc, lowest, count):
+    # Boundaries (indices of zc) of at most count segments which give the
+    # shortest time at the lowest speed of each segment. lowest[i] is the
+    # lowest speed between zc[i] and zc[i+1].
+    n = len(zc)
+    cost = np.full((n, n), np.inf)
+    for j in range(n - 1):
+        cost[j, j+1:] = (zc[j+1:] - zc[j]) / np.minimum.accumulate(lowest[j:])
+    best = cost[0].copy()
+    previous = [np.zeros(n, dtype=int)]
+    for k in range(1, min(count, n - 1)):
+        total = best[:, None] + cost
+        previous.append(np.argmin(total, axis=0))
+        best = total[previous[-1], np.arange(n)]
+    edges = [n - 1]
+    for k in range(len(previous) - 1, 0, -1):
+        edges.append(int(previous[k][edges[-1]]))
+    edges.append(0)
+    return sorted(set(edges))
+
+
+def optimalTable(distance, speed, accel, units, fieldMap, rateLimit=None, maxSpeed=None,
+                 segments=speedTable.TABLE_MAX, points=2001, candidates=256):
+    # Speed table (positions in steps, speeds in motor units) for the fastest
+    # move of distance (cm) within the speed, acceleration and sweep rate
+    # limits. accel is rounded to motor units as in motionPlanner.planMotion().
+    accel = units.accelFromMotor(units.accelToMotor(accel))
+    if accel <= 0:
+        raise ValueError("Acceleration is too low for the motor (CNST31).")
+    if maxSpeed is not None:
+        speed = min(speed, maxSpeed)
+    z = np.linspace(0, distance, points)
+    envelope = forwardBackward(z, speedLimit(z, speed, fieldMap, rateLimit), accel, start=False, stop=False)
+
+    # Lowest speed in each interval between candidate boundaries
+    step = max(1, (points - 1) // candidates)
+    index = np.arange(0, points, step)
+    if index[-1] != points - 1:
+        index = np.append(index, points - 1)
+    lowest = np.array([envelope[index[i]:index[i+1] + 1].min() for i in range(len(index) - 1)])
+    edges = _segments(z[index], lowest, segments)
+
+    positions = []
+    speeds = []
+    for j, k in zip(edges[:-1], edges[1:]):
+        position = units.steps(z[index[j]])
+        motorSpeed = max(1, units.speedToMotor(lowest[j:k].min()))
+        if len(positions) > 0 and position <= positions[-1]:
+            speeds[-1] = min(speeds[-1], motorSpeed)
+            continue
+        positions.append(position)
+        speeds.append(motorSpeed)
+    return positions, speeds
+
+
+
+if __name__ == '__main__':
+    # Compare the optimal profile with the ramp and settings in NMRShuttleSetup.py
+    import NMRShuttleSetup
+    import fieldMapTable
+    import motionPlanner
+    setup = NMRShuttleSetup.NMRShuttle()
+    distance = float(sys.argv[1])
+    speed = float(sys.argv[2]) if len(sys.argv) > 2 else setup.speed
+    accel = float(sys.argv[3]) if len(sys.argv) > 3 else setup.accel
+    units = motionPlanner.motorUnits(setup.model, setup.circ, setup.fullStepRot, pulseDiv=setup.pulDiv, rampDiv=setup.rampDiv)
+    fieldMap = fieldMapTable.load('fieldMap.csv')
+    rateLimit = sweepRateLimit(setup.sweepRateLimit, fieldMap)
+
+    z = np.linspace(0, distance, 2001)
+    ideal = forwardBackward(z, speedLimit(z, min(speed, setup.maxSpeed), fieldMap, rateLimit), accel)
+    table = optimalTable(distance, speed, accel, units, fieldMap, rateLimit, maxSpeed=setup.maxSpeed)
+    plan = motionPlanner.planMotion(distance, speed, accel, units, maxSpeed=setup.maxSpeed, table=table, fieldMap=fieldMap)
+    print("Optimal profile: " + str(round(profileTime(z, ideal),3)) + " s")
+    print("Optimal speed table (" + str(len(table[0])) + " entries): " + str(round(plan.motionTime,3)) + " s")
+    if not isOptimal(setup.ramp):
+        rampPlan = motionPlanner.planMotion(distance, speed, accel, units, maxSpeed=setup.maxSpeed, ramp=velocityRamp.velocityRamp(setup.ramp, fieldMap), fieldMap=fieldMap)
+        print("Ramp " + setup.ramp + ": " + str(round(rampPlan.motionTime,3)) + " s")
+    if rateLimit is not None:
+        # Phases share their end points, so skip intervals of zero length
+        dt = np.diff(plan.t)
+        moving = dt > 0
+        dBdt = np.abs(np.diff(plan.B))[moving] / dt[moving]
+        middle = 0.5 * (plan.z[:-1] + plan.z[1:])[moving]
+        print("Largest |dB/dt| / limit along the table trajectory: " + str(round(float(np.max(dBdt / rateLimit(middle))),3)))
+    plan.save('shuttleTrajectory.csv')
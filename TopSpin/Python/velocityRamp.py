@@ -0,0 +1,114 @@
+#
+# velocityRamp.py
+# Version 1.0, Oct 2026
+#
+# Compiled velocity ramp for the velocity sweep mode of the NMR shuttle.
+#
+# The ramp equation (USERA1 or NMRShuttleSetup.NMRShuttle.ramp) is parsed and
+# checked once when the ramp is created, then compiled to a code object. The
+# local field strength Bz is taken from the measured field map (see
+# fieldMapTable.py) rather than an analytic fit. The compiled ramp is
+# evaluated over whole arrays of positions at once with NumPy, or for a single
+# position with the math module.
+#
+
+import ast, math
+import numpy as np
+
+
+# Names that may appear in a ramp equation. 'currField' and 'currPosition' are
+# accepted as aliases for 'Bz' and 'z' for compatibility with older equations.
+FIELD_NAMES = ('Bz', 'currField')
+POSITION_NAMES = ('z', 'currPosition')
+FUNCTION_NAMES = ('abs', 'min', 'max')
+
+# Functions and constants from the math module that may be used in a ramp
+MATH_NAMES = ('exp', 'log', 'log10', 'sqrt', 'pow', 'fabs', 'floor', 'ceil',
+              'sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'sinh', 'cosh',
+              'tanh', 'pi', 'e')
+
+
+class _arrayMath(object):
+    # Stand-in for the math module which operates on NumPy arrays
+    def __init__(self):
+        for name in MATH_NAMES:
+            setattr(self, name, getattr(np, name, None))
+        self.pow = np.power
+        self.fabs = np.abs
+        self.asin = np.arcsin
+        self.acos = np.arccos
+        self.atan = np.arctan
+
+
+class velocityRamp(object):
+
+    def __init__(self, expression, fieldMap):
+        self.expression = str(expression).strip()
+        self.fieldMap = fieldMap
+
+        # Parse the equation and check that it only uses allowed names
+        try:
+            tree = ast.parse(self.expression, mode='eval')
+        except SyntaxError:
+            raise ValueError("Invalid equation for velocity sweep ramp: " + self.expression)
+        names = self._checkNames(tree)
+        self.usesField = len(names.intersection(FIELD_NAMES)) > 0
+        self.usesPosition = len(names.intersection(POSITION_NAMES)) > 0
+        if not (self.usesField or self.usesPosition):
+            raise ValueError("Invalid equation for velocity sweep ramp.\nEquation must be expressed in terms of sample position (z) or local field strength (Bz).")
+        self.code = compile(tree, '<ramp>', 'eval')
+
+        # Namespaces used to evaluate the compiled equation
+        self.scalarNamespace = {'__builtins__': {}, 'math': math,
+                                'abs': abs, 'min': min, 'max': max}
+        self.arrayNamespace = {'__builtins__': {}, 'math': _arrayMath(),
+                               'abs': np.abs, 'min': np.minimum, 'max': np.maximum}
+
+
+    def _checkNames(self, tree):
+        # Walk the syntax tree and reject anything that is not a plain
+        # arithmetic expression of the allowed variables and functions.
+        names = set()
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.Lambda, ast.ListComp, ast.GeneratorExp, ast.DictComp,
+                                 ast.SetComp, ast.Subscript, ast.Dict, ast.List, ast.Tuple)):
+                raise ValueError("Invalid equation for velocity sweep ramp: " + self.expression)
+            if isinstance(node, ast.Attribute):
+                if not (isinstance(node.value, ast.Name) and node.value.id == 'math' and node.attr in MATH_NAMES):
+                    raise ValueError("Unknown function '" + getattr(node, 'attr', '') + "' in velocity sweep ramp.")
+            elif isinstance(node, ast.Name):
+                if node.id not in FIELD_NAMES + POSITION_NAMES + FUNCTION_NAMES + ('math',):
+                    raise ValueError("Unknown variable '" + node.id + "' in velocity sweep ramp.")
+                names.add(node.id)
+        return names
+
+
+    def evaluate(self, z, Bz):
+        # Evaluate the ramp for given position (cm) and field strength (mT).
+        # Returns the speed as a fraction of the target speed.
+        if isinstance(z, np.ndarray) or isinstance(Bz, np.ndarray):
+            namespace = self.arrayNamespace
+        else:
+            namespace = self.scalarNamespace
+        variables = {'z': z, 'currPosition': z, 'Bz': Bz, 'currField': Bz}
+        return eval(self.code, namespace, variables)
+
+
+    def __call__(self, z):
+        # Speed fraction at distance z (cm), using the field map for Bz
+        if not isinstance(z, (np.ndarray, int, float)):
+            z = np.asarray(z, dtype=float)
+        Bz = self.fieldMap.fieldAt(z) if self.usesField else 0.0
+        value = self.evaluate(z, Bz)
+        if isinstance(z, np.ndarray):
+            return np.broadcast_to(value, z.shape).astype(float)
+        return float(value)
+
+
+    def validate(self, distance, points=201):
+        # Evaluate the ramp over the whole distance of travel and make sure
+        # that it gives a positive, finite speed everywhere.
+        with np.errstate(all='ignore'):
+            values = self(np.linspace(0, distance, points))
+        if not (np.isfinite(values) & (values > 0)).all():
+            raise ValueError("Velocity sweep ramp must give a positive, finite speed between 0 and " + str(round(distance,2)) + " cm: " + self.expression)